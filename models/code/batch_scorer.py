@@ -0,0 +1,193 @@
+# In file: batch_scorer.py
+
+import os
+import numpy as np
+import pandas as pd
+from sklearn.metrics import classification_report, accuracy_score
+
+from processing_pipeline import iter_processed_files, process_single_subject
+from recording_store import resolve_raw_files, describe_source
+from model_backends import load_backend, STAGE_LABELS, STAGE_INDICES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+    print("pyarrow not installed, batch scores will be written as CSV. Install with: pip install pyarrow")
+
+PROBABILITY_COLUMNS = [f"prob_{label.lower()}" for label in STAGE_LABELS]
+
+class ScoreWriter:
+    """
+    Appends per-epoch score tables to one Parquet file (or CSV without pyarrow),
+    so the output never has to be held in memory.
+    """
+    def __init__(self, output_path: str):
+        if not PYARROW_AVAILABLE and output_path.endswith('.parquet'):
+            output_path = output_path[:-len('.parquet')] + '.csv'
+        self.output_path = output_path
+        self.writer = None
+        self.rows_written = 0
+
+    def write(self, scores_df: pd.DataFrame) -> None:
+        if PYARROW_AVAILABLE and self.output_path.endswith('.parquet'):
+            table = pa.Table.from_pandas(scores_df, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.output_path, table.schema)
+            self.writer.write_table(table)
+        else:
+            scores_df.to_csv(self.output_path, mode='a' if self.rows_written else 'w',
+                             header=not self.rows_written, index=False)
+        self.rows_written += len(scores_df)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def save_hypnogram(scores_df: pd.DataFrame, recording: str, plot_path: str) -> None:
+    """
+    Renders actual vs predicted stages to an image without pyplot,
+    so it never opens a window or blocks.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(15, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    if scores_df['true_stage'].notna().any():
+        ax.plot(scores_df['epoch'], scores_df['true_stage'], label='Actual Stage', color='blue',
+                alpha=0.7, drawstyle='steps-post')
+    ax.plot(scores_df['epoch'], scores_df['predicted_stage'], label='Predicted Stage', color='red',
+            alpha=0.6, linestyle='--', drawstyle='steps-post')
+    ax.set_yticks(STAGE_INDICES)
+    ax.set_yticklabels(STAGE_LABELS)
+    ax.set_xlabel('Epoch (30-second intervals)')
+    ax.set_ylabel('Sleep Stage')
+    ax.set_title(f'Sleep Stage Prediction for {recording}')
+    ax.legend()
+    ax.invert_yaxis()
+    fig.tight_layout()
+    fig.savefig(plot_path)
+
+def score_recordings(data_source, model_path: str, output_path: str, stats_path: str = None,
+                     process_fn=process_single_subject, n_workers: int = 1, batch_rows: int = 100_000,
+                     cache=None, plot_dir: str = None) -> dict:
+    """
+    Scores an archive of recordings headlessly.
+
+    Recordings are featurized in parallel worker processes and queued until
+    batch_rows epochs are waiting; the whole batch is then normalized and sent
+    through the model in one call. Per-epoch predictions and probabilities are
+    appended to a columnar output file as each batch finishes.
+
+    Args:
+        data_source: Folder of CSVs, a recording store, or a list of recording paths.
+        model_path (str): A .pkl bundle, a compiled .npz or an .onnx model.
+        output_path (str): Output .parquet file (.csv if pyarrow is missing).
+        stats_path (str): Stats JSON for an ONNX model, if not next to it.
+        process_fn: Featurization matching the model: process_single_subject for the
+                    offline models, process_subject_live_simulation_batch for the live ones.
+        n_workers (int): Worker processes for featurization. None uses all cores.
+        batch_rows (int): Epochs collected before running the model.
+        cache (SubjectCache): Optional cache of processed subjects.
+        plot_dir (str): If set, a hypnogram PNG is saved here for each recording.
+
+    Returns:
+        A dict with per-recording accuracy and the overall accuracy (None without labels).
+    """
+    # 1. Load the model once
+    backend = load_backend(model_path, stats_path)
+    print(f"Loaded {os.path.basename(model_path)} with {len(backend.features)} features")
+
+    file_paths = resolve_raw_files(data_source)
+    print(f"Scoring {len(file_paths)} recordings from {describe_source(data_source)}...")
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+
+    writer = ScoreWriter(output_path)
+    pending = []
+    pending_rows = 0
+    summary = {'recordings': {}, 'failed': []}
+    all_true, all_pred = [], []
+
+    def flush():
+        # 2. One normalization and one model call for the whole batch
+        X = np.concatenate([backend.stats.feature_matrix(df) for _, df in pending])
+        probabilities = backend.predict_proba(X)
+        predictions = np.argmax(probabilities, axis=1).astype(np.int8)
+
+        start = 0
+        for file_path, processed_df in pending:
+            stop = start + len(processed_df)
+            recording = os.path.basename(file_path)
+            if 'sleep_stage' in processed_df:
+                true_stage = processed_df['sleep_stage'].to_numpy(dtype=np.float32)
+            else:
+                true_stage = np.full(stop - start, np.nan, dtype=np.float32)
+
+            scores_df = pd.DataFrame({
+                'recording': recording,
+                'epoch': processed_df.index.to_numpy(),
+                'true_stage': true_stage,
+                'predicted_stage': predictions[start:stop],
+                **{column: probabilities[start:stop, i] for i, column in enumerate(PROBABILITY_COLUMNS)}
+            })
+            writer.write(scores_df)
+
+            # 3. Per-recording summary and optional plot
+            labelled = ~np.isnan(true_stage)
+            accuracy = float(np.mean(true_stage[labelled] == predictions[start:stop][labelled])) if labelled.any() else None
+            summary['recordings'][recording] = accuracy
+            all_true.append(true_stage[labelled])
+            all_pred.append(predictions[start:stop][labelled])
+            accuracy_text = f", accuracy {accuracy:.3f}" if accuracy is not None else ""
+            print(f"  - Scored {recording} ({len(processed_df)} epochs{accuracy_text})")
+            if plot_dir:
+                save_hypnogram(scores_df, recording, os.path.join(plot_dir, f"{os.path.splitext(recording)[0]}.png"))
+            start = stop
+
+        pending.clear()
+
+    try:
+        for file_path, processed_df, error in iter_processed_files(file_paths, process_fn, n_workers, cache):
+            if error is not None:
+                print(f"  ❌ Failed to process {os.path.basename(file_path)}: {str(error)}")
+                summary['failed'].append(os.path.basename(file_path))
+                continue
+            if processed_df.empty:
+                print(f"  ⚠️ Not enough data in {os.path.basename(file_path)} to score. Skipping.")
+                continue
+            pending.append((file_path, processed_df))
+            pending_rows += len(processed_df)
+            if pending_rows >= batch_rows:
+                flush()
+                pending_rows = 0
+        if pending:
+            flush()
+    finally:
+        writer.close()
+
+    # 4. Overall report
+    y_true = np.concatenate(all_true) if all_true else np.array([])
+    y_pred = np.concatenate(all_pred) if all_pred else np.array([])
+    summary['accuracy'] = accuracy_score(y_true, y_pred) if len(y_true) else None
+    print(f"\n✅ Wrote {writer.rows_written} epoch scores to {writer.output_path}")
+    if len(y_true):
+        print("Overall Accuracy:", summary['accuracy'])
+        print(classification_report(y_true.astype(int), y_pred, target_names=STAGE_LABELS,
+                                    labels=STAGE_INDICES, zero_division=0))
+    if summary['failed']:
+        print(f"Warning: {len(summary['failed'])} file(s) could not be processed: {summary['failed']}")
+    return summary
+
+if __name__ == '__main__':
+    DATA_FOLDER = './exp-csv'
+    MODEL_PATH = './xgboost_sleep_model7.pkl'  # or an .onnx model with its _stats.json
+    OUTPUT_PATH = './scores.parquet'
+    PLOT_DIR = None  # e.g. './score_plots'
+
+    score_recordings(DATA_FOLDER, MODEL_PATH, OUTPUT_PATH, n_workers=os.cpu_count(), plot_dir=PLOT_DIR)
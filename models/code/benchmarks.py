@@ -0,0 +1,357 @@
+# In file: benchmarks.py
+
+import time
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+from label_processor import remap_sleep_stages
+from feature_engineering import create_30s_epochs
+from temporal_features import add_temporal_features
+from data_loader import load_raw_csv, PYARROW_CSV_AVAILABLE
+from recording_store import convert_csv_folder, RecordingStore
+from processing_pipeline import process_subject_live_simulation_batch
+from model_backends import NormalizationStats, FeatureVectorAssembler
+
+SHIPPED_ONNX_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model', 'lightgbm_live_model3.onnx')
+
+def make_synthetic_recording(hours: float = 8.0, random_state: int = 42) -> pd.DataFrame:
+    """
+    Creates a raw 5-second recording with the same columns as the real CSVs.
+
+    Args:
+        hours (float): Length of the recording.
+        random_state (int): A random seed for reproducibility.
+
+    Returns:
+        A DataFrame with timestamp, heart_rate, motion_x/y/z and sleep_stage.
+    """
+    rng = np.random.default_rng(random_state)
+    num_samples = int(hours * 3600 / 5)
+    
+    # Stages change every 5 minutes on average, starting awake
+    stage_blocks = rng.choice([0, 1, 2, 3, 5], size=num_samples // 60 + 1, p=[0.2, 0.3, 0.2, 0.1, 0.2])
+    stage_blocks[0] = 0
+    sleep_stage = np.repeat(stage_blocks, 60)[:num_samples]
+    
+    heart_rate = 62 + 6 * np.sin(np.arange(num_samples) / 500) + rng.normal(0, 2, num_samples)
+    
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01 22:00', periods=num_samples, freq='5s').astype(str),
+        'heart_rate': np.round(heart_rate, 1),
+        'motion_x': rng.normal(0, 0.02, num_samples),
+        'motion_y': rng.normal(0, 0.02, num_samples),
+        'motion_z': rng.normal(0, 0.02, num_samples),
+        'sleep_stage': sleep_stage
+    })
+
+def time_call(func, *args, repeats: int = 3, **kwargs) -> float:
+    """Returns the best wall-clock time of several calls, in seconds"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmark_temporal_features(hours: float = 24 * 7):
+    """
+    Compares the column-by-column add_temporal_features with the vectorized
+    builder on one long recording (a week of data by default).
+    """
+    epoch_df = create_30s_epochs(remap_sleep_stages(make_synthetic_recording(hours)))
+    print(f"\n--- add_temporal_features on {len(epoch_df)} epochs ({hours:.0f} h) ---")
+    
+    loop_time = time_call(lambda: add_temporal_features(epoch_df.copy(), vectorized=False))
+    vectorized_time = time_call(lambda: add_temporal_features(epoch_df.copy(), vectorized=True))
+    
+    identical = add_temporal_features(epoch_df.copy(), vectorized=False).equals(
+        add_temporal_features(epoch_df.copy(), vectorized=True))
+    
+    print(f"  Column by column: {loop_time * 1000:.1f} ms")
+    print(f"  Vectorized:       {vectorized_time * 1000:.1f} ms ({loop_time / vectorized_time:.1f}x)")
+    print(f"  Identical output: {identical}")
+
+def benchmark_csv_loading(hours: float = 24 * 7):
+    """
+    Compares a plain pd.read_csv of a raw recording with the typed, column-pruned loader.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'recording.csv')
+        make_synthetic_recording(hours).to_csv(file_path, index=False)
+        print(f"\n--- Raw CSV loading ({hours:.0f} h, {os.path.getsize(file_path) / 1e6:.1f} MB) ---")
+        
+        plain_time = time_call(pd.read_csv, file_path)
+        c_time = time_call(load_raw_csv, file_path, engine='c')
+        print(f"  pd.read_csv:            {plain_time * 1000:.1f} ms")
+        print(f"  load_raw_csv (C):       {c_time * 1000:.1f} ms ({plain_time / c_time:.1f}x)")
+        if PYARROW_CSV_AVAILABLE:
+            arrow_time = time_call(load_raw_csv, file_path, engine='pyarrow')
+            print(f"  load_raw_csv (pyarrow): {arrow_time * 1000:.1f} ms ({plain_time / arrow_time:.1f}x)")
+        
+        plain_bytes = pd.read_csv(file_path).memory_usage(deep=True).sum()
+        typed_bytes = load_raw_csv(file_path).memory_usage(deep=True).sum()
+        print(f"  Memory: {plain_bytes / 1e6:.1f} MB -> {typed_bytes / 1e6:.1f} MB")
+
+def benchmark_recording_store(nights: int = 50, hours: float = 8.0):
+    """
+    Compares loading an archive of raw nights from CSV with opening the converted memory-mapped store.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_dir = os.path.join(tmp_dir, 'csv')
+        store_dir = os.path.join(tmp_dir, 'store')
+        os.makedirs(csv_dir)
+        for night in range(nights):
+            make_synthetic_recording(hours, random_state=night).to_csv(os.path.join(csv_dir, f"night{night:03d}.csv"), index=False)
+        print(f"\n--- Archive of {nights} nights ({hours:.0f} h each) ---")
+        
+        def load_all_csv():
+            return [load_raw_csv(os.path.join(csv_dir, f)) for f in sorted(os.listdir(csv_dir))]
+        
+        def load_all_store():
+            store = RecordingStore(store_dir)
+            return [store.frame(name) for name in store.names]
+        
+        convert_time = time_call(convert_csv_folder, csv_dir, store_dir, repeats=1)
+        csv_time = time_call(load_all_csv)
+        store_time = time_call(load_all_store)
+        print(f"  One-time conversion: {convert_time * 1000:.1f} ms")
+        print(f"  load_raw_csv, all nights: {csv_time * 1000:.1f} ms")
+        print(f"  Store open + all frames:  {store_time * 1000:.1f} ms ({csv_time / store_time:.0f}x)")
+
+def benchmark_feature_assembly(repeats: int = 2000):
+    """
+    Compares the per-epoch pandas reindex/normalize/reshape with the FeatureVectorAssembler.
+    """
+    processed_df = process_subject_live_simulation_batch(make_synthetic_recording(8))
+    features = [column for column in processed_df.columns if column != 'sleep_stage']
+    mean_stats = processed_df[features].mean()
+    std_stats = processed_df[features].std()
+    epoch = processed_df.iloc[[len(processed_df) // 2]]
+    print(f"\n--- Model input assembly for one epoch ({len(features)} features) ---")
+    
+    def pandas_assembly():
+        X_epoch = epoch.drop('sleep_stage', axis=1).reindex(columns=features, fill_value=0)
+        X_epoch_normalized = (X_epoch - mean_stats) / (std_stats + 1e-6)
+        zero_std_mask = std_stats < 1e-6
+        if zero_std_mask.any():
+            X_epoch_normalized.loc[:, zero_std_mask] = 0
+        return X_epoch_normalized.astype(np.float32).values.reshape(1, -1)
+    
+    assembler = FeatureVectorAssembler(NormalizationStats(features, mean_stats, std_stats))
+    epoch_dict = epoch.iloc[0].to_dict()
+    
+    def per_call(func, *args):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func(*args)
+        return (time.perf_counter() - start) / repeats
+    
+    pandas_time = per_call(pandas_assembly)
+    frame_time = per_call(assembler.assemble_frame, epoch)
+    dict_time = per_call(assembler.assemble, epoch_dict)
+    print(f"  pandas:                    {pandas_time * 1e6:.1f} us")
+    print(f"  assemble_frame (1-row df): {frame_time * 1e6:.1f} us ({pandas_time / frame_time:.0f}x)")
+    print(f"  assemble (dict):           {dict_time * 1e6:.1f} us ({pandas_time / dict_time:.0f}x)")
+    print(f"  Identical output: {np.array_equal(pandas_assembly(), assembler.assemble_frame(epoch))}")
+
+def benchmark_onnx_sessions(onnx_path: str = SHIPPED_ONNX_MODEL, batch_rows: int = 10_000, repeats: int = 500):
+    """
+    Compares ONNX Runtime start-up and per-call latency for default sessions,
+    tuned sessions, the optimized-model cache and an ORT-format model.
+    """
+    import onnxruntime as ort
+    from onnx_sessions import create_session, convert_to_ort_format
+    from model_backends import probabilities_from_onnx
+
+    print(f"\n--- ONNX Runtime sessions ({os.path.basename(onnx_path)}) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, 'cache')
+        ort_path = os.path.join(tmp, 'model.ort')
+        create_session(onnx_path, cache_dir=cache_dir)  # Fill the cache
+        convert_to_ort_format(onnx_path, ort_path)
+
+        # 1. Cold start
+        def load_time(factory, loads: int = 20):
+            start = time.perf_counter()
+            for _ in range(loads):
+                factory()
+            return (time.perf_counter() - start) / loads
+
+        default_load = load_time(lambda: ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']))
+        cached_load = load_time(lambda: create_session(onnx_path, cache_dir=cache_dir))
+        ort_load = load_time(lambda: create_session(ort_path))
+        print(f"  Load, default session:  {default_load * 1e3:.1f} ms")
+        print(f"  Load, optimized cache:  {cached_load * 1e3:.1f} ms ({default_load / cached_load:.1f}x)")
+        print(f"  Load, ORT format:       {ort_load * 1e3:.1f} ms ({default_load / ort_load:.1f}x)")
+
+        # 2. Per-epoch latency and batch throughput
+        default_session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        live_session = create_session(onnx_path, cache_dir=cache_dir)
+        batch_session = create_session(onnx_path, intra_op_threads=0, cache_dir=cache_dir)
+        input_name = default_session.get_inputs()[0].name
+        probability_name = default_session.get_outputs()[1].name
+        num_features = default_session.get_inputs()[0].shape[1]
+        rng = np.random.default_rng(0)
+        X_batch = rng.standard_normal((batch_rows, num_features)).astype(np.float32)
+        x_epoch = X_batch[:1]
+
+        def per_call(session, X, calls):
+            session.run([probability_name], {input_name: X})
+            start = time.perf_counter()
+            for _ in range(calls):
+                session.run([probability_name], {input_name: X})
+            return (time.perf_counter() - start) / calls
+
+        default_epoch = per_call(default_session, x_epoch, repeats)
+        live_epoch = per_call(live_session, x_epoch, repeats)
+        print(f"  One epoch, default session:     {default_epoch * 1e6:.0f} us")
+        print(f"  One epoch, 1 thread + cache:    {live_epoch * 1e6:.0f} us ({default_epoch / live_epoch:.1f}x)")
+        default_batch = per_call(default_session, X_batch, 5)
+        tuned_batch = per_call(batch_session, X_batch, 5)
+        print(f"  {batch_rows} epochs, default session: {default_batch * 1e3:.1f} ms")
+        print(f"  {batch_rows} epochs, batch preset:    {tuned_batch * 1e3:.1f} ms")
+
+        reference = probabilities_from_onnx(default_session.run([probability_name], {input_name: X_batch})[0])
+        cached = probabilities_from_onnx(live_session.run([probability_name], {input_name: X_batch})[0])
+        print(f"  Identical probabilities from the cached model: {np.array_equal(reference, cached)}")
+
+def benchmark_compiled_trees(model_name: str = 'lightgbm', batch_rows: int = 10_000, repeats: int = 200):
+    """
+    Compares the library's predict_proba with the compiled NumPy ensemble, for one epoch and a batch.
+    """
+    from model_definitions import get_model
+    from tree_compiler import compile_model, check_parity
+
+    processed_df = process_subject_live_simulation_batch(make_synthetic_recording(24))
+    features = [column for column in processed_df.columns if column != 'sleep_stage']
+    X_df = processed_df[features]
+    model = get_model(model_name).fit(X_df, processed_df['sleep_stage'])
+    ensemble = compile_model(model)
+    print(f"\n--- Compiled {model_name} ({ensemble.num_trees} trees, depth {ensemble.max_depth}) ---")
+
+    rng = np.random.default_rng(0)
+    X_batch = X_df.to_numpy()[rng.integers(0, len(X_df), batch_rows)]
+    X_batch_df = pd.DataFrame(X_batch, columns=features)
+    X_epoch_df = X_batch_df.iloc[:1]
+
+    def per_call(func, X, calls):
+        func(X)
+        start = time.perf_counter()
+        for _ in range(calls):
+            func(X)
+        return (time.perf_counter() - start) / calls
+
+    library_epoch = per_call(model.predict_proba, X_epoch_df, repeats)
+    compiled_epoch = per_call(ensemble.predict_proba, X_batch[:1], repeats)
+    library_batch = per_call(model.predict_proba, X_batch_df, 3)
+    compiled_batch = per_call(ensemble.predict_proba, X_batch, 3)
+    print(f"  One epoch, {type(model).__name__}: {library_epoch * 1e6:.0f} us")
+    print(f"  One epoch, compiled:          {compiled_epoch * 1e6:.0f} us ({library_epoch / compiled_epoch:.1f}x)")
+    print(f"  {batch_rows} epochs, library:       {library_batch * 1e3:.1f} ms")
+    print(f"  {batch_rows} epochs, compiled:      {compiled_batch * 1e3:.1f} ms")
+    print(f"  Parity: {check_parity(model, ensemble, X_batch)}")
+
+def benchmark_inference_service(num_sessions: int = 2000, epochs_per_session: int = 10,
+                                onnx_path: str = SHIPPED_ONNX_MODEL):
+    """
+    Load test of the multi-session service: synthetic sessions pushing samples as fast
+    as they can, with one model call per epoch versus cross-session micro-batching.
+    """
+    import asyncio
+    from inference_service import InferenceService, run_synthetic_sessions
+
+    recording = make_synthetic_recording(8)[['heart_rate', 'motion_x', 'motion_y', 'motion_z']].to_numpy()
+    print(f"\n--- Inference service: {num_sessions} sessions x {epochs_per_session} epochs ---")
+
+    async def load_test(max_batch, max_delay):
+        service = InferenceService(onnx_path, max_batch=max_batch, max_delay=max_delay)
+        await service.start()
+        seconds = await run_synthetic_sessions(service, recording, num_sessions, epochs_per_session)
+        await service.stop()
+        return seconds, service.summary()
+
+    for max_batch, max_delay in [(1, 0.0), (64, 0.005), (512, 0.02)]:
+        seconds, summary = asyncio.run(load_test(max_batch, max_delay))
+        print(f"  max_batch={max_batch:<4} max_delay={max_delay * 1000:.0f} ms: "
+              f"{summary['epochs'] / seconds:,.0f} epochs/s, mean batch {summary['mean_batch']:.0f}, "
+              f"latency p50 {summary['p50_ms']:.1f} ms / p99 {summary['p99_ms']:.1f} ms")
+
+def benchmark_streaming_stager(hours: float = 8.0, onnx_path: str = SHIPPED_ONNX_MODEL):
+    """
+    Replays a synthetic night through the headless StreamingSleepStager at full speed.
+    """
+    from streaming_stager import replay_csv
+
+    print(f"\n--- StreamingSleepStager replay ({hours:g} h) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'night.csv')
+        make_synthetic_recording(hours).to_csv(csv_path, index=False)
+        replay_csv(onnx_path, csv_path)
+
+def benchmark_hypnogram_rendering(hours: float = 8.0):
+    """
+    Render time per epoch of the live hypnogram over a night, redrawing after every
+    epoch: the old full redraw (clear, re-plot everything, draw) versus LiveHypnogram.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from hypnogram_plot import LiveHypnogram, STAGE_COLORS, STAGE_TICK_LABELS
+
+    num_epochs = int(hours * 3600 / 30)
+    rng = np.random.default_rng(42)
+    stages = np.repeat(rng.integers(0, 4, size=num_epochs // 10 + 1), 10)[:num_epochs]
+    predictions = np.where(rng.random(num_epochs) < 0.8, stages, rng.integers(0, 4, size=num_epochs))
+    print(f"\n--- Hypnogram rendering: {num_epochs} epochs ({hours:g} h), one redraw per epoch ---")
+
+    def full_redraw(ax, canvas, epoch):
+        ax.clear()
+        actual_times = [t for t in range(0, num_epochs * 30, 30) if t <= epoch * 30]
+        ax.plot(actual_times, stages[:len(actual_times)], label='Actual Stage', color='blue', alpha=0.3,
+                linewidth=2, drawstyle='steps-post')
+        time_seconds = [t * 30 for t in range(epoch + 1)]
+        colors = [STAGE_COLORS[int(p)] for p in predictions[:epoch + 1]]
+        ax.scatter(time_seconds, predictions[:epoch + 1], c=colors, s=50, alpha=0.7, label='Predicted')
+        ax.plot(time_seconds, predictions[:epoch + 1], 'gray', alpha=0.3, linewidth=1)
+        ax.set_yticks([0, 1, 2, 3])
+        ax.set_yticklabels(STAGE_TICK_LABELS)
+        ax.set_ylim(-0.5, 3.5)
+        ax.legend()
+        canvas.draw()
+
+    def incremental(ax, canvas, epoch):
+        hypnogram.append(epoch, predictions[epoch])
+        hypnogram.update(epoch + 1)
+
+    for name, render in [('Full redraw', full_redraw), ('LiveHypnogram', incremental)]:
+        fig = Figure(figsize=(15, 4))
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        if render is incremental:
+            hypnogram = LiveHypnogram(ax, canvas)
+            hypnogram.reset(stages)
+        elapsed = np.zeros(num_epochs)
+        for epoch in range(num_epochs):
+            start = time.perf_counter()
+            render(ax, canvas, epoch)
+            elapsed[epoch] = time.perf_counter() - start
+        per_hour = elapsed[:num_epochs // 120 * 120].reshape(-1, 120)
+        hourly = ', '.join(f"{np.median(hour) * 1e3:.1f}" for hour in per_hour)
+        print(f"  {name:<14} median ms/epoch by hour: {hourly}; whole night {elapsed.sum():.1f} s")
+        if render is incremental:
+            print(f"  {'':<14} full redraws: {hypnogram.full_redraws}")
+
+if __name__ == '__main__':
+    benchmark_temporal_features(hours=8)
+    benchmark_temporal_features(hours=24 * 7)
+    benchmark_csv_loading(hours=24 * 7)
+    benchmark_recording_store(nights=50)
+    benchmark_feature_assembly()
+    benchmark_onnx_sessions()
+    benchmark_compiled_trees('lightgbm')
+    benchmark_compiled_trees('xgboost')
+    benchmark_compiled_trees('random_forest')
+    benchmark_inference_service()
+    benchmark_streaming_stager()
+    benchmark_hypnogram_rendering()
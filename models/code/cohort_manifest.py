@@ -0,0 +1,278 @@
+# In file: cohort_manifest.py
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from label_processor import remap_sleep_stages
+from feature_engineering import SAMPLES_PER_EPOCH
+from recording_store import list_raw_files, load_raw_recording, raw_content_hash
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+SAMPLE_SECONDS = 5
+STAGE_NAMES = ['Wake', 'Light', 'Deep', 'REM']
+# Raw labels remap_sleep_stages understands; anything else counts as missing
+RAW_STAGE_VALUES = [-1, 0, 1, 2, 3, 4, 5]
+
+# A recording gets a quality flag when it crosses one of these limits
+QUALITY_THRESHOLDS = {
+    'max_hr_missing': 0.05,       # fraction of heart-rate samples that are NaN
+    'max_hr_out_of_range': 0.01,  # fraction outside the plausible range below
+    'hr_range': (30, 220),
+    'min_hr_std': 0.5,            # below this the heart rate looks flat-lined
+    'max_motion_missing': 0.05,
+    'max_label_missing': 0.5,
+    'min_hours': 2.0
+}
+
+def profile_recording(file_path: str) -> dict:
+    """
+    Reads one raw recording and summarizes it for the manifest.
+    Module-level so it can be sent to worker processes.
+
+    Returns:
+        A dict with rows, epochs, duration_hours, per-stage epoch counts,
+        quality measurements and the list of quality flags.
+    """
+    raw_df = load_raw_recording(file_path)
+    rows = len(raw_df)
+    heart_rate = raw_df['heart_rate'].to_numpy(dtype=np.float64)
+    motion = raw_df[['motion_x', 'motion_y', 'motion_z']].to_numpy(dtype=np.float64)
+
+    # 1. Labels: count the per-epoch label the pipeline trains on (last sample of each epoch)
+    raw_stages = raw_df['sleep_stage'].to_numpy()
+    label_missing = float(np.mean(~np.isin(raw_stages, RAW_STAGE_VALUES))) if rows else 1.0
+    epochs = -(-rows // SAMPLES_PER_EPOCH)
+    stage_counts = {name: 0 for name in STAGE_NAMES}
+    if label_missing < 1.0:
+        stages = remap_sleep_stages(pd.DataFrame({'sleep_stage': raw_stages}))['sleep_stage'].to_numpy()
+        last_rows = np.minimum((np.arange(epochs) + 1) * SAMPLES_PER_EPOCH, rows) - 1
+        counts = np.bincount(stages[last_rows], minlength=len(STAGE_NAMES))
+        stage_counts = {name: int(count) for name, count in zip(STAGE_NAMES, counts)}
+
+    # 2. Signal quality
+    thresholds = QUALITY_THRESHOLDS
+    hr_valid = heart_rate[~np.isnan(heart_rate)]
+    hr_missing = 1.0 - len(hr_valid) / rows if rows else 1.0
+    low, high = thresholds['hr_range']
+    hr_out_of_range = float(np.mean((hr_valid < low) | (hr_valid > high))) if len(hr_valid) else 0.0
+    hr_std = float(np.std(hr_valid)) if len(hr_valid) > 1 else 0.0
+    motion_missing = float(np.isnan(motion).any(axis=1).mean()) if rows else 1.0
+    duration_hours = rows * SAMPLE_SECONDS / 3600
+
+    flags = []
+    if hr_missing > thresholds['max_hr_missing']:
+        flags.append('hr_gaps')
+    if hr_out_of_range > thresholds['max_hr_out_of_range']:
+        flags.append('hr_out_of_range')
+    if hr_std < thresholds['min_hr_std']:
+        flags.append('hr_flatline')
+    if motion_missing > thresholds['max_motion_missing']:
+        flags.append('motion_gaps')
+    if label_missing > thresholds['max_label_missing']:
+        flags.append('unlabeled')
+    if duration_hours < thresholds['min_hours']:
+        flags.append('short')
+
+    return {
+        'rows': rows,
+        'epochs': epochs,
+        'duration_hours': round(duration_hours, 4),
+        'stage_counts': stage_counts,
+        'hr_missing': round(hr_missing, 6),
+        'hr_out_of_range': round(hr_out_of_range, 6),
+        'hr_std': round(hr_std, 4),
+        'motion_missing': round(motion_missing, 6),
+        'label_missing': round(label_missing, 6),
+        'quality_flags': flags
+    }
+
+def file_signature(file_path: str) -> list:
+    """
+    Cheap change check: size and mtime for a CSV, the source hash for a store recording.
+    """
+    if os.path.isfile(file_path):
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+    return [raw_content_hash(file_path)]
+
+class CohortManifest:
+    """
+    Per-recording metadata for a data folder (CSVs or a recording store), saved as manifest.json.
+
+    update() scans the folder and only reads recordings that are new or whose
+    size/mtime changed, so keeping the manifest current is cheap even with
+    thousands of nights. Queries and splits work on the manifest alone and
+    return file paths the trainers and run_inference_on_folder accept
+    instead of a folder.
+
+    Args:
+        folder_path (str): Folder with the raw CSVs, or a recording store.
+        manifest_path (str): Where to keep the manifest. Defaults to manifest.json in the folder.
+    """
+    def __init__(self, folder_path: str, manifest_path: str = None):
+        self.folder_path = folder_path
+        self.manifest_path = manifest_path or os.path.join(folder_path, MANIFEST_FILE)
+        self.records = {}
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION and manifest.get('thresholds') == _jsonable(QUALITY_THRESHOLDS):
+                self.records = manifest['recordings']
+            else:
+                print("⚠️ Manifest was built with different settings, it will be rebuilt")
+
+    def update(self, n_workers: int = 1) -> dict:
+        """
+        Brings the manifest in line with the folder and saves it.
+
+        Args:
+            n_workers (int): Worker processes used to profile new or changed recordings.
+
+        Returns:
+            Counts of added, updated, removed and unchanged recordings.
+        """
+        file_paths = list_raw_files(self.folder_path)
+        names = {os.path.basename(path): path for path in file_paths}
+        summary = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
+        # 1. Forget recordings that are gone
+        for name in list(self.records):
+            if name not in names:
+                del self.records[name]
+                summary['removed'] += 1
+
+        # 2. Find new and changed recordings
+        to_profile = []
+        for name, path in names.items():
+            signature = file_signature(path)
+            record = self.records.get(name)
+            if record is not None and record['signature'] == signature:
+                summary['unchanged'] += 1
+                continue
+            content_hash = raw_content_hash(path)
+            if record is not None and record['content_hash'] == content_hash:
+                # Touched but not changed, e.g. copied with a new mtime
+                record['signature'] = signature
+                summary['unchanged'] += 1
+                continue
+            summary['updated' if record is not None else 'added'] += 1
+            to_profile.append((name, path, signature, content_hash))
+
+        # 3. Profile them, in parallel if requested
+        paths = [path for _, path, _, _ in to_profile]
+        if n_workers is not None and n_workers <= 1:
+            profiles = [_safe_profile(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                profiles = list(executor.map(_safe_profile, paths, chunksize=8))
+        for (name, path, signature, content_hash), profile in zip(to_profile, profiles):
+            if 'error' in profile:
+                print(f"  ❌ Could not read {name}: {profile['error']}")
+            self.records[name] = {'signature': signature, 'content_hash': content_hash, **profile}
+
+        self.save()
+        print(f"Manifest for {self.folder_path}: {summary['added']} added, {summary['updated']} updated, "
+              f"{summary['removed']} removed, {summary['unchanged']} unchanged")
+        return summary
+
+    def save(self) -> None:
+        """Writes the manifest atomically"""
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'thresholds': _jsonable(QUALITY_THRESHOLDS),
+            'recordings': dict(sorted(self.records.items()))
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder_path, name)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The manifest as one row per readable recording, with a column per stage count
+        (wake_epochs, light_epochs, ...), the quality flags and an 'ok' column (no flags).
+        """
+        rows = []
+        for name, record in self.records.items():
+            if 'error' in record:
+                continue
+            row = {key: value for key, value in record.items() if key not in ('signature', 'stage_counts')}
+            row['name'] = name
+            row['path'] = self.path(name)
+            for stage, count in record['stage_counts'].items():
+                row[f"{stage.lower()}_epochs"] = count
+            row['ok'] = not record['quality_flags']
+            rows.append(row)
+        return pd.DataFrame(rows).set_index('name') if rows else pd.DataFrame()
+
+    def select(self, query: str = None, exclude_flags: list = None, only_ok: bool = False) -> list:
+        """
+        File paths of the recordings matching a query, in name order.
+
+        Args:
+            query (str): A pandas query over the to_frame() columns,
+                         e.g. "duration_hours >= 6 and deep_epochs > 20".
+            exclude_flags (list): Drop recordings with any of these quality flags.
+            only_ok (bool): Drop recordings with any quality flag.
+        """
+        df = self.to_frame()
+        if df.empty:
+            return []
+        if query:
+            df = df.query(query)
+        if exclude_flags:
+            df = df[[not set(flags) & set(exclude_flags) for flags in df['quality_flags']]]
+        if only_ok:
+            df = df[df['ok']]
+        return df.sort_index()['path'].tolist()
+
+    def split(self, test_fraction: float = 0.2, random_state: int = 42, query: str = None,
+              exclude_flags: list = None, only_ok: bool = False):
+        """
+        Splits the matching recordings into training and testing file lists by night.
+        The split depends only on the content of the recordings and the seed,
+        not on file names or the order they were added.
+
+        Returns:
+            (train_paths, test_paths)
+        """
+        paths = self.select(query, exclude_flags, only_ok)
+        hashes = {path: self.records[os.path.basename(path)]['content_hash'] for path in paths}
+        paths = sorted(paths, key=lambda path: hashes[path])
+
+        rng = np.random.default_rng(random_state)
+        order = rng.permutation(len(paths))
+        num_test = int(round(len(paths) * test_fraction))
+        test_paths = sorted(paths[i] for i in order[:num_test])
+        train_paths = sorted(paths[i] for i in order[num_test:])
+        return train_paths, test_paths
+
+def _safe_profile(file_path: str) -> dict:
+    """profile_recording that reports a failure instead of raising"""
+    try:
+        return profile_recording(file_path)
+    except Exception as e:
+        return {'error': str(e)}
+
+def _jsonable(value):
+    """Round-trips a value through JSON so tuples compare equal to the loaded lists"""
+    return json.loads(json.dumps(value))
+
+if __name__ == '__main__':
+    DATA_FOLDER = './train_data'
+
+    manifest = CohortManifest(DATA_FOLDER)
+    manifest.update(n_workers=os.cpu_count())
+    print(manifest.to_frame()[['duration_hours', 'epochs', 'deep_epochs', 'rem_epochs', 'quality_flags']])
+
+    train_files, test_files = manifest.split(test_fraction=0.2, query="duration_hours >= 4", only_ok=True)
+    print(f"{len(train_files)} training nights, {len(test_files)} testing nights")
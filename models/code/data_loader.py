@@ -0,0 +1,76 @@
+# In file: data_loader.py
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    PYARROW_CSV_AVAILABLE = True
+except ImportError:
+    PYARROW_CSV_AVAILABLE = False
+
+# Columns of the raw 5-second files that the pipeline actually uses
+RAW_SIGNAL_COLUMNS = ['heart_rate', 'motion_x', 'motion_y', 'motion_z']
+RAW_LABEL_COLUMN = 'sleep_stage'
+RAW_TIMESTAMP_COLUMN = 'timestamp'
+
+# float32 is plenty for the sensor values; sleep_stage stays float so missing labels load as NaN
+RAW_DTYPES = {column: np.float32 for column in RAW_SIGNAL_COLUMNS + [RAW_LABEL_COLUMN]}
+
+def read_raw_header(file_path: str) -> list:
+    """Returns the column names of a raw CSV without parsing its rows"""
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+def validate_raw_columns(columns, file_path: str = '<frame>', include_timestamp: bool = False):
+    """
+    Raises a ValueError naming the missing columns if a raw file lacks any the pipeline needs.
+    """
+    required = RAW_SIGNAL_COLUMNS + [RAW_LABEL_COLUMN]
+    if include_timestamp:
+        required = required + [RAW_TIMESTAMP_COLUMN]
+    missing = [column for column in required if column not in columns]
+    if missing:
+        raise ValueError(f"{file_path} is missing required columns: {missing}")
+
+def load_raw_csv(file_path: str, include_timestamp: bool = False, engine: str = None) -> pd.DataFrame:
+    """
+    Reads a raw 5-second CSV, parsing only the columns the pipeline uses with compact dtypes.
+
+    Args:
+        file_path (str): Path of the raw CSV.
+        include_timestamp (bool): Also read the timestamp column, kept as text.
+        engine (str): pandas parser engine. None uses pyarrow when it is installed
+                      and the C parser otherwise.
+
+    Returns:
+        A DataFrame with float32 heart_rate, motion_x/y/z and sleep_stage columns
+        (plus timestamp if requested), in the pipeline's column order.
+    """
+    # 1. Check the header before parsing so a bad file fails with a clear message
+    validate_raw_columns(read_raw_header(file_path), file_path, include_timestamp)
+
+    columns = ([RAW_TIMESTAMP_COLUMN] if include_timestamp else []) + RAW_SIGNAL_COLUMNS + [RAW_LABEL_COLUMN]
+    dtypes = dict(RAW_DTYPES)
+    if include_timestamp:
+        dtypes[RAW_TIMESTAMP_COLUMN] = str
+
+    if engine is None:
+        engine = 'pyarrow' if PYARROW_CSV_AVAILABLE else 'c'
+
+    # 2. Parse only the needed columns with explicit dtypes
+    try:
+        df = pd.read_csv(file_path, usecols=columns, dtype=dtypes, engine=engine)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"{file_path} has non-numeric values in a sensor or label column: {e}") from e
+
+    return df[columns]
+
+def load_raw_arrays(file_path: str) -> dict:
+    """
+    Reads a raw CSV into one contiguous float32 array per column.
+
+    Returns:
+        A dict mapping heart_rate, motion_x/y/z and sleep_stage to 1-D arrays.
+    """
+    df = load_raw_csv(file_path)
+    return {column: np.ascontiguousarray(df[column].to_numpy(dtype=np.float32)) for column in df.columns}
@@ -0,0 +1,260 @@
+# In file: dataset_builder.py
+
+import os
+import numpy as np
+import pandas as pd
+
+from processing_pipeline import iter_processed_files, process_single_subject
+from recording_store import resolve_raw_files, describe_source, raw_sample_count
+from feature_engineering import SAMPLES_PER_EPOCH
+from model_backends import NormalizationStats
+
+class StreamingDatasetBuilder:
+    """
+    Assembles processed subjects into one preallocated feature matrix that ends
+    up as float32 normalized features.
+
+    Subjects are written into the matrix as they arrive, together with the
+    label vector and a subject-offset index. Nothing else holds the whole
+    dataset, instead of the several copies made by pd.concat, drop and
+    DataFrame arithmetic.
+
+    Normalization is computed in float64 and only the result is rounded to
+    float32, exactly like NormalizationStats.normalize at serving time. When the
+    stats are known up front (a test set), each subject is normalized as it is
+    added and the matrix is float32 throughout. Otherwise (a training set) the
+    raw features are kept in float64 until normalize(), and mean/std make two
+    exact passes over each raw column (one column copy at a time) so the stats
+    are bit-identical to the non-streaming trainer's.
+
+    Peak memory is therefore about twice the final float32 matrix for a
+    training set, plus a second matrix for the duration of a realloc whenever
+    expected_rows is exceeded (the realloc may copy). build_dataset_streaming
+    passes an upper bound from the raw sample counts, so the matrix is allocated
+    once and only trimmed at the end.
+
+    Args:
+        features (list): Feature columns, in order. Defaults to every column of
+                         the first subject except the label.
+        label_column (str): Name of the target column.
+        expected_rows (int): Upper bound on the number of rows, if known. The
+                             matrix grows in place when it is exceeded.
+        mean_stats (pd.Series): Normalization means to apply while adding subjects.
+        std_stats (pd.Series): Normalization standard deviations, with mean_stats.
+        raw_sample_rows (int): Also keep this many of the first rows unnormalized (float64) in
+                               raw_sample, e.g. to check a model that normalizes its own input.
+    """
+    def __init__(self, features: list = None, label_column: str = 'sleep_stage', expected_rows: int = None,
+                 mean_stats: pd.Series = None, std_stats: pd.Series = None, raw_sample_rows: int = 0):
+        self.features = list(features) if features is not None else None
+        self.label_column = label_column
+        self.capacity = expected_rows or 0
+        self.raw_sample_rows = raw_sample_rows
+        self.raw_sample = None    # Rows 0..len(raw_sample) of X before normalization
+        self.stats = None
+        if mean_stats is not None:
+            self.features = self.features or list(mean_stats.index)
+            self.stats = NormalizationStats(self.features, mean_stats, std_stats)
+        self.normalized = self.stats is not None
+        self.num_rows = 0
+        self.X = None
+        self.y = None
+        self.subject_names = []
+        self.subject_offsets = [0]
+        
+        # Running per-feature count, mean and sum of squared deviations; only kept for a dataset
+        # normalized while streaming, whose raw features are gone (see _column_stats otherwise)
+        self._count = 0
+        self._mean = None
+        self._m2 = None
+    
+    def add_subject(self, processed_df: pd.DataFrame, name: str = None) -> None:
+        """Appends one processed subject"""
+        if self.features is None:
+            self.features = [col for col in processed_df.columns if self.label_column not in col]
+        
+        block = processed_df[self.features].to_numpy(dtype=np.float64)
+        labels = processed_df[self.label_column].to_numpy()
+        num_new = len(block)
+        
+        if self.X is None:
+            self.capacity = max(self.capacity, num_new)
+            self.X = np.empty((self.capacity, len(self.features)), dtype=np.float32 if self.normalized else np.float64)
+            self.y = np.empty(self.capacity, dtype=np.int32)
+            self._mean = np.zeros(len(self.features))
+            self._m2 = np.zeros(len(self.features))
+        elif self.num_rows + num_new > self.capacity:
+            # Grow by 25%: a realloc, which may copy the whole matrix (a good expected_rows avoids it)
+            self.capacity = max(self.num_rows + num_new, int(self.capacity * 1.25))
+            self.X.resize((self.capacity, len(self.features)), refcheck=False)
+            self.y.resize(self.capacity, refcheck=False)
+        
+        self.X[self.num_rows:self.num_rows + num_new] = self.stats.normalize(block) if self.normalized else block
+        if self.num_rows < self.raw_sample_rows:
+            kept = block[:self.raw_sample_rows - self.num_rows].copy()
+            self.raw_sample = kept if self.raw_sample is None else np.concatenate([self.raw_sample, kept])
+        self.y[self.num_rows:self.num_rows + num_new] = labels
+        self.num_rows += num_new
+        self.subject_names.append(name)
+        self.subject_offsets.append(self.num_rows)
+        if self.normalized:
+            self._update_stats(block)
+    
+    def _update_stats(self, block: np.ndarray) -> None:
+        # Chan et al. merge of the block's mean/M2 into the running totals
+        num_new = len(block)
+        if num_new == 0:
+            return
+        block_mean = block.mean(axis=0)
+        block_m2 = ((block - block_mean) ** 2).sum(axis=0)
+        total = self._count + num_new
+        delta = block_mean - self._mean
+        self._mean = self._mean + delta * num_new / total
+        self._m2 = self._m2 + block_m2 + delta ** 2 * self._count * num_new / total
+        self._count = total
+    
+    def finalize(self):
+        """Trims the arrays to the rows actually written. Returns self."""
+        if self.X is None:
+            raise ValueError("No subjects were added to the dataset")
+        if self.capacity != self.num_rows:
+            self.X.resize((self.num_rows, len(self.features)), refcheck=False)
+            self.y.resize(self.num_rows, refcheck=False)
+            self.capacity = self.num_rows
+        return self
+    
+    def _column_stats(self) -> tuple:
+        # Two passes over each contiguous raw column, the same arithmetic as DataFrame.mean/std,
+        # so the stats are bit-identical to the non-streaming trainer's
+        if self.normalized or self.X is None:
+            return self._mean, np.sqrt(self._m2 / max(self._count - 1, 1))
+        if getattr(self, '_stats_rows', None) != self.num_rows:
+            means, stds = [], []
+            for j in range(len(self.features)):
+                column = np.ascontiguousarray(self.X[:self.num_rows, j])
+                column_mean = column.sum() / self.num_rows
+                means.append(column_mean)
+                stds.append(np.sqrt(((column - column_mean) ** 2).sum() / max(self.num_rows - 1, 1)))
+            self._exact_stats = (np.array(means), np.array(stds))
+            self._stats_rows = self.num_rows
+        return self._exact_stats
+    
+    @property
+    def mean(self) -> pd.Series:
+        """Per-feature mean of everything added so far"""
+        return pd.Series(self._column_stats()[0], index=self.features)
+    
+    @property
+    def std(self) -> pd.Series:
+        """Per-feature sample standard deviation (ddof=1, like pandas)"""
+        return pd.Series(self._column_stats()[1], index=self.features)
+    
+    def normalize(self, mean_stats: pd.Series, std_stats: pd.Series, chunk_rows: int = 65536) -> None:
+        """
+        Normalizes the raw float64 matrix into float32: (X - mean) / (std + 1e-6)
+        in float64, with zero-std features set to 0, exactly as the trainers do.
+
+        The float32 rows are written over the front of the same buffer, chunk by
+        chunk (row i's output ends before row i's input starts), so no second
+        matrix is allocated.
+        """
+        if self.normalized:
+            raise ValueError("The dataset is already normalized")
+        stats = NormalizationStats(self.features, mean_stats, std_stats)
+        num_features = len(self.features)
+        
+        if self.X is not None:
+            raw = self.X[:self.num_rows]
+            output = self.X.reshape(-1).view(np.float32)[:self.num_rows * num_features].reshape(self.num_rows, num_features)
+            for start in range(0, self.num_rows, chunk_rows):
+                end = min(start + chunk_rows, self.num_rows)
+                output[start:end] = stats.normalize(raw[start:end])
+            
+            # Give back the float64 half of the buffer the float32 rows no longer need
+            buffer = self.X
+            buffer.resize((self.num_rows * num_features + 1) // 2, refcheck=False)
+            self.X = buffer.view(np.float32)[:self.num_rows * num_features].reshape(self.num_rows, num_features)
+            self.capacity = self.num_rows
+        self.stats = stats
+        self.normalized = True
+    
+    def subject_slice(self, index: int) -> slice:
+        """Row range of the index-th subject"""
+        return slice(self.subject_offsets[index], self.subject_offsets[index + 1])
+    
+    def as_frame(self) -> pd.DataFrame:
+        """The feature matrix as a DataFrame with feature names (no copy)"""
+        return pd.DataFrame(self.X, columns=self.features, copy=False)
+
+def expected_epochs(file_paths: list) -> int:
+    """
+    Upper bound on the epochs the processing functions produce for these recordings
+    (one per started 30-second window), from raw_sample_count's cheap first pass.
+    """
+    return sum(-(-raw_sample_count(file_path) // SAMPLES_PER_EPOCH) for file_path in file_paths)
+
+def build_dataset_streaming(folder_path: str, process_fn=process_single_subject, n_workers: int = 1,
+                            cache=None, features: list = None, mean_stats: pd.Series = None,
+                            std_stats: pd.Series = None, expected_rows: int = None,
+                            raw_sample_rows: int = 0) -> StreamingDatasetBuilder:
+    """
+    Processes every CSV in a folder straight into a StreamingDatasetBuilder.
+    Files that fail are reported and skipped.
+
+    Args:
+        folder_path: Folder with the raw CSVs, a recording store, or a list of recording paths.
+        process_fn: Processing function, e.g. process_single_subject.
+        n_workers (int): Worker processes used to featurize the subjects.
+        cache (SubjectCache): Optional cache of processed subjects.
+        features (list): Feature order to use (pass the training features for a test set).
+        mean_stats, std_stats: Normalize each subject as it is added (e.g. a test set with the training stats).
+        expected_rows (int): Rows to preallocate. Defaults to expected_epochs of the files,
+                             so the matrix never has to grow.
+        raw_sample_rows (int): First rows to also keep unnormalized (see StreamingDatasetBuilder).
+
+    Returns:
+        The finalized builder.
+    """
+    file_paths = resolve_raw_files(folder_path)
+    print(f"Found {len(file_paths)} files to stream from {describe_source(folder_path)}...")
+    
+    if expected_rows is None:
+        expected_rows = expected_epochs(file_paths)
+    builder = StreamingDatasetBuilder(features=features, expected_rows=expected_rows,
+                                      mean_stats=mean_stats, std_stats=std_stats, raw_sample_rows=raw_sample_rows)
+    
+    for file_path, processed_df, error in iter_processed_files(file_paths, process_fn, n_workers, cache):
+        filename = os.path.basename(file_path)
+        if error is not None:
+            print(f"  ❌ Failed to process {filename}: {str(error)}")
+            continue
+        builder.add_subject(processed_df, filename)
+        print(f"  - Added {filename} ({len(processed_df)} epochs, {builder.num_rows} total)")
+    
+    return builder.finalize()
+
+def load_normalized_datasets(train_folder: str, test_folder: str, process_fn=process_single_subject,
+                             n_workers: int = 1, cache=None, raw_test_rows: int = 0):
+    """
+    Streams the training and testing folders into float32 matrices and
+    normalizes both with the training stats. With raw_test_rows, the test
+    builder also keeps that many of its first rows unnormalized in raw_sample.
+
+    Returns:
+        (train_builder, test_builder, mean_stats, std_stats)
+    """
+    train_data = build_dataset_streaming(train_folder, process_fn, n_workers, cache)
+    
+    # Stats from the training set only
+    mean_stats = train_data.mean
+    std_stats = train_data.std
+    
+    zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
+    if zero_std_cols:
+        print(f"Warning: The following features have zero standard deviation and will be set to 0: {zero_std_cols}")
+    
+    train_data.normalize(mean_stats, std_stats)
+    # The test set is normalized subject by subject as it streams in
+    test_data = build_dataset_streaming(test_folder, process_fn, n_workers, cache, features=train_data.features,
+                                        mean_stats=mean_stats, std_stats=std_stats, raw_sample_rows=raw_test_rows)
+    return train_data, test_data, mean_stats, std_stats
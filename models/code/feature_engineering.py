@@ -2,6 +2,26 @@
 
 import pandas as pd
 import numpy as np
+import warnings
+
+# Number of 5-second samples in one 30-second epoch
+SAMPLES_PER_EPOCH = 6
+
+# Signals aggregated per epoch and the statistics kept for each one
+EPOCH_SIGNALS = ['heart_rate', 'motion_x', 'motion_y', 'motion_z']
+EPOCH_FEATURE_COLUMNS = [
+    ('hr_mean', 'heart_rate', 'mean'),
+    ('hr_std', 'heart_rate', 'std'),
+    ('hr_min', 'heart_rate', 'min'),
+    ('hr_max', 'heart_rate', 'max'),
+    ('hr_rmssd', 'heart_rate', 'rmssd'),
+    ('motion_x_std', 'motion_x', 'std'),
+    ('motion_x_range', 'motion_x', 'range'),
+    ('motion_y_std', 'motion_y', 'std'),
+    ('motion_y_range', 'motion_y', 'range'),
+    ('motion_z_std', 'motion_z', 'std'),
+    ('motion_z_range', 'motion_z', 'range'),
+]
 
 def calculate_rmssd(series):
     """Calculates the RMSSD from a series of heart rate values."""
@@ -18,19 +38,101 @@ def calculate_rmssd(series):
     return rmssd
 
 
-def create_30s_epochs(df: pd.DataFrame) -> pd.DataFrame:
+def epoch_block_stats(block: np.ndarray) -> dict:
+    """
+    Computes the per-epoch statistics for a block of equally sized epochs.
+
+    Matches the pandas groupby semantics used by the original aggregation:
+    NaNs are skipped by mean/std/min/max, std uses ddof=1 and RMSSD is NaN
+    when an epoch has fewer than two samples or contains a NaN.
+
+    Args:
+        block: Array of shape (n_epochs, samples_per_epoch, n_channels).
+
+    Returns:
+        A dict mapping each statistic name to an (n_epochs, n_channels) array.
+    """
+    n_epochs, n_samples, n_channels = block.shape
+    
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        
+        if np.isnan(block).any():
+            stats = {
+                'mean': np.nanmean(block, axis=1),
+                'std': np.nanstd(block, axis=1, ddof=1),
+                'min': np.nanmin(block, axis=1),
+                'max': np.nanmax(block, axis=1),
+            }
+        else:
+            stats = {
+                'mean': block.mean(axis=1),
+                'std': block.std(axis=1, ddof=1) if n_samples > 1 else np.full((n_epochs, n_channels), np.nan),
+                'min': block.min(axis=1),
+                'max': block.max(axis=1),
+            }
+        
+        if n_samples < 2:
+            stats['rmssd'] = np.full((n_epochs, n_channels), np.nan)
+        else:
+            successive_diffs = np.diff(block, axis=1)
+            stats['rmssd'] = np.sqrt(np.mean(successive_diffs ** 2, axis=1))
+    
+    stats['range'] = stats['max'] - stats['min']
+    return stats
+
+
+def aggregate_epoch_signals(signals: np.ndarray, samples_per_epoch: int = SAMPLES_PER_EPOCH) -> dict:
+    """
+    Aggregates 5-second samples into per-epoch statistics for all channels at once.
+
+    The full epochs are viewed as an (n_epochs, samples_per_epoch, n_channels)
+    array, so every statistic is a single NumPy reduction. A trailing partial
+    epoch is aggregated separately, just like the last groupby group.
+
+    Args:
+        signals: Array of shape (n_samples, n_channels).
+        samples_per_epoch: Number of samples in one epoch.
+
+    Returns:
+        A dict mapping each statistic name to an (n_epochs, n_channels) array.
+    """
+    n_samples, n_channels = signals.shape
+    n_full = n_samples // samples_per_epoch
+    
+    blocks = []
+    if n_full > 0:
+        blocks.append(signals[:n_full * samples_per_epoch].reshape(n_full, samples_per_epoch, n_channels))
+    if n_samples > n_full * samples_per_epoch:
+        blocks.append(signals[n_full * samples_per_epoch:].reshape(1, -1, n_channels))
+    
+    if not blocks:
+        return {name: np.empty((0, n_channels)) for name in ['mean', 'std', 'min', 'max', 'rmssd', 'range']}
+    
+    block_stats = [epoch_block_stats(block) for block in blocks]
+    if len(block_stats) == 1:
+        return block_stats[0]
+    return {name: np.concatenate([stats[name] for stats in block_stats]) for name in block_stats[0]}
+
+
+def create_30s_epochs(df: pd.DataFrame, use_numpy_kernel: bool = True) -> pd.DataFrame:
     """
     Transforms 5-second interval data into 30-second epochs and engineers features.
 
     Args:
         df: The DataFrame for a single subject with 5-second data.
+        use_numpy_kernel: Aggregate with the reshape-based NumPy kernel instead
+                          of pandas groupby. Both give the same columns.
 
     Returns:
         A new DataFrame where each row represents one 30-second epoch with
         engineered features.
     """
     # Create an 'epoch_id' to group every 6 rows (30 seconds)
-    df['epoch_id'] = np.arange(len(df)) // 6
+    df['epoch_id'] = np.arange(len(df)) // SAMPLES_PER_EPOCH
+    
+    if use_numpy_kernel:
+        return create_30s_epochs_numpy(df)
     
     # Define a function to calculate the range
     def range_func(x):
@@ -67,4 +169,27 @@ def create_30s_epochs(df: pd.DataFrame) -> pd.DataFrame:
         'sleep_stage_last': 'sleep_stage'
     })
 
-    return epoch_df
\ No newline at end of file
+    return epoch_df
+
+
+def create_30s_epochs_numpy(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    NumPy implementation of create_30s_epochs using aggregate_epoch_signals.
+    """
+    signals = np.column_stack([df[signal].to_numpy(dtype=np.float64) for signal in EPOCH_SIGNALS])
+    stats = aggregate_epoch_signals(signals)
+    n_epochs = len(stats['mean'])
+    
+    epoch_data = {}
+    for column, signal, stat in EPOCH_FEATURE_COLUMNS:
+        values = stats[stat][:, EPOCH_SIGNALS.index(signal)]
+        # groupby keeps integer dtype for min/max (and so for the range)
+        if stat in ('min', 'max', 'range') and pd.api.types.is_integer_dtype(df[signal].dtype):
+            values = values.astype(df[signal].dtype)
+        epoch_data[column] = values
+    
+    # Take the label from the end of each 30s window
+    last_rows = np.minimum((np.arange(n_epochs) + 1) * SAMPLES_PER_EPOCH, len(df)) - 1
+    epoch_data['sleep_stage'] = df['sleep_stage'].to_numpy()[last_rows]
+    
+    return pd.DataFrame(epoch_data, index=pd.Index(np.arange(n_epochs), name='epoch_id'))
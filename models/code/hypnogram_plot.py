@@ -0,0 +1,151 @@
+# In file: hypnogram_plot.py
+
+import numpy as np
+from matplotlib.colors import to_rgba_array
+
+from label_processor import EpochStageLabels
+
+EPOCH_SECONDS = 30
+STAGE_COLORS = ['red', 'darkorange', 'blue', 'green']
+STAGE_TICK_LABELS = ['WAKE', 'LIGHT', 'DEEP', 'REM']
+
+# The x axis starts at one hour and doubles when the predictions reach its end,
+# so a night needs a handful of full redraws instead of one per epoch
+INITIAL_SPAN_SECONDS = 3600
+
+class LiveHypnogram:
+    """
+    Live plot of the predicted stages on top of the actual ones, updated in place.
+
+    The artists are created once. New epochs are appended to preallocated arrays
+    and only the points added since the last frame are drawn, onto the bitmap
+    already on screen (blitting), so the cost of a frame does not grow with the
+    night. The whole axes is redrawn only when the x axis has to grow, when the
+    canvas is resized or after reset.
+
+    Args:
+        ax: The matplotlib axes to draw in.
+        canvas: Its figure canvas (FigureCanvasTkAgg in the apps).
+        capacity (int): Initial number of epochs the arrays hold; they grow as needed.
+    """
+    def __init__(self, ax, canvas, capacity: int = 1024):
+        self.ax = ax
+        self.canvas = canvas
+        self.times = np.zeros(capacity)
+        self.stages = np.zeros(capacity)
+        self.colors = np.zeros((capacity, 4))
+        self.stage_rgba = to_rgba_array(STAGE_COLORS)
+        self.actual_times = np.zeros(0)
+        self.actual_stages = np.zeros(0)
+
+        # 1. Persistent artists with everything shown so far; drawn by full redraws only
+        self.actual_line, = ax.plot([], [], label='Actual Stage', color='blue', alpha=0.3, linewidth=2,
+                                    drawstyle='steps-post')
+        self.prediction_points = ax.scatter([], [], s=50, alpha=0.7, label='Predicted')
+        self.prediction_line, = ax.plot([], [], 'gray', alpha=0.3, linewidth=1)
+
+        # 2. Animated twins holding only the newest points; drawn on top of the screen bitmap
+        self.actual_tail, = ax.plot([], [], color='blue', alpha=0.3, linewidth=2, drawstyle='steps-post',
+                                    animated=True)
+        self.prediction_tail_points = ax.scatter([], [], s=50, alpha=0.7, animated=True)
+        self.prediction_tail_line, = ax.plot([], [], 'gray', alpha=0.3, linewidth=1, animated=True)
+
+        ax.set_yticks([0, 1, 2, 3])
+        ax.set_yticklabels(STAGE_TICK_LABELS)
+        ax.set_ylabel('Sleep Stage')
+        ax.set_xlabel('Time Since Start (seconds)')
+        ax.set_title('Live Sleep Stage Predictions (Actual vs Predicted)')
+        ax.grid(True, alpha=0.3)
+        ax.set_ylim(-0.5, 3.5)
+        self.legend = None
+
+        self.full_redraws = 0
+        canvas.mpl_connect('resize_event', lambda event: self.request_full_redraw())
+        self.reset()
+
+    def reset(self, actual_stages=None) -> None:
+        """
+        Clears the predictions and sets the actual stages of the new recording.
+
+        Args:
+            actual_stages: One actual stage per epoch (a list, array or lazy EpochStageLabels),
+                           or None to keep the current ones.
+        """
+        if actual_stages is not None:
+            if not isinstance(actual_stages, EpochStageLabels):
+                actual_stages = np.asarray(actual_stages, dtype=np.float64)
+            self.actual_stages = actual_stages
+            self.actual_times = np.arange(len(self.actual_stages)) * EPOCH_SECONDS
+        self.count = 0                # Predictions stored
+        self.drawn = 0                # Predictions on screen
+        self.actual_shown = 0         # Actual stages on screen
+        self.span = INITIAL_SPAN_SECONDS
+        self.ax.set_xlim(0, self.span)
+        self.request_full_redraw()
+
+    def append(self, epoch: int, stage: int) -> None:
+        """Stores one prediction; it is shown by the next update"""
+        if self.count == len(self.times):
+            self.times = np.resize(self.times, 2 * self.count)
+            self.stages = np.resize(self.stages, 2 * self.count)
+            self.colors = np.resize(self.colors, (2 * self.count, 4))
+        self.times[self.count] = epoch * EPOCH_SECONDS
+        self.stages[self.count] = stage
+        self.colors[self.count] = self.stage_rgba[int(stage)]
+        self.count += 1
+
+    def request_full_redraw(self) -> None:
+        self.needs_full_redraw = True
+
+    def update(self, epoch_counter: int) -> None:
+        """
+        Shows the predictions appended since the last call and the actual stages up to epoch_counter.
+        Call it once per UI frame, not per epoch.
+        """
+        # Only show actual data up to current point to avoid data leakage
+        actual_count = min(len(self.actual_stages), epoch_counter + 1)
+        if self.count == self.drawn and actual_count == self.actual_shown and not self.needs_full_redraw:
+            return
+
+        # 1. The full artists always hold everything; they are drawn at the next full redraw
+        self.actual_line.set_data(self.actual_times[:actual_count], self.actual_stages[:actual_count])
+        self.prediction_points.set_offsets(np.column_stack([self.times[:self.count], self.stages[:self.count]]))
+        self.prediction_points.set_facecolors(self.colors[:self.count])
+        self.prediction_line.set_data(self.times[:self.count], self.stages[:self.count])
+
+        latest_time = max(self.times[self.count - 1] if self.count else 0,
+                          self.actual_times[actual_count - 1] if actual_count else 0)
+        while latest_time > self.span:
+            self.span *= 2
+            self.needs_full_redraw = True
+
+        if self.needs_full_redraw or not self.canvas.supports_blit:
+            self.full_redraw(actual_count)
+        else:
+            self.draw_tail(actual_count)
+        self.drawn = self.count
+        self.actual_shown = actual_count
+
+    def full_redraw(self, actual_count: int) -> None:
+        self.ax.set_xlim(0, self.span)
+        # Only show legend if we have both actual and predicted data
+        if self.legend is None and self.count and actual_count:
+            self.legend = self.ax.legend(handles=[self.actual_line, self.prediction_points])
+        self.canvas.draw()  # Animated tails are left out, their points are in the full artists
+        self.needs_full_redraw = False
+        self.full_redraws += 1
+
+    def draw_tail(self, actual_count: int) -> None:
+        # 2. Start each tail at the last point on screen so the lines stay connected
+        start = max(self.drawn - 1, 0)
+        self.prediction_tail_line.set_data(self.times[start:self.count], self.stages[start:self.count])
+        self.prediction_tail_points.set_offsets(np.column_stack([self.times[self.drawn:self.count],
+                                                                 self.stages[self.drawn:self.count]]))
+        self.prediction_tail_points.set_facecolors(self.colors[self.drawn:self.count])
+        actual_start = max(self.actual_shown - 1, 0)
+        self.actual_tail.set_data(self.actual_times[actual_start:actual_count],
+                                  self.actual_stages[actual_start:actual_count])
+
+        for tail in (self.actual_tail, self.prediction_tail_points, self.prediction_tail_line):
+            self.ax.draw_artist(tail)
+        self.canvas.blit(self.ax.bbox)
@@ -2,35 +2,35 @@
 
 import pandas as pd
 import os
-import pickle
 import matplotlib.pyplot as plt
 from sklearn.metrics import classification_report, accuracy_score
 
 # Import the main processing function
 from processing_pipeline import process_single_subject
+from recording_store import resolve_raw_files, load_raw_recording
+from model_backends import load_backend
 
-def run_inference_on_folder(test_folder: str, model_path: str):
+def run_inference_on_folder(test_folder, model_path: str, stats_path: str = None):
     """
     Loads a trained model and runs inference on all CSV files in a folder.
     For each file, it prints metrics and generates a comparison plot.
+    For scoring a whole archive without plots, use batch_scorer.score_recordings.
 
     Args:
-        test_folder (str): Path to the folder with test CSVs.
-        model_path (str): Path to the saved .pkl model file.
+        test_folder: Path to the folder with test CSVs, a recording store, or a list
+                     of recording paths (e.g. from CohortManifest.select).
+        model_path (str): Path to the saved .pkl model file, a compiled .npz or an .onnx model.
+        stats_path (str): Stats JSON of an ONNX model, if not next to it.
     """
     # 1. Load the trained model
-    print(f"Loading model and stats bundle from {model_path}...")
-    with open(model_path, 'rb') as f:
-        bundle = pickle.load(f)
-    
-    model = bundle['model']
-    norm_stats = bundle['normalization_stats']
+    print(f"Loading model and stats from {model_path}...")
+    backend = load_backend(model_path, stats_path)
     print("Model and stats loaded successfully.")
 
     # 2. Get list of files to process
-    all_files = [f for f in os.listdir(test_folder) if f.endswith('.csv')]
+    all_paths = resolve_raw_files(test_folder)
     
-    if not all_files:
+    if not all_paths:
         print(f"No CSV files found in {test_folder}.")
         return
 
@@ -38,12 +38,12 @@ def run_inference_on_folder(test_folder: str, model_path: str):
     stage_indices = [0, 1, 2, 3]
 
     # 3. Process each file individually
-    for filename in all_files:
+    for file_path in all_paths:
+        filename = os.path.basename(file_path)
         print(f"\n--- Processing file: {filename} ---")
-        file_path = os.path.join(test_folder, filename)
         
         # a. Load and process the single subject's data
-        raw_df = pd.read_csv(file_path)
+        raw_df = load_raw_recording(file_path)
         processed_df = process_single_subject(raw_df)
         
         if processed_df.empty:
@@ -51,24 +51,12 @@ def run_inference_on_folder(test_folder: str, model_path: str):
             continue
             
         # b. Separate features and true labels
-        # Ensure the subject's columns match the training columns exactly
-        X_subject = processed_df.drop('sleep_stage', axis=1)
-        X_subject = X_subject.reindex(columns=norm_stats['features'], fill_value=0)
+        # Ensure the subject's columns match the training columns exactly (missing ones are 0)
+        X_subject = backend.stats.feature_matrix(processed_df)
         y_true = processed_df['sleep_stage']
-        
-        # Normalize the new data using the loaded population stats safely
-        mean_stats = norm_stats['mean']
-        std_stats = norm_stats['std']
 
-        # c. Predict sleep stages
-        # Safely normalize the data
-        X_subject_normalized = (X_subject - mean_stats) / (std_stats + 1e-6) # Add epsilon
-         # Handle columns that had zero std in the training set
-        zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
-        if zero_std_cols:
-            X_subject_normalized[zero_std_cols] = 0
-            
-        y_pred = model.predict(X_subject_normalized)
+        # c. Predict sleep stages (normalized with the training stats, zero-std features set to 0)
+        y_pred = backend.predict(X_subject)
 
         # d. Report metrics for this specific file
         print(f"\nMetrics for {filename}:")
@@ -0,0 +1,358 @@
+# In file: inference_service.py
+
+import json
+import time
+import asyncio
+import numpy as np
+from collections import deque
+
+from label_processor import STAGE_MAPPING
+from feature_engineering import SAMPLES_PER_EPOCH, EPOCH_SIGNALS, epoch_block_stats
+from streaming_stager import epoch_features_from_stats, live_epoch_features
+from temporal_features import LiveFeatureState, SleepOnsetTracker, LIVE_ONSET_LEGACY_WINDOW
+from model_backends import load_backend, STAGE_LABELS
+
+class SessionState:
+    """
+    Everything the service keeps for one wearable: the samples of the epoch in
+    progress and the incremental lag/rolling/onset state. A few kilobytes, so
+    thousands of sessions fit easily.
+    """
+    def __init__(self, session_id, legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW):
+        self.session_id = session_id
+        self.samples = np.zeros((SAMPLES_PER_EPOCH, len(EPOCH_SIGNALS)), dtype=np.float64)
+        self.num_samples = 0
+        self.label = None        # Last known 4-stage label, carried forward like remap_sleep_stages' ffill
+        self.epoch_label = None
+        self.num_epochs = 0
+        # float64 history matches process_subject_live_simulation to rounding, at ~5 KB per session
+        self.feature_state = LiveFeatureState(dtype=np.float64)
+        self.onset_tracker = SleepOnsetTracker(legacy_window=legacy_onset)
+
+    def add_sample(self, heart_rate, motion_x, motion_y, motion_z, sleep_stage=None) -> bool:
+        """Stores one 5-second sample; True when it completes an epoch"""
+        self.samples[self.num_samples] = (heart_rate, motion_x, motion_y, motion_z)
+        self.num_samples += 1
+        if sleep_stage is not None:
+            self.label = STAGE_MAPPING.get(sleep_stage, self.label)
+        if self.num_samples < SAMPLES_PER_EPOCH:
+            return False
+        self.num_samples = 0
+        self.epoch_label = self.label
+        return True
+
+def parse_request(request) -> dict:
+    """
+    Checks one decoded request line of the socket protocol.
+
+    Raises:
+        ValueError: When it is not an object with a session id and, unless it closes
+                    the session, numeric hr/x/y/z and an optional numeric stage.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("expected a JSON object")
+    if not isinstance(request.get('session'), (str, int)):
+        raise ValueError("'session' must be a string or an integer")
+    if request.get('close'):
+        return request
+    for key in ('hr', 'x', 'y', 'z'):
+        value = request.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"'{key}' must be a number")
+    stage = request.get('stage')
+    if stage is not None and (isinstance(stage, bool) or not isinstance(stage, (int, float))):
+        raise ValueError("'stage' must be a number")
+    return request
+
+class InferenceService:
+    """
+    Asyncio service staging many live sessions with one shared model.
+
+    Samples are pushed per session; every sixth sample completes an epoch, which
+    is queued. A batcher task collects queued epochs across all sessions until
+    max_batch are waiting or the oldest has waited max_delay seconds, then
+    computes their epoch statistics in one vectorized pass, adds each session's
+    temporal features and runs a single model call for the whole batch. The
+    model runs in a worker thread, so new samples keep arriving meanwhile.
+
+    time_since_sleep_onset follows the sample labels when a session sends them
+    (replays of recorded nights) and the session's own predictions otherwise;
+    in that case a session should wait for each epoch's result before sending
+    the next epoch. Samples of one session must be pushed in order.
+
+    Errors are delivered through the futures. An epoch that fails to featurize
+    fails alone and the rest of its batch is scored. When the model call itself
+    fails, every epoch of the batch gets the error, and the temporal history of
+    those sessions already includes that epoch.
+
+    Args:
+        model_path (str): A .pkl bundle, compiled .npz or .onnx model (see model_backends.load_backend).
+        stats_path (str): Stats JSON of an ONNX model, if not next to it.
+        max_batch (int): Most epochs per model call.
+        max_delay (float): Longest time in seconds an epoch waits for its batch to fill.
+        legacy_onset (bool): Use the buffer-relative onset feature the deployed models were trained with.
+    """
+    def __init__(self, model_path: str, stats_path: str = None, max_batch: int = 256, max_delay: float = 0.02,
+                 legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW):
+        self.backend = load_backend(model_path, stats_path)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.legacy_onset = legacy_onset
+        self.sessions = {}
+
+        # Rows in the model's own input (normalized unless the ONNX graph does it, in its input dtype),
+        # the same route the per-epoch stager uses
+        self.assembler = self.backend.make_assembler()
+        self.batch_input = np.zeros((max_batch, len(self.backend.features)), dtype=self.backend.input_dtype)
+        self.batch_blocks = np.zeros((max_batch, SAMPLES_PER_EPOCH, len(EPOCH_SIGNALS)), dtype=np.float64)
+
+        self.pending = []
+        self._batch_ready = None
+        self._batcher = None
+        self._busy = False
+        self.stats = {'epochs': 0, 'batches': 0, 'latencies': deque(maxlen=100_000)}
+
+    async def start(self) -> None:
+        """Starts the batcher on the running event loop"""
+        self._batch_ready = asyncio.Event()
+        self._batcher = asyncio.get_running_loop().create_task(self._run_batcher())
+
+    async def stop(self) -> None:
+        """Scores whatever is still queued, then stops the batcher. If the batcher has died, the queued epochs fail."""
+        while (self.pending or self._busy) and self._batcher is not None and not self._batcher.done():
+            await asyncio.sleep(self.max_delay)
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"❌ The batcher stopped with an error: {str(e)}")
+            self._batcher = None
+        self._batch_ready = None
+
+        # Nothing scores these any more
+        pending, self.pending = self.pending, []
+        for _, _, _, _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("The inference service stopped before this epoch was scored"))
+
+    def open_session(self, session_id) -> SessionState:
+        """Returns the state of a session, creating it on first use"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = SessionState(session_id, self.legacy_onset)
+        return session
+
+    def close_session(self, session_id) -> None:
+        """Forgets a session (end of the night)"""
+        self.sessions.pop(session_id, None)
+
+    def submit_sample(self, session_id, heart_rate, motion_x, motion_y, motion_z, sleep_stage=None):
+        """
+        Adds one 5-second sample to a session without waiting.
+
+        Returns:
+            None, or a Future resolving to the epoch's prediction dict when this sample completed an epoch.
+        """
+        if self._batch_ready is None:
+            raise RuntimeError("InferenceService.start() must be awaited before submitting samples")
+        session = self.open_session(session_id)
+        if not session.add_sample(heart_rate, motion_x, motion_y, motion_z, sleep_stage):
+            return None
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((session, session.samples.copy(), session.epoch_label, loop.time(), future))
+        if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+            self._batch_ready.set()
+        return future
+
+    async def push_sample(self, session_id, heart_rate, motion_x, motion_y, motion_z, sleep_stage=None):
+        """Adds one sample and, if it completed an epoch, waits for and returns the prediction"""
+        future = self.submit_sample(session_id, heart_rate, motion_x, motion_y, motion_z, sleep_stage)
+        return await future if future is not None else None
+
+    async def _run_batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._batch_ready.wait()
+            self._batch_ready.clear()
+            if not self.pending:
+                continue
+
+            # 1. Wait for a full batch or the oldest epoch's deadline, whichever comes first
+            remaining = self.pending[0][3] + self.max_delay - loop.time()
+            while len(self.pending) < self.max_batch and remaining > 0:
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._batch_ready.clear()
+                remaining = self.pending[0][3] + self.max_delay - loop.time()
+
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            if self.pending:
+                self._batch_ready.set()
+
+            # 2. Featurize on the loop thread (session state is only touched here), predict in a worker
+            self._busy = True
+            try:
+                batch, X = self._featurize(batch)
+                if not batch:
+                    continue
+                probabilities = await loop.run_in_executor(None, self.backend.predict_proba_assembled, X)
+                self._resolve(batch, probabilities, loop.time())
+            except Exception as e:
+                for _, _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                self._busy = False
+
+    def _featurize(self, batch: list) -> tuple:
+        """
+        Epoch statistics for the whole batch at once, then each session's temporal features.
+        An entry that fails gets the exception on its future and is left out.
+
+        Returns:
+            (the entries that were featurized, their model input rows)
+        """
+        n = len(batch)
+        blocks = self.batch_blocks[:n]
+        for i, (_, samples, _, _, _) in enumerate(batch):
+            blocks[i] = samples
+        block_stats = epoch_block_stats(blocks)
+
+        X = self.batch_input
+        featurized = []
+        for i, entry in enumerate(batch):
+            session, _, label, _, future = entry
+            try:
+                features = live_epoch_features(epoch_features_from_stats(block_stats, i),
+                                               session.feature_state, session.onset_tracker)
+                X[len(featurized)] = self.assembler.assemble(features)[0]
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if label is not None:
+                session.onset_tracker.push(label)
+            featurized.append(entry)
+        return featurized, X[:len(featurized)].copy()
+
+    def _resolve(self, batch: list, probabilities: np.ndarray, now: float) -> None:
+        predictions = np.argmax(probabilities, axis=1)
+        for (session, _, label, enqueued, future), probs, prediction in zip(batch, probabilities, predictions):
+            prediction = int(prediction)
+            if label is None:
+                session.onset_tracker.push(prediction)
+            result = {
+                'session': session.session_id,
+                'epoch': session.num_epochs,
+                'stage': prediction,
+                'stage_label': STAGE_LABELS[prediction],
+                'confidence': float(probs[prediction]),
+                'probabilities': probs.tolist()
+            }
+            session.num_epochs += 1
+            self.stats['latencies'].append(now - enqueued)
+            if not future.done():
+                future.set_result(result)
+        self.stats['epochs'] += len(batch)
+        self.stats['batches'] += 1
+
+    def summary(self) -> dict:
+        """Epochs scored, mean batch size and latency percentiles (ms) so far"""
+        latencies = np.array(self.stats['latencies']) * 1000
+        return {
+            'sessions': len(self.sessions),
+            'epochs': self.stats['epochs'],
+            'batches': self.stats['batches'],
+            'mean_batch': self.stats['epochs'] / max(self.stats['batches'], 1),
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None
+        }
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Line-delimited JSON protocol for the socket server. Each request line is one sample,
+            {"session": "watch-1", "hr": 61.0, "x": 0.01, "y": -0.02, "z": 0.98, "stage": 2}
+        ("stage" optional), or {"session": "watch-1", "close": true}. Every completed epoch
+        is answered with one line holding the prediction dict.
+        """
+        def send(future):
+            if future.cancelled() or writer.is_closing():
+                return
+            error = future.exception()
+            reply = {'error': str(error)} if error is not None else future.result()
+            writer.write((json.dumps(reply) + '\n').encode())
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = parse_request(json.loads(line))
+                    if request.get('close'):
+                        self.close_session(request['session'])
+                        continue
+                    future = self.submit_sample(request['session'], request['hr'], request['x'], request['y'],
+                                                request['z'], request.get('stage'))
+                except (ValueError, KeyError, TypeError) as e:
+                    writer.write((json.dumps({'error': f"Bad request: {str(e)}"}) + '\n').encode())
+                    continue
+                if future is not None:
+                    future.add_done_callback(send)
+                await writer.drain()
+        finally:
+            writer.close()
+
+async def serve(model_path: str, host: str = '127.0.0.1', port: int = 8765, **service_kwargs) -> None:
+    """Runs the service behind a local TCP socket until cancelled"""
+    service = InferenceService(model_path, **service_kwargs)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"✅ Sleep staging service listening on {host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+async def run_synthetic_sessions(service: InferenceService, recording: np.ndarray, num_sessions: int,
+                                 epochs_per_session: int, sample_interval: float = 0.0,
+                                 random_state: int = 42) -> float:
+    """
+    Load generator: num_sessions concurrent sessions, each replaying a different
+    stretch of a (n_samples, 4) signal array. With sample_interval > 0 every session
+    waits that long between samples (a compressed clock, e.g. 0.005 for 1000x real time).
+
+    Returns:
+        Wall-clock seconds for all sessions to finish.
+    """
+    rng = np.random.default_rng(random_state)
+    num_samples = epochs_per_session * SAMPLES_PER_EPOCH
+    starts = rng.integers(0, len(recording) - num_samples, num_sessions)
+
+    async def session(session_id, start):
+        if sample_interval:
+            await asyncio.sleep(rng.random() * sample_interval)
+        for heart_rate, motion_x, motion_y, motion_z in recording[start:start + num_samples].tolist():
+            future = service.submit_sample(session_id, heart_rate, motion_x, motion_y, motion_z)
+            if future is not None:
+                await future
+            if sample_interval:
+                await asyncio.sleep(sample_interval)
+            elif future is None:
+                await asyncio.sleep(0)  # Let the other sessions in
+        service.close_session(session_id)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(session(f"synthetic-{i}", start) for i, start in enumerate(starts)))
+    return time.perf_counter() - start_time
+
+if __name__ == '__main__':
+    MODEL_PATH = '../model/lightgbm_live_model3.onnx'  # Stats JSON next to it
+
+    asyncio.run(serve(MODEL_PATH, max_batch=256, max_delay=0.02))
@@ -1,6 +1,20 @@
 # In file: label_processor.py
 
 import pandas as pd
+import numpy as np
+
+from feature_engineering import SAMPLES_PER_EPOCH
+
+# Raw label -> 4-stage label
+STAGE_MAPPING = {
+    -1: 0,  # Artifact -> Wake
+    0: 0,   # Wake -> Wake
+    1: 1,   # N1 -> Light
+    2: 1,   # N2 -> Light
+    3: 2,   # N3 -> Deep
+    4: 3,   # Artifact -> REM
+    5: 3    # REM -> REM (assuming 5 is the original REM label)
+}
 
 def remap_sleep_stages(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -19,19 +33,8 @@ def remap_sleep_stages(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         The DataFrame with the 'sleep_stage' column remapped.
     """
-    # Create a mapping dictionary for the stages
-    stage_mapping = {
-        -1: 0,  # Artifact -> Wake
-        0: 0,   # Wake -> Wake
-        1: 1,   # N1 -> Light
-        2: 1,   # N2 -> Light
-        3: 2,   # N3 -> Deep
-        4: 3,   # Artifact -> REM
-        5: 3    # REM -> REM (assuming 5 is the original REM label)
-    }
-
     # Apply the mapping
-    df['sleep_stage'] = df['sleep_stage'].map(stage_mapping)
+    df['sleep_stage'] = df['sleep_stage'].map(STAGE_MAPPING)
     
     # Forward-fill any remaining NaNs, treating them as the previous stage
     df['sleep_stage'] = df['sleep_stage'].ffill()
@@ -42,4 +45,78 @@ def remap_sleep_stages(df: pd.DataFrame) -> pd.DataFrame:
     # Ensure the column is of integer type
     df['sleep_stage'] = df['sleep_stage'].astype(int)
 
-    return df
\ No newline at end of file
+    return df
+
+class EpochStageLabels:
+    """
+    Per-epoch 4-stage labels of a raw recording, computed on demand.
+
+    Gives the same labels as remap_sleep_stages followed by create_30s_epochs
+    (the remapped label of the last sample of each epoch), but only for the
+    epochs asked for so far, a chunk at a time. A live replay can start right
+    away and the labels are filled in just ahead of its cursor.
+
+    Slicing (labels[:n]) computes up to epoch n first; len() is the number of epochs.
+
+    Args:
+        raw_stages: The raw sleep_stage column (5-second samples, NaN where unlabelled).
+        chunk_epochs (int): Epochs computed per step.
+    """
+    def __init__(self, raw_stages, chunk_epochs: int = 120):
+        self.raw_stages = np.asarray(raw_stages, dtype=np.float64)
+        self.chunk_epochs = chunk_epochs
+        self.num_epochs = -(-len(self.raw_stages) // SAMPLES_PER_EPOCH)
+        self.stages = np.zeros(self.num_epochs, dtype=np.float64)
+        self.ready = 0            # Epochs computed
+        self.carry = np.nan       # Last remapped label before the next chunk, for the ffill
+
+        # Raw label -> 4-stage label lookup; anything else is treated as missing
+        self.lookup_offset = -min(STAGE_MAPPING)
+        self.lookup = np.full(max(STAGE_MAPPING) + self.lookup_offset + 1, np.nan)
+        for raw, stage in STAGE_MAPPING.items():
+            self.lookup[raw + self.lookup_offset] = stage
+
+    def __len__(self) -> int:
+        return self.num_epochs
+
+    def __getitem__(self, index):
+        stop = index.stop if isinstance(index, slice) else index + 1
+        self.ensure(self.num_epochs if stop is None else min(stop, self.num_epochs))
+        return self.stages[index]
+
+    def map_stages(self, raw: np.ndarray) -> np.ndarray:
+        codes = np.where(np.isfinite(raw), raw, np.inf)
+        known = (codes == np.round(codes)) & (codes >= -self.lookup_offset) & (codes < len(self.lookup) - self.lookup_offset)
+        mapped = np.full(len(raw), np.nan)
+        mapped[known] = self.lookup[codes[known].astype(int) + self.lookup_offset]
+        return mapped
+
+    def ensure(self, count: int) -> None:
+        """Computes the labels of the first count epochs (rounded up to whole chunks)"""
+        if count <= self.ready:
+            return
+        end = min(self.num_epochs, max(count, self.ready + self.chunk_epochs))
+
+        # 1. Remap the chunk's samples and forward-fill from the previous chunk
+        start_row, end_row = self.ready * SAMPLES_PER_EPOCH, min(end * SAMPLES_PER_EPOCH, len(self.raw_stages))
+        mapped = self.map_stages(self.raw_stages[start_row:end_row])
+        if np.isnan(self.carry):
+            # Nothing labelled yet: back-fill with the first label of the recording, as remap_sleep_stages does
+            self.carry = self.first_label(start_row)
+        valid_rows = np.where(np.isnan(mapped), -1, np.arange(len(mapped)))
+        last_valid = np.maximum.accumulate(valid_rows)
+        filled = np.where(last_valid >= 0, mapped[np.maximum(last_valid, 0)], self.carry)
+
+        # 2. Take the label from the end of each 30s window
+        last_rows = np.minimum((np.arange(self.ready, end) + 1) * SAMPLES_PER_EPOCH, end_row) - 1 - start_row
+        self.stages[self.ready:end] = filled[last_rows]
+        self.carry = filled[-1]
+        self.ready = end
+
+    def first_label(self, start_row: int) -> float:
+        for row in range(start_row, len(self.raw_stages), self.chunk_epochs * SAMPLES_PER_EPOCH):
+            mapped = self.map_stages(self.raw_stages[row:row + self.chunk_epochs * SAMPLES_PER_EPOCH])
+            valid = np.flatnonzero(~np.isnan(mapped))
+            if len(valid):
+                return mapped[valid[0]]
+        return np.nan
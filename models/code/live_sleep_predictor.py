@@ -0,0 +1,499 @@
+# live_sleep_predictor.py
+
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import numpy as np
+from collections import deque
+import queue
+import threading
+import traceback
+
+from label_processor import EpochStageLabels
+from data_loader import load_raw_csv
+from model_backends import load_backend
+from streaming_stager import StreamingSleepStager, SampleReplay, ReplayWorker
+from hypnogram_plot import LiveHypnogram
+from status_log import StatusLog, DEBUG, INFO, ERROR
+
+# The UI picks up the worker's predictions this often and redraws once per frame
+UI_FRAME_MS = 50
+STATUS_FLUSH_MS = 250  # Status messages are written to the log widget in batches
+
+MODEL_FILETYPES = [("Model files", "*.pkl *.npz *.onnx"), ("All files", "*.*")]
+
+class LiveSleepPredictor:
+    """
+    The live replay view shared by the Tk apps: controls, status log, prediction
+    display and hypnogram, with StreamingSleepStager doing the work.
+
+    The apps only override choose_model_files (which files to ask for) and
+    describe_model (what to log about them); load_backend opens every model type.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Live Sleep Stage Predictor")
+        self.root.geometry("1200x800")
+        
+        # Initialize variables
+        self.model = None
+        self.stager = None  # Headless engine doing the featurization and prediction
+        self.raw_data = None
+        self.current_index = 0
+        self.prediction_history = deque()  # Keep last 100 predictions
+        self.time_history = deque()
+        self.epoch_counter = 0
+        
+        # Auto-play runs the engine on a worker thread that publishes predictions here
+        self.replay = None
+        self.worker = None
+        self.results = queue.Queue()
+        self.drain_job = None
+        
+        self.status_log = StatusLog(max_lines=500)
+        self.loading = set()  # 'model' and/or 'data' while they load in the background
+        
+        self.setup_ui()
+        self.flush_status()
+        
+    def setup_ui(self):
+        # Main frame
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Control panel
+        control_frame = ttk.LabelFrame(main_frame, text="Controls", padding="10")
+        control_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        # Model loading
+        ttk.Button(control_frame, text="Load Model", 
+                  command=self.load_model).grid(row=0, column=0, padx=(0, 10))
+        self.model_label = ttk.Label(control_frame, text="No model loaded")
+        self.model_label.grid(row=0, column=1, padx=(0, 20))
+        
+        # Data loading
+        ttk.Button(control_frame, text="Load CSV Data", 
+                  command=self.load_csv_data).grid(row=0, column=2, padx=(0, 10))
+        self.data_label = ttk.Label(control_frame, text="No data loaded")
+        self.data_label.grid(row=0, column=3, padx=(0, 20))
+        
+        # Simulation controls
+        ttk.Button(control_frame, text="Next Sample", 
+                  command=self.process_next_sample).grid(row=0, column=4, padx=(0, 10))
+        ttk.Button(control_frame, text="Auto Play (1x)", 
+                  command=self.start_auto_play).grid(row=0, column=5, padx=(0, 10))
+        ttk.Button(control_frame, text="Auto Play (50x)", 
+                  command=lambda: self.start_auto_play(0.02)).grid(row=0, column=6, padx=(0, 10))
+        ttk.Button(control_frame, text="Auto Play (Max)", 
+                  command=lambda: self.start_auto_play(0)).grid(row=0, column=7, padx=(0, 10))
+        ttk.Button(control_frame, text="Stop", 
+                  command=self.stop_auto_play).grid(row=0, column=8, padx=(0, 10))
+        ttk.Button(control_frame, text="Reset", 
+                  command=self.reset_simulation).grid(row=0, column=9, padx=(0, 10))
+        
+        # Busy indicator for background loading
+        self.progress_bar = ttk.Progressbar(control_frame, mode='indeterminate', length=80)
+        self.progress_bar.grid(row=0, column=10)
+        
+        # Status panel
+        status_frame = ttk.LabelFrame(main_frame, text="Current Status", padding="10")
+        status_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        self.status_text = tk.Text(status_frame, height=8, width=80)
+        self.status_text.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        status_scrollbar = ttk.Scrollbar(status_frame, orient="vertical", command=self.status_text.yview)
+        status_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.status_text.configure(yscrollcommand=status_scrollbar.set)
+        
+        self.verbose_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(status_frame, text="Verbose", variable=self.verbose_var,
+                        command=self.toggle_verbose).grid(row=1, column=0, sticky=tk.W)
+        
+        # Prediction display
+        pred_frame = ttk.LabelFrame(main_frame, text="Current Prediction", padding="10")
+        pred_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        self.prediction_label = ttk.Label(pred_frame, text="No prediction yet", 
+                                         font=("Arial", 16, "bold"))
+        self.prediction_label.grid(row=0, column=0)
+        
+        self.confidence_label = ttk.Label(pred_frame, text="", font=("Arial", 12))
+        self.confidence_label.grid(row=1, column=0)
+        
+        # Feature display
+        feature_frame = ttk.LabelFrame(main_frame, text="Current Features", padding="10")
+        feature_frame.grid(row=2, column=1, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        self.feature_text = tk.Text(feature_frame, height=8, width=40)
+        self.feature_text.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        
+        # Plot frame
+        plot_frame = ttk.LabelFrame(main_frame, text="Live Prediction History", padding="10")
+        plot_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Create matplotlib figure
+        self.fig, self.ax = plt.subplots(figsize=(15, 4))
+        self.canvas = FigureCanvasTkAgg(self.fig, master=plot_frame)
+        self.canvas.get_tk_widget().grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.hypnogram = LiveHypnogram(self.ax, self.canvas)
+        
+        # Configure grid weights for resizing
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.columnconfigure(1, weight=1)
+        main_frame.rowconfigure(3, weight=1)
+        plot_frame.columnconfigure(0, weight=1)
+        plot_frame.rowconfigure(0, weight=1)
+        
+        self.auto_play = False
+        self.auto_play_speed = 1.0
+        
+    def load_model(self):
+        """Load a trained model in the background (.pkl, compiled .npz or .onnx, see load_backend)"""
+        choice = self.choose_model_files()
+        if choice is None or 'model' in self.loading:
+            return
+        model_path, backend_options = choice
+        
+        def open_model(progress):
+            progress("Loading: opening model...")
+            return load_backend(model_path, **backend_options)
+        
+        self.run_in_background('model', self.model_label, open_model,
+                               lambda backend: self.model_loaded(backend, model_path),
+                               lambda e, tb: messagebox.showerror("Error", f"Failed to load model: {str(e)}"))
+    
+    def choose_model_files(self):
+        """
+        Asks which model to load.
+        
+        Returns:
+            (model_path, keyword arguments for load_backend), or None if cancelled.
+        """
+        model_path = filedialog.askopenfilename(
+            title="Select Model File",
+            filetypes=MODEL_FILETYPES
+        )
+        return (model_path, {}) if model_path else None
+    
+    def model_loaded(self, backend, model_path):
+        """Start using a newly loaded model (UI thread)"""
+        self.stop_worker()
+        self.stager = StreamingSleepStager(backend)
+        self.model = backend
+        self.describe_model(backend, model_path)
+        # The new engine has none of the replayed history (lags, rolling windows, sleep onset)
+        # and starts on an epoch boundary, so replay the recording from the start
+        if self.current_index:
+            self.reset_simulation()
+    
+    def describe_model(self, backend, model_path):
+        """Show and log what was loaded"""
+        self.model_label.config(text="Model loaded")
+        self.log_status(f"✓ Model loaded successfully from {model_path}")
+        self.log_status(f"  - Features: {len(backend.features)}")
+    
+    def load_csv_data(self):
+        """Load CSV data for simulation"""
+        file_path = filedialog.askopenfilename(
+            title="Select CSV Data File",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        
+        if not file_path or 'data' in self.loading:
+            return
+        
+        def read_csv(progress):
+            progress("Loading: reading CSV...")
+            raw_data = load_raw_csv(file_path, include_timestamp=True)
+            progress("Loading: preparing samples...")
+            # Contiguous arrays for the engine, so playback never goes through pandas per sample
+            return raw_data, SampleReplay.from_frame(raw_data)
+        
+        self.run_in_background('data', self.data_label, read_csv, self.csv_loaded,
+                               lambda e, tb: messagebox.showerror("Error", f"Failed to load CSV: {str(e)}"))
+    
+    def csv_loaded(self, loaded):
+        """Switch the simulation to a newly loaded recording (UI thread)"""
+        self.stop_worker()
+        self.raw_data, self.replay = loaded
+        self.current_index = 0
+        self.epoch_counter = 0
+        if self.stager is not None:
+            self.stager.reset()
+        self.prediction_history.clear()
+        self.time_history.clear()
+        
+        # Actual stages are computed lazily, a chunk ahead of the replay
+        self.actual_sleep_stages = EpochStageLabels(self.raw_data['sleep_stage'].to_numpy(dtype=np.float64))
+        self.hypnogram.reset(self.actual_sleep_stages)
+        
+        self.data_label.config(text=f"Data loaded: {len(self.raw_data)} rows")
+        self.log_status(f"✓ CSV data loaded: {len(self.raw_data)} rows")
+        self.log_status(f"  - Columns: {list(self.raw_data.columns)}", DEBUG)
+        self.log_status(f"  - First timestamp: {self.raw_data['timestamp'].iloc[0]}", DEBUG)
+        
+        # Initialize plot
+        self.update_plot()
+    
+    def run_in_background(self, task, label, work, on_done, on_error):
+        """
+        Runs work(progress) on a thread while the UI stays responsive.
+        progress(text) shows text in label; on_done(result) or on_error(exception, traceback)
+        is then called on the UI thread.
+        """
+        self.loading.add(task)
+        self.progress_bar.start(10)
+        previous_text = label.cget('text')
+        updates = queue.Queue()
+        outcome = {}
+        
+        def run():
+            try:
+                outcome['result'] = work(updates.put)
+            except Exception as e:
+                outcome['error'] = (e, traceback.format_exc())
+        
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        
+        def poll():
+            while not updates.empty():
+                label.config(text=updates.get_nowait())
+            if thread.is_alive():
+                self.root.after(UI_FRAME_MS, poll)
+                return
+            self.loading.discard(task)
+            if not self.loading:
+                self.progress_bar.stop()
+            if 'error' in outcome:
+                label.config(text=previous_text)
+                on_error(*outcome['error'])
+            else:
+                on_done(outcome['result'])
+        
+        self.root.after(UI_FRAME_MS, poll)
+    
+    def process_next_sample(self):
+        """Process the next 5-second sample and make prediction when 30s epoch is complete"""
+        if self.model is None or self.raw_data is None:
+            messagebox.showwarning("Warning", "Please load both model and data first")
+            return
+        
+        if self.worker is not None and self.worker.is_alive():
+            return  # The worker owns the engine during auto-play
+        
+        if self.current_index >= len(self.raw_data):
+            self.log_status("✓ End of data reached")
+            return
+        
+        # Get current 5-second sample
+        current_sample = self.replay.sample(self.current_index)
+        self.log_sample(self.current_index)
+        
+        # The engine scores the epoch once it has 6 samples (30 seconds)
+        try:
+            result = self.stager.push_sample(*current_sample)
+        except Exception as e:
+            result = {'error': f"Error processing epoch: {str(e)}"}
+        
+        self.current_index += 1
+        self.show_results([result] if result is not None else [])
+    
+    def log_sample(self, index):
+        """Log the values of one sample"""
+        if not self.status_log.is_enabled(DEBUG):
+            return
+        heart_rate, motion_x, motion_y, motion_z, _ = self.replay.sample(index)
+        self.log_status(f"Processing sample {index + 1}: "
+                       f"HR={heart_rate}, "
+                       f"Motion=({motion_x:.2f}, "
+                       f"{motion_y:.2f}, "
+                       f"{motion_z:.2f})", DEBUG)
+    
+    def show_results(self, results):
+        """Record new predictions and refresh the display once for all of them"""
+        latest = None
+        for result in results:
+            if 'error' in result:
+                self.log_status(result['error'], ERROR)
+                continue
+            # Store prediction for plotting
+            self.prediction_history.append(result['stage'])
+            self.time_history.append(result['epoch'])
+            self.hypnogram.append(result['epoch'], result['stage'])
+            latest = result
+        
+        if latest is not None:
+            self.epoch_counter = latest['epoch'] + 1
+            self.display_prediction(latest['stage'], latest['confidence'], latest['features'])
+            self.update_plot()
+        
+        # Update progress
+        progress = (self.current_index / len(self.raw_data)) * 100
+        self.root.title(f"Live Sleep Stage Predictor - Progress: {progress:.1f}%")
+    
+    def display_prediction(self, prediction, confidence, features):
+        """Display the current prediction and features"""
+        stage_names = {0: 'WAKE', 1: 'LIGHT', 2: 'DEEP', 3: 'REM'}
+        stage_colors = {0: 'red', 1: 'darkorange', 2: 'blue', 3: 'green'}
+        
+        stage_name = stage_names.get(prediction, 'UNKNOWN')
+        color = stage_colors.get(prediction, 'gray')
+        
+        self.prediction_label.config(
+            text=f"Predicted Stage: {stage_name}",
+            foreground=color
+        )
+        
+        self.confidence_label.config(
+            text=f"Confidence: {confidence:.2%}",
+            foreground=color
+        )
+        
+        # Display important features
+        if features is not None:
+            feature_text = "Current Features:\n"
+            important_features = {
+                'hr_mean': 'Heart Rate Mean',
+                'hr_std': 'HR Variability',
+                'hr_rmssd': 'HR RMSSD',
+                'motion_x_std': 'Motion X STD'
+            }
+            
+            for feat_key, feat_name in important_features.items():
+                if feat_key in features:
+                    value = features[feat_key]
+                    feature_text += f"{feat_name}: {value:.2f}\n"
+            
+            self.feature_text.delete(1.0, tk.END)
+            self.feature_text.insert(1.0, feature_text)
+        
+        self.log_status(f"✓ Epoch {self.epoch_counter}: Predicted {stage_name} "
+                       f"(confidence: {confidence:.2%})")
+    
+    # def update_plot(self):
+    #     """Update the live prediction plot"""
+    #     self.ax.clear()
+        
+    #     if self.prediction_history:
+    #         # Create colormap for sleep stages
+    #         colors = [['red', 'darkorange', 'blue', 'green'][int(p)] for p in self.prediction_history]
+            
+    #         time_seconds = [t * 30 for t in self.time_history]
+            
+    #         self.ax.scatter(time_seconds, self.prediction_history, 
+    #                        c=colors, s=50, alpha=0.7)
+    #         self.ax.plot(time_seconds, self.prediction_history, 
+    #                     'gray', alpha=0.3, linewidth=1)
+        
+    #     self.ax.set_yticks([0, 1, 2, 3])
+    #     self.ax.set_yticklabels(['WAKE', 'LIGHT', 'DEEP', 'REM'])
+    #     self.ax.set_ylabel('Sleep Stage')
+    #     self.ax.set_xlabel('Time Since Start (seconds)')
+    #     self.ax.set_title('Live Sleep Stage Predictions')
+    #     self.ax.grid(True, alpha=0.3)
+    #     self.ax.set_ylim(-0.5, 3.5)
+        
+    #     self.canvas.draw()
+    
+    def update_plot(self):
+        """Update the live prediction plot with actual vs predicted (only the new points are drawn)"""
+        self.hypnogram.update(self.epoch_counter)
+    
+    def start_auto_play(self, speed=1.0):
+        """Start automatic playback"""
+        if self.model is None or self.raw_data is None:
+            messagebox.showwarning("Warning", "Please load both model and data first")
+            return
+        
+        self.stop_worker()
+        self.auto_play = True
+        self.auto_play_speed = speed
+        
+        # Featurization and inference run on the worker; the UI only drains its results
+        self.worker = ReplayWorker(self.stager, self.replay, self.current_index,
+                                   interval=1.0 * speed, results=self.results)  # Simulate real-time with speed factor
+        self.worker.start()
+        self.schedule_drain()
+        
+        speed_text = f"{1/self.auto_play_speed:.1f}x speed" if speed else "max speed"
+        self.log_status(f"▶ Started auto-play ({speed_text})")
+    
+    def schedule_drain(self):
+        if self.drain_job is None:
+            self.drain_job = self.root.after(UI_FRAME_MS, self.drain_results)
+    
+    def drain_results(self):
+        """Once per frame: take everything the worker produced and show it with a single redraw"""
+        if self.drain_job is not None:
+            self.root.after_cancel(self.drain_job)  # No-op when called from the timer itself
+            self.drain_job = None
+        # Check before reading: once the worker has finished, its queue and position are final
+        worker = self.worker
+        finished = worker is not None and not worker.is_alive()
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        
+        if worker is not None:
+            if worker.position > self.current_index:
+                self.log_sample(worker.position - 1)  # Only the latest sample of the frame
+            self.current_index = worker.position
+        if results or worker is not None:
+            self.show_results(results)
+        
+        if worker is not None and not finished:
+            self.schedule_drain()
+        elif worker is not None:
+            self.worker = None
+            self.auto_play = False
+            if self.current_index >= len(self.raw_data):
+                self.log_status("✓ End of data reached")
+    
+    def stop_worker(self):
+        """Stop the worker and take over its last results"""
+        if self.worker is not None:
+            self.worker.stop()
+            self.drain_results()
+        self.auto_play = False
+    
+    def stop_auto_play(self):
+        """Stop automatic playback"""
+        self.stop_worker()
+        self.log_status("⏹ Stopped auto-play")
+    
+    def reset_simulation(self):
+        """Reset the simulation to start"""
+        self.stop_worker()
+        self.current_index = 0
+        self.epoch_counter = 0
+        self.prediction_history.clear()
+        self.time_history.clear()
+        
+        if self.stager is not None:
+            self.stager.reset()
+        
+        self.prediction_label.config(text="No prediction yet", foreground="black")
+        self.confidence_label.config(text="", foreground="black")
+        self.feature_text.delete(1.0, tk.END)
+        self.hypnogram.reset()
+        self.update_plot()
+        self.log_status("✓ Simulation reset")
+        self.root.title("Live Sleep Stage Predictor")
+    
+    def log_status(self, message, level=INFO):
+        """Add message to status log (shown at the next flush)"""
+        self.status_log.log(message, level)
+    
+    def flush_status(self):
+        """Write the buffered status messages to the log widget"""
+        self.status_log.flush(self.status_text)
+        self.root.after(STATUS_FLUSH_MS, self.flush_status)
+    
+    def toggle_verbose(self):
+        """Show or hide per-sample and model detail messages"""
+        self.status_log.level = DEBUG if self.verbose_var.get() else INFO
@@ -0,0 +1,309 @@
+# In file: model_backends.py
+
+import os
+import json
+import pickle
+import numpy as np
+import pandas as pd
+
+from tree_compiler import CompiledEnsemble
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+if ONNXRUNTIME_AVAILABLE:
+    from onnx_sessions import create_preset_session
+
+STAGE_LABELS = ['Wake', 'Light', 'Deep', 'REM']
+STAGE_INDICES = [0, 1, 2, 3]
+
+# ONNX metadata flag set on models that take raw features and normalize them in the graph
+NORMALIZATION_METADATA_KEY = 'normalization_embedded'
+
+class NormalizationStats:
+    """
+    Feature order and normalization vectors of a trained model.
+
+    Normalization is the same as in training, (X - mean) / (std + 1e-6) with
+    zero-std features set to 0, but done on plain float arrays instead of
+    aligning pandas Series for every call.
+
+    Args:
+        features (list): Feature names, in model input order.
+        mean: Per-feature means, as a dict/Series keyed by feature or a sequence in feature order.
+        std: Per-feature standard deviations, same forms as mean.
+    """
+    def __init__(self, features: list, mean, std):
+        self.features = list(features)
+        self.mean = self._as_vector(mean)
+        self.std = self._as_vector(std)
+        self.zero_std = self.std < 1e-6
+        self.denominator = self.std + 1e-6
+
+    def _as_vector(self, values) -> np.ndarray:
+        if isinstance(values, (dict, pd.Series)):
+            values = [values[feature] for feature in self.features]
+        return np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_json(cls, stats_path: str) -> 'NormalizationStats':
+        """Reads the stats JSON written next to an ONNX model"""
+        with open(stats_path, 'r') as f:
+            stats_data = json.load(f)
+        return cls(stats_data['features'], stats_data['mean'], stats_data['std'])
+
+    @classmethod
+    def from_bundle(cls, normalization_stats: dict) -> 'NormalizationStats':
+        """Reads the normalization_stats entry of a pickle bundle"""
+        return cls(normalization_stats['features'], normalization_stats['mean'], normalization_stats['std'])
+
+    def as_series(self) -> dict:
+        """The stats in the pickle-bundle form ({'mean': Series, 'std': Series, 'features': list})"""
+        return {
+            'mean': pd.Series(self.mean, index=self.features),
+            'std': pd.Series(self.std, index=self.features),
+            'features': self.features
+        }
+
+    def feature_matrix(self, processed_df: pd.DataFrame) -> np.ndarray:
+        """Processed features in model order as float64; features the frame lacks are 0"""
+        return processed_df.reindex(columns=self.features, fill_value=0).to_numpy(dtype=np.float64)
+
+    def normalize(self, X: np.ndarray, dtype=np.float32) -> np.ndarray:
+        """
+        Normalizes a (n, num_features) matrix in model order. The arithmetic is
+        float64; only the result is cast to dtype (a backend's input_dtype).
+        """
+        X_normalized = (np.asarray(X, dtype=np.float64) - self.mean) / self.denominator
+        X_normalized[:, self.zero_std] = 0
+        return X_normalized.astype(dtype, copy=False)
+
+class FeatureVectorAssembler:
+    """
+    Turns one epoch's features into a model input row without pandas.
+
+    Built once when a model is loaded: the feature positions, mean and
+    denominator vectors are precomputed, and each call writes into the same
+    preallocated (1, num_features) buffer. Features the epoch lacks are 0
+    before normalization, as with reindex(fill_value=0).
+
+    The arithmetic runs in float64 before the cast to the buffer dtype, so the
+    result is bit-identical to the pandas normalization; doing it in float32
+    moves values across split thresholds.
+
+    Args:
+        stats (NormalizationStats): Feature order and normalization vectors.
+        normalize (bool): False for models that normalize their own input.
+        dtype: Buffer dtype, float32 for ONNX, float64 for the pickled models.
+    """
+    def __init__(self, stats: NormalizationStats, normalize: bool = True, dtype=np.float32):
+        self.features = stats.features
+        self.normalize = normalize
+        self.positions = {feature: i for i, feature in enumerate(self.features)}
+        self.mean = stats.mean.copy()
+        self.denominator = stats.denominator.copy()
+        self.zero_std = np.flatnonzero(stats.zero_std)
+        self.raw = np.zeros(len(self.features), dtype=np.float64)
+        self.buffer = np.zeros((1, len(self.features)), dtype=dtype)
+        self._bindings = {}
+
+    def bind(self, columns) -> tuple:
+        """(source, destination) index arrays mapping a column order onto the model order, cached per order"""
+        key = tuple(columns)
+        binding = self._bindings.get(key)
+        if binding is None:
+            pairs = [(i, self.positions[column]) for i, column in enumerate(key) if column in self.positions]
+            source = np.array([i for i, _ in pairs], dtype=np.intp)
+            destination = np.array([j for _, j in pairs], dtype=np.intp)
+            binding = self._bindings[key] = (source, destination)
+        return binding
+
+    def assemble_array(self, values: np.ndarray, columns) -> np.ndarray:
+        """Assembles from a 1-D array of values in the given column order"""
+        source, destination = self.bind(columns)
+        self.raw.fill(0.0)
+        self.raw[destination] = values[source]
+        return self._finish()
+
+    def assemble(self, features) -> np.ndarray:
+        """Assembles from a mapping of feature name to value"""
+        self.raw.fill(0.0)
+        positions = self.positions
+        for feature, value in features.items():
+            i = positions.get(feature)
+            if i is not None:
+                self.raw[i] = value
+        return self._finish()
+
+    def assemble_frame(self, epoch_df: pd.DataFrame) -> np.ndarray:
+        """Assembles from the first row of a processed single-epoch DataFrame"""
+        # Iterating a pandas Index is slow; the NumPy copy of the labels is much cheaper to key on
+        return self.assemble_array(epoch_df.to_numpy(dtype=np.float64)[0], tuple(epoch_df.columns.to_numpy()))
+
+    def _finish(self) -> np.ndarray:
+        raw = self.raw
+        if self.normalize:
+            np.subtract(raw, self.mean, out=raw)
+            np.divide(raw, self.denominator, out=raw)
+            raw[self.zero_std] = 0.0
+        # The buffer is reused: consume it before the next call
+        self.buffer[0] = raw
+        return self.buffer
+
+class ModelBackend:
+    """
+    Common interface of the trained-model artifacts: normalized matrix in,
+    (n, 4) stage probabilities out.
+
+    input_dtype is what the model is fed on every path (predict_proba and
+    make_assembler alike): float64 like the training DataFrames for the pickled
+    and compiled models, the session's input type for ONNX.
+    """
+    stats = None
+    input_dtype = np.float64
+
+    @property
+    def features(self) -> list:
+        return self.stats.features
+
+    def predict_proba_normalized(self, X_normalized: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probabilities for raw (not yet normalized) features in model order"""
+        return self.predict_proba_normalized(self.stats.normalize(X, self.input_dtype))
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predicted stage indices for raw features in model order"""
+        return np.argmax(self.predict_proba(X), axis=1)
+
+    def make_assembler(self) -> 'FeatureVectorAssembler':
+        """A FeatureVectorAssembler producing this model's input, for predict_proba_assembled"""
+        return FeatureVectorAssembler(self.stats, dtype=self.input_dtype)
+
+    def predict_proba_assembled(self, X_input: np.ndarray) -> np.ndarray:
+        """Probabilities for rows built by make_assembler()"""
+        return self.predict_proba_normalized(X_input)
+
+class PickleBackend(ModelBackend):
+    """
+    The .pkl bundle written by the trainers ({'model': ..., 'normalization_stats': ...}).
+    """
+    def __init__(self, model_path: str):
+        with open(model_path, 'rb') as f:
+            bundle = pickle.load(f)
+        self.model = bundle['model']
+        self.stats = NormalizationStats.from_bundle(bundle['normalization_stats'])
+        self.classes = [int(c) for c in getattr(self.model, 'classes_', STAGE_INDICES)]
+
+    def predict_proba_normalized(self, X_normalized: np.ndarray) -> np.ndarray:
+        # The models were fitted on DataFrames; keep the feature names to avoid sklearn warnings
+        X_frame = pd.DataFrame(X_normalized, columns=self.features, copy=False)
+        probabilities = self.model.predict_proba(X_frame)
+        # Put the columns in stage order even if a class was missing at training time
+        result = np.zeros((len(X_normalized), len(STAGE_INDICES)), dtype=np.float32)
+        result[:, self.classes] = probabilities
+        return result
+
+class CompiledBackend(ModelBackend):
+    """
+    A model compiled with tree_compiler.compile_model_bundle: the trees as NumPy
+    arrays plus the normalization stats, in one .npz file. Loading and predicting
+    need neither the training libraries nor onnxruntime.
+    """
+    def __init__(self, model_path: str):
+        with np.load(model_path, allow_pickle=False) as data:
+            self.ensemble = CompiledEnsemble.from_npz(data)
+            self.stats = NormalizationStats(data['stats_features'].tolist(), data['stats_mean'], data['stats_std'])
+        self.classes = self.ensemble.classes
+
+    def predict_proba_normalized(self, X_normalized: np.ndarray) -> np.ndarray:
+        probabilities = self.ensemble.predict_proba(X_normalized)
+        result = np.zeros((len(probabilities), len(STAGE_INDICES)), dtype=np.float32)
+        result[:, self.classes] = probabilities
+        return result
+
+def onnx_normalization_embedded(session) -> bool:
+    """True if an ONNX model was exported with the normalization folded into its graph"""
+    return session.get_modelmeta().custom_metadata_map.get(NORMALIZATION_METADATA_KEY) == 'true'
+
+def onnx_input_dtype(session):
+    """NumPy dtype of a session's input (float64 for models with embedded normalization)"""
+    return np.float64 if session.get_inputs()[0].type == 'tensor(double)' else np.float32
+
+def onnx_has_zipmap(session) -> bool:
+    """True if the probability output of an ONNX session is a ZipMap (sequence of dicts) instead of a tensor"""
+    return session.get_outputs()[1].type.startswith('seq')
+
+def probabilities_from_onnx(probabilities) -> np.ndarray:
+    """
+    Converts the probability output of an ONNX classifier to a (n, 4) float32 array.
+    Tensor outputs are returned as they are; ZipMap outputs from older exports are unpacked.
+    """
+    if isinstance(probabilities, list):
+        return np.array([[row.get(c, 0.0) for c in STAGE_INDICES] for row in probabilities], dtype=np.float32)
+    return np.asarray(probabilities, dtype=np.float32)
+
+class OnnxBackend(ModelBackend):
+    """
+    An exported .onnx model plus its stats JSON.
+
+    Models exported with embed_normalization take raw float64 features; predict_proba
+    then feeds them to the session as they are and the stats only give the
+    feature order.
+
+    Args:
+        onnx_path (str): Path of the .onnx file.
+        stats_path (str): Path of the stats JSON. Defaults to <model>_stats.json next to the model.
+        session_preset (str): Session settings from onnx_sessions.SESSION_PRESETS.
+        cache_dir (str): Folder for the optimized-model cache. None disables it.
+    """
+    def __init__(self, onnx_path: str, stats_path: str = None, session_preset: str = 'batch', cache_dir: str = None):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise ImportError("onnxruntime is required for ONNX models. Install with: pip install onnxruntime")
+        if stats_path is None:
+            stats_path = onnx_path[:-len('.onnx')] + '_stats.json'
+        self.session = create_preset_session(onnx_path, session_preset, cache_dir)
+        self.stats = NormalizationStats.from_json(stats_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.probability_name = self.session.get_outputs()[1].name
+        self.zipmap = onnx_has_zipmap(self.session)
+        self.normalization_embedded = onnx_normalization_embedded(self.session)
+        self.input_dtype = onnx_input_dtype(self.session)
+
+    def run(self, X_input: np.ndarray) -> np.ndarray:
+        """Runs the session on whatever input the model expects"""
+        probabilities = self.session.run([self.probability_name], {self.input_name: X_input})[0]
+        return probabilities_from_onnx(probabilities)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        if self.normalization_embedded:
+            return self.run(np.asarray(X, dtype=self.input_dtype))
+        return self.run(self.stats.normalize(X, self.input_dtype))
+
+    def make_assembler(self) -> FeatureVectorAssembler:
+        return FeatureVectorAssembler(self.stats, normalize=not self.normalization_embedded, dtype=self.input_dtype)
+
+    def predict_proba_assembled(self, X_input: np.ndarray) -> np.ndarray:
+        return self.run(X_input)
+
+    def predict_proba_normalized(self, X_normalized: np.ndarray) -> np.ndarray:
+        if self.normalization_embedded:
+            raise ValueError("This ONNX model normalizes its own input; pass raw features to predict_proba")
+        return self.run(X_normalized)
+
+def load_backend(model_path: str, stats_path: str = None, **onnx_options) -> ModelBackend:
+    """
+    Opens a .pkl bundle, a compiled .npz or an .onnx model (with its stats JSON) behind the same interface.
+    onnx_options (session_preset, cache_dir) are passed on to OnnxBackend.
+    """
+    if model_path.endswith('.onnx'):
+        return OnnxBackend(model_path, stats_path, **onnx_options)
+    if model_path.endswith('.pkl'):
+        return PickleBackend(model_path)
+    if model_path.endswith('.npz'):
+        return CompiledBackend(model_path)
+    raise ValueError(f"Unknown model file type: {os.path.basename(model_path)} (expected .pkl, .npz or .onnx)")
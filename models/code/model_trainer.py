@@ -9,72 +9,85 @@ import matplotlib.pyplot as plt
 from sklearn.utils.class_weight import compute_sample_weight
 
 # Import your previously created modules
-from processing_pipeline import process_single_subject
+from processing_pipeline import process_single_subject, process_csv_folder
 from model_definitions import get_model
+from subject_cache import SubjectCache
+from dataset_builder import load_normalized_datasets
 
-def load_and_process_data(folder_path: str) -> pd.DataFrame:
+def load_and_process_data(folder_path, n_workers: int = 1, cache_dir: str = None) -> pd.DataFrame:
     """
-    Loads all CSVs from a folder, processes each one, and concatenates them.
+    Loads all CSVs from a folder (or a list of recording paths), processes each one, and concatenates them.
     (This function is reused from the previous response for completeness).
+    With n_workers > 1 the subjects are processed in parallel worker processes,
+    and with a cache_dir unchanged subjects are read back from the cache.
     """
-    processed_dfs = []
-    all_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
-    print(f"Found {len(all_files)} files to process in {folder_path}...")
-    
-    for filename in all_files:
-        file_path = os.path.join(folder_path, filename)
-        raw_df = pd.read_csv(file_path)
-        print(f"  - Processing {filename}...")
-        processed_df = process_single_subject(raw_df)
-        processed_dfs.append(processed_df)
+    cache = SubjectCache(cache_dir) if cache_dir else None
+    processed_dfs = process_csv_folder(folder_path, process_single_subject, n_workers, cache)
         
     print("Concatenating all processed subjects...")
     final_dataset = pd.concat(processed_dfs, ignore_index=True)
     return final_dataset
 
-def train_and_evaluate(train_folder: str, test_folder: str, model_name: str, model_save_path: str):
+def train_and_evaluate(train_folder, test_folder, model_name: str, model_save_path: str,
+                       n_workers: int = 1, cache_dir: str = None, streaming: bool = False):
     """
     Orchestrates the full training and evaluation pipeline.
 
     Args:
-        train_folder (str): Path to the folder with training CSVs.
-        test_folder (str): Path to the folder with testing CSVs.
+        train_folder: Path to the folder with training CSVs, or a list of recording
+                      paths (e.g. from CohortManifest.split).
+        test_folder: Path to the folder with testing CSVs, or a list of recording paths.
         model_name (str): The name of the model to train (e.g., 'xgboost').
         model_save_path (str): Path to save the trained model pickle file.
+        n_workers (int): Worker processes used to featurize the subjects.
+        cache_dir (str): Optional folder for the processed-subject cache.
+        streaming (bool): Assemble the datasets straight into float32 matrices
+                          instead of concatenating DataFrames (lower peak memory).
     """
-    # 1. Load and process data
-    train_df = load_and_process_data(train_folder)
-    test_df = load_and_process_data(test_folder)
-
-    # 2. Separate features (X) and target (y)
-    X_train = train_df.drop('sleep_stage', axis=1)
-    y_train = train_df['sleep_stage']
-    X_test = test_df.drop('sleep_stage', axis=1)
-    y_test = test_df['sleep_stage']
+    cache = SubjectCache(cache_dir) if cache_dir else None
+    
+    if streaming:
+        # 1-2. Stream subjects into float32 matrices, normalized with the training stats
+        train_data, test_data, mean_stats, std_stats = load_normalized_datasets(
+            train_folder, test_folder, process_single_subject, n_workers, cache)
+        features_to_normalize = train_data.features
+        X_train_normalized, y_train = train_data.as_frame(), train_data.y
+        X_test_normalized, y_test = test_data.as_frame(), test_data.y
+        X_train, X_test = X_train_normalized, X_test_normalized
+    else:
+        # 1. Load and process data
+        train_df = load_and_process_data(train_folder, n_workers, cache_dir)
+        test_df = load_and_process_data(test_folder, n_workers, cache_dir)
+
+        # 2. Separate features (X) and target (y)
+        X_train = train_df.drop('sleep_stage', axis=1)
+        y_train = train_df['sleep_stage']
+        X_test = test_df.drop('sleep_stage', axis=1)
+        y_test = test_df['sleep_stage']
     
     
-    print("\nCalculating normalization stats from the training set...")
-    # Define which features to normalize
-    features_to_normalize = [col for col in X_train.columns if 'sleep_stage' not in col]
+        print("\nCalculating normalization stats from the training set...")
+        # Define which features to normalize
+        features_to_normalize = [col for col in X_train.columns if 'sleep_stage' not in col]
     
-    # Calculate mean and std for each feature across the entire training dataset
-    mean_stats = X_train[features_to_normalize].mean()
-    std_stats = X_train[features_to_normalize].std()
+        # Calculate mean and std for each feature across the entire training dataset
+        mean_stats = X_train[features_to_normalize].mean()
+        std_stats = X_train[features_to_normalize].std()
     
-    zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
-    if zero_std_cols:
-        print(f"Warning: The following features have zero standard deviation and will be set to 0: {zero_std_cols}")
+        zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
+        if zero_std_cols:
+            print(f"Warning: The following features have zero standard deviation and will be set to 0: {zero_std_cols}")
     
-    print("Applying normalization to training and testing sets...")
+        print("Applying normalization to training and testing sets...")
     
-    # Normalize the data safely
-    X_train_normalized = (X_train[features_to_normalize] - mean_stats) / (std_stats + 1e-6) # Add epsilon for safety
-    X_test_normalized = (X_test[features_to_normalize] - mean_stats) / (std_stats + 1e-6)   # Add epsilon for safety
+        # Normalize the data safely
+        X_train_normalized = (X_train[features_to_normalize] - mean_stats) / (std_stats + 1e-6) # Add epsilon for safety
+        X_test_normalized = (X_test[features_to_normalize] - mean_stats) / (std_stats + 1e-6)   # Add epsilon for safety
     
-    # For any columns that were constant, the result of normalization could be NaN, so set them to 0.
-    if zero_std_cols:
-        X_train_normalized[zero_std_cols] = 0
-        X_test_normalized[zero_std_cols] = 0
+        # For any columns that were constant, the result of normalization could be NaN, so set them to 0.
+        if zero_std_cols:
+            X_train_normalized[zero_std_cols] = 0
+            X_test_normalized[zero_std_cols] = 0
 
     # Bundle the stats for saving. We must save the column list as well.
     mean_std_stats = {
@@ -145,5 +158,9 @@ if __name__ == '__main__':
     TEST_FOLDER = './test_data'
     MODEL_NAME = 'xgboost'  # or 'random_forest'
     MODEL_SAVE_PATH = f'./{MODEL_NAME}_sleep_model7.pkl'
+    N_WORKERS = os.cpu_count()
+    CACHE_DIR = './processed_cache'
 
-    train_and_evaluate(TRAIN_FOLDER, TEST_FOLDER, MODEL_NAME, MODEL_SAVE_PATH)
\ No newline at end of file
+    # To pick nights by metadata instead, pass file lists from a manifest, e.g.
+    #   TRAIN_FOLDER, TEST_FOLDER = CohortManifest('./all_data').split(0.2, query="duration_hours >= 6", only_ok=True)
+    train_and_evaluate(TRAIN_FOLDER, TEST_FOLDER, MODEL_NAME, MODEL_SAVE_PATH, N_WORKERS, CACHE_DIR)
\ No newline at end of file
@@ -0,0 +1,130 @@
+# In file: onnx_sessions.py
+
+import os
+import hashlib
+import platform
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+    print("ONNX Runtime not installed. Please install with: pip install onnxruntime")
+
+# Settings for the two ways the models are used. A single epoch is far too small
+# to split across threads, so the live preset runs everything on the calling thread;
+# intra_op_threads=0 lets ORT use every core for large batches.
+SESSION_PRESETS = {
+    'live': {'intra_op_threads': 1, 'inter_op_threads': 1, 'execution_mode': 'sequential',
+             'optimization_level': 'all'},
+    'batch': {'intra_op_threads': 0, 'inter_op_threads': 1, 'execution_mode': 'sequential',
+              'optimization_level': 'all'}
+}
+
+EXECUTION_MODES = {
+    'sequential': 'ORT_SEQUENTIAL',
+    'parallel': 'ORT_PARALLEL'
+}
+
+OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+
+def model_cache_key(onnx_path: str, optimization_level: str) -> str:
+    """
+    Key of an optimized model in the cache: the model contents plus everything the
+    optimized graph depends on (ORT version, CPU architecture, optimization level).
+    """
+    sha = hashlib.sha256()
+    with open(onnx_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    sha.update(f"{ort.__version__}|{platform.machine()}|{optimization_level}".encode())
+    return sha.hexdigest()[:24]
+
+def make_session_options(intra_op_threads: int = 1, inter_op_threads: int = 1, execution_mode: str = 'sequential',
+                         optimization_level: str = 'all'):
+    """Builds ort.SessionOptions from plain settings (thread count 0 means ORT's default)"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[execution_mode])
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, OPTIMIZATION_LEVELS[optimization_level])
+    return options
+
+def create_session(onnx_path: str, intra_op_threads: int = 1, inter_op_threads: int = 1,
+                   execution_mode: str = 'sequential', optimization_level: str = 'all', cache_dir: str = None):
+    """
+    Creates a configured ONNX Runtime session, reusing a cached optimized model if there is one.
+
+    The first time a model is opened with a cache_dir, ORT's optimized graph is
+    saved there in ORT format under model_cache_key. Later starts load that file
+    with graph optimization switched off, skipping both protobuf parsing and the
+    optimizer passes. A changed model, ORT version or optimization level gets a new key.
+
+    Args:
+        onnx_path (str): Path of the .onnx (or .ort) model.
+        intra_op_threads (int): Threads used inside one operator, 0 for ORT's default.
+        inter_op_threads (int): Threads used across operators in parallel mode.
+        execution_mode (str): 'sequential' or 'parallel'.
+        optimization_level (str): 'disable', 'basic', 'extended' or 'all'.
+        cache_dir (str): Folder for optimized models. None disables caching.
+
+    Returns:
+        An ort.InferenceSession on the CPU provider.
+    """
+    providers = ['CPUExecutionProvider']
+    options = make_session_options(intra_op_threads, inter_op_threads, execution_mode, optimization_level)
+
+    if cache_dir is None or onnx_path.endswith('.ort'):
+        return ort.InferenceSession(onnx_path, options, providers=providers)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, f"{model_cache_key(onnx_path, optimization_level)}.ort")
+
+    if os.path.exists(cached_path):
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(cached_path, options, providers=providers)
+        except Exception as e:
+            print(f"⚠️ Cached optimized model is unusable, rebuilding: {str(e)}")
+            options.graph_optimization_level = getattr(ort.GraphOptimizationLevel,
+                                                       OPTIMIZATION_LEVELS[optimization_level])
+
+    # Optimize once and save the result; write to a temporary name so readers never see a partial file
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp.ort"
+    options.optimized_model_filepath = tmp_path
+    options.add_session_config_entry('session.save_model_format', 'ORT')
+    options.log_severity_level = 3  # The cache is per machine, so the hardware-specific warning does not apply
+    session = ort.InferenceSession(onnx_path, options, providers=providers)
+    try:
+        os.replace(tmp_path, cached_path)
+    except OSError:
+        pass
+    return session
+
+def create_preset_session(onnx_path: str, preset: str = 'live', cache_dir: str = None):
+    """create_session with one of the SESSION_PRESETS"""
+    return create_session(onnx_path, cache_dir=cache_dir, **SESSION_PRESETS[preset])
+
+def convert_to_ort_format(onnx_path: str, ort_path: str = None, optimization_level: str = 'basic') -> str:
+    """
+    Converts an .onnx model to ORT format for fast loading, e.g. to ship next to the .onnx.
+
+    Basic optimizations only depend on the graph, so the result is portable across
+    machines; higher levels may bake in CPU-specific kernels (use the session cache for those).
+
+    Returns:
+        The path of the .ort file.
+    """
+    if ort_path is None:
+        ort_path = os.path.splitext(onnx_path)[0] + '.ort'
+    options = make_session_options(optimization_level=optimization_level)
+    options.optimized_model_filepath = ort_path
+    options.add_session_config_entry('session.save_model_format', 'ORT')
+    ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+    print(f"✅ ORT format model saved to: {ort_path}")
+    return ort_path
@@ -1,13 +1,19 @@
 # In file: processing_pipeline.py
 
 import pandas as pd
+import numpy as np
+import os
 from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 
 # Import the functions from your other modules
 from label_processor import remap_sleep_stages
+from recording_store import load_raw_recording, raw_content_hash, resolve_raw_files, describe_source
 from feature_engineering import create_30s_epochs
 from temporal_features import add_temporal_features, add_time_since_sleep_onset
-from temporal_features import add_live_temporal_features, add_live_time_since_sleep_onset
+from temporal_features import LiveFeatureState, SleepOnsetTracker, LIVE_ONSET_LEGACY_WINDOW
+from temporal_features import add_live_temporal_features_batch, add_live_time_since_sleep_onset_batch
+from temporal_features import add_live_temporal_features, add_live_time_since_sleep_onset, LIVE_BUFFER_SIZE
 
 def process_single_subject(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -36,9 +42,14 @@ def process_single_subject(df: pd.DataFrame) -> pd.DataFrame:
     
     return df_clean
 
-def process_subject_live_simulation(raw_df: pd.DataFrame) -> pd.DataFrame:
+def process_subject_live_simulation(raw_df: pd.DataFrame,
+                                    legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW) -> pd.DataFrame:
     """
-    Processes data to simulate live conditions - only uses past data for features
+    Processes data to simulate live conditions - only uses past data for features.
+    legacy_onset selects the original buffer-relative time_since_sleep_onset.
+
+    This is the reference implementation (epoch by epoch over a deque of past
+    epochs); the batch path and LiveFeatureState are checked against it.
     """
     # Step 1: Remap sleep stages
     df_labeled = remap_sleep_stages(raw_df)
@@ -48,7 +59,8 @@ def process_subject_live_simulation(raw_df: pd.DataFrame) -> pd.DataFrame:
     
     # Step 3: Process each epoch with only past data available
     live_processed_epochs = []
-    previous_epochs_buffer = deque(maxlen=50)  # Keep last 50 epochs
+    previous_epochs_buffer = deque(maxlen=LIVE_BUFFER_SIZE)  # Keep last 50 epochs
+    onset_tracker = None if legacy_onset else SleepOnsetTracker()
     
     for i in range(len(df_epochs)):
         current_epoch = df_epochs.iloc[i:i+1].copy()
@@ -57,7 +69,10 @@ def process_subject_live_simulation(raw_df: pd.DataFrame) -> pd.DataFrame:
         epoch_with_temporal = add_live_temporal_features(current_epoch, previous_epochs_buffer)
         
         # Add live time since sleep onset
-        epoch_with_onset = add_live_time_since_sleep_onset(epoch_with_temporal, previous_epochs_buffer)
+        if legacy_onset:
+            epoch_with_onset = add_live_time_since_sleep_onset(epoch_with_temporal, previous_epochs_buffer)
+        else:
+            epoch_with_onset = onset_tracker.add_feature(epoch_with_temporal)
         
         # Add to results
         live_processed_epochs.append(epoch_with_onset)
@@ -71,4 +86,196 @@ def process_subject_live_simulation(raw_df: pd.DataFrame) -> pd.DataFrame:
         final_df = pd.concat(live_processed_epochs, ignore_index=True)
         return final_df.dropna().reset_index(drop=True)
     else:
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame()
+
+def process_subject_live_simulation_batch(raw_df: pd.DataFrame,
+                                          legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW) -> pd.DataFrame:
+    """
+    Vectorized version of process_subject_live_simulation.
+
+    Produces the same live-compatible columns in one pass over the whole epoch
+    table instead of walking the epochs one at a time.
+
+    Args:
+        raw_df: The raw 5-second interval DataFrame for one subject.
+        legacy_onset: Use the original buffer-relative time_since_sleep_onset.
+
+    Returns:
+        The processed DataFrame, matching process_subject_live_simulation.
+    """
+    # Step 1: Remap sleep stages
+    df_labeled = remap_sleep_stages(raw_df)
+    
+    # Step 2: Create 30-second epochs
+    df_epochs = create_30s_epochs(df_labeled)
+    
+    if df_epochs.empty:
+        return pd.DataFrame()
+    
+    # Step 3: Add live temporal features for all epochs at once
+    df_temporal = add_live_temporal_features_batch(df_epochs)
+    
+    # Step 4: Add live time since sleep onset
+    df_with_onset = add_live_time_since_sleep_onset_batch(df_temporal, legacy_window=legacy_onset)
+    
+    return df_with_onset.dropna().reset_index(drop=True)
+
+def verify_live_simulation_parity(raw_df: pd.DataFrame, legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW) -> bool:
+    """
+    Checks that the batch and per-epoch live simulations produce exactly the same output.
+    """
+    per_epoch_df = process_subject_live_simulation(raw_df.copy(), legacy_onset)
+    batch_df = process_subject_live_simulation_batch(raw_df.copy(), legacy_onset)
+    
+    try:
+        pd.testing.assert_frame_equal(batch_df, per_epoch_df, check_exact=True)
+    except AssertionError as e:
+        print(f"❌ Live simulation parity check failed: {str(e)}")
+        return False
+    
+    print(f"✅ Batch live simulation matches the per-epoch path ({len(batch_df)} epochs)")
+    return True
+
+def verify_live_feature_state(raw_df: pd.DataFrame, legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW,
+                              rtol: float = 1e-9, atol: float = 1e-12) -> bool:
+    """
+    Checks the incremental LiveFeatureState and SleepOnsetTracker (used by the
+    live apps and services) against the reference per-epoch simulation.
+
+    Lags and onset must match exactly. The rolling stats come from sliding
+    Welford accumulators, so they may differ from the reference by rounding,
+    within rtol/atol.
+    """
+    reference_df = process_subject_live_simulation(raw_df.copy(), legacy_onset)
+    
+    df_epochs = create_30s_epochs(remap_sleep_stages(raw_df.copy()))
+    live_feature_state = LiveFeatureState(dtype=np.float64)
+    onset_tracker = SleepOnsetTracker(legacy_window=legacy_onset)
+    incremental_epochs = [onset_tracker.add_feature(live_feature_state.add_features(df_epochs.iloc[i:i+1].copy()))
+                          for i in range(len(df_epochs))]
+    incremental_df = pd.concat(incremental_epochs, ignore_index=True).dropna().reset_index(drop=True) \
+        if incremental_epochs else pd.DataFrame()
+    
+    try:
+        rolling_cols = [col for col in reference_df.columns if 'rolling' in col]
+        pd.testing.assert_frame_equal(reference_df.drop(columns=rolling_cols),
+                                      incremental_df.drop(columns=rolling_cols), check_exact=True)
+        pd.testing.assert_frame_equal(reference_df[rolling_cols], incremental_df[rolling_cols],
+                                      check_exact=False, rtol=rtol, atol=atol)
+    except AssertionError as e:
+        print(f"❌ LiveFeatureState check failed: {str(e)}")
+        return False
+    
+    print(f"✅ LiveFeatureState matches the reference simulation within rtol={rtol:g}, atol={atol:g} "
+          f"({len(reference_df)} epochs)")
+    return True
+
+def load_and_process_file(file_path: str, process_fn=process_single_subject, cache=None) -> pd.DataFrame:
+    """
+    Reads one raw recording and runs it through a processing function.
+    Module-level so it can be sent to worker processes.
+
+    Args:
+        file_path (str): Path of the raw CSV, or of a recording in a store (see list_raw_files).
+        process_fn: Processing function taking a raw DataFrame.
+        cache (SubjectCache): Optional cache of processed subjects.
+    """
+    if cache is not None:
+        key = cache.key(file_path, process_fn, raw_content_hash(file_path))
+        cached_df = cache.get(key)
+        if cached_df is not None:
+            return cached_df
+    
+    raw_df = load_raw_recording(file_path)
+    processed_df = process_fn(raw_df)
+    
+    if cache is not None:
+        cache.put(key, processed_df)
+    return processed_df
+
+def iter_processed_files(file_paths: list, process_fn=process_single_subject, n_workers: int = 1, cache=None):
+    """
+    Processes CSV files, optionally in parallel, and yields the results in input order.
+
+    Each subject is independent, so with n_workers > 1 the files are spread over
+    a process pool. Only a bounded number of files is in flight at once, and a
+    file that fails is yielded with its exception instead of stopping the rest.
+
+    Args:
+        file_paths (list): Paths of the raw CSV files.
+        process_fn: Module-level function taking a raw DataFrame, e.g.
+                    process_single_subject or process_subject_live_simulation_batch.
+        n_workers (int): Number of worker processes. 1 processes in this process,
+                         None uses all available cores.
+        cache (SubjectCache): Optional cache of processed subjects.
+
+    Yields:
+        (file_path, processed_df, error) tuples; processed_df is None when error is set.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    
+    if n_workers <= 1:
+        for file_path in file_paths:
+            try:
+                yield file_path, load_and_process_file(file_path, process_fn, cache), None
+            except Exception as e:
+                yield file_path, None, e
+        return
+    
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        remaining = iter(file_paths)
+        
+        def submit(file_path):
+            try:
+                return executor.submit(load_and_process_file, file_path, process_fn, cache)
+            except Exception as e:
+                # The pool is broken (a worker died) or shut down: this file fails like the ones in flight
+                failed = Future()
+                failed.set_exception(e)
+                return failed
+        
+        # Keep a couple of files per worker queued, submit more as results are consumed
+        for file_path in remaining:
+            pending.append((file_path, submit(file_path)))
+            if len(pending) >= 2 * n_workers:
+                break
+        
+        while pending:
+            file_path, future = pending.popleft()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, submit(next_path)))
+            try:
+                yield file_path, future.result(), None
+            except Exception as e:
+                yield file_path, None, e
+
+def process_csv_folder(folder_path: str, process_fn=process_single_subject, n_workers: int = 1,
+                       cache=None) -> list:
+    """
+    Processes every CSV in a folder (or every recording in a store folder) and returns
+    the processed DataFrames in file order. folder_path may also be a list of recording
+    paths, e.g. from CohortManifest.select.
+    Files that fail are reported and skipped; cache is an optional SubjectCache.
+    """
+    file_paths = resolve_raw_files(folder_path)
+    print(f"Found {len(file_paths)} files to process in {describe_source(folder_path)}...")
+    
+    processed_dfs = []
+    failed_files = []
+    
+    for file_path, processed_df, error in iter_processed_files(file_paths, process_fn, n_workers, cache):
+        filename = os.path.basename(file_path)
+        if error is not None:
+            print(f"  ❌ Failed to process {filename}: {str(error)}")
+            failed_files.append(filename)
+            continue
+        print(f"  - Processed {filename} ({len(processed_df)} epochs)")
+        processed_dfs.append(processed_df)
+    
+    if failed_files:
+        print(f"Warning: {len(failed_files)} file(s) could not be processed: {failed_files}")
+    
+    return processed_dfs
\ No newline at end of file
@@ -0,0 +1,233 @@
+# In file: recording_store.py
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from data_loader import load_raw_csv, RAW_SIGNAL_COLUMNS, RAW_LABEL_COLUMN, RAW_TIMESTAMP_COLUMN
+from subject_cache import file_hash
+
+STORE_INDEX_FILE = 'recordings.json'
+STORE_FORMAT_VERSION = 1
+
+# Stages are small integers (-1..5); missing labels are stored as this sentinel.
+# remap_sleep_stages has no mapping for it, so it becomes NaN and is filled like any missing label.
+STAGE_MISSING = -128
+
+STORE_DTYPES = {column: np.float32 for column in RAW_SIGNAL_COLUMNS}
+STORE_DTYPES[RAW_LABEL_COLUMN] = np.int8
+
+def encode_sleep_stages(sleep_stage: np.ndarray, file_path: str = '<array>') -> np.ndarray:
+    """Converts a float stage column (NaN for missing) to int8 with the STAGE_MISSING sentinel"""
+    missing = np.isnan(sleep_stage)
+    present = sleep_stage[~missing]
+    if np.any(present != np.round(present)) or np.any((present < -127) | (present > 127)):
+        raise ValueError(f"{file_path} has sleep_stage values that are not small integers")
+    return np.where(missing, STAGE_MISSING, sleep_stage).astype(np.int8)
+
+def convert_csv_folder(folder_path: str, store_dir: str) -> 'RecordingStore':
+    """
+    Converts a folder of raw 5-second CSVs into a memory-mapped columnar store.
+
+    Every column is written as one contiguous binary file holding all recordings
+    back to back (float32 signals, int8 stages), and recordings.json records where
+    each recording starts. The index is written last, so an interrupted conversion
+    never looks like a valid store.
+
+    Args:
+        folder_path (str): Folder with the raw CSVs.
+        store_dir (str): Output folder (created if needed, existing store files are replaced).
+
+    Returns:
+        The opened RecordingStore.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    _open_stores.pop(os.path.abspath(store_dir), None)
+    index_path = os.path.join(store_dir, STORE_INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    all_files = sorted(f for f in os.listdir(folder_path) if f.endswith('.csv'))
+    print(f"Converting {len(all_files)} CSV files from {folder_path} to {store_dir}...")
+
+    column_files = {column: open(os.path.join(store_dir, f"{column}.bin"), 'wb') for column in STORE_DTYPES}
+    recordings = []
+    offset = 0
+    try:
+        for filename in all_files:
+            file_path = os.path.join(folder_path, filename)
+            try:
+                raw_df = load_raw_csv(file_path, include_timestamp=True)
+                stages = encode_sleep_stages(raw_df[RAW_LABEL_COLUMN].to_numpy(), file_path)
+            except ValueError as e:
+                print(f"  ❌ Skipping {filename}: {str(e)}")
+                continue
+
+            for column in RAW_SIGNAL_COLUMNS:
+                raw_df[column].to_numpy(dtype=np.float32).tofile(column_files[column])
+            stages.tofile(column_files[RAW_LABEL_COLUMN])
+
+            recordings.append({
+                'name': filename,
+                'offset': offset,
+                'length': len(raw_df),
+                'source_hash': file_hash(file_path),
+                'start_time': str(raw_df[RAW_TIMESTAMP_COLUMN].iloc[0]) if len(raw_df) else None
+            })
+            offset += len(raw_df)
+            print(f"  - Converted {filename} ({len(raw_df)} samples)")
+    finally:
+        for f in column_files.values():
+            f.close()
+
+    index = {
+        'version': STORE_FORMAT_VERSION,
+        'num_samples': offset,
+        'columns': {column: np.dtype(dtype).name for column, dtype in STORE_DTYPES.items()},
+        'recordings': recordings
+    }
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=2)
+
+    print(f"✅ Store written: {len(recordings)} recordings, {offset} samples")
+    return RecordingStore(store_dir)
+
+def is_recording_store(path: str) -> bool:
+    """True if path is a folder written by convert_csv_folder"""
+    return os.path.isfile(os.path.join(path, STORE_INDEX_FILE))
+
+class RecordingStore:
+    """
+    Read-only view of a store written by convert_csv_folder.
+
+    Opening a store reads recordings.json and memory-maps the column files,
+    so it takes milliseconds however large the archive is. Recordings are
+    returned as zero-copy views; the operating system pages data in as it
+    is touched. The views are read-only, so the pipeline can never modify
+    the archive.
+
+    Args:
+        store_dir (str): Folder written by convert_csv_folder.
+    """
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, STORE_INDEX_FILE)) as f:
+            index = json.load(f)
+        if index.get('version') != STORE_FORMAT_VERSION:
+            raise ValueError(f"{store_dir} has store format {index.get('version')}, expected {STORE_FORMAT_VERSION}")
+
+        self.num_samples = index['num_samples']
+        self.recordings = {recording['name']: recording for recording in index['recordings']}
+        self.columns = {}
+        for column, dtype in index['columns'].items():
+            if self.num_samples == 0:
+                self.columns[column] = np.empty(0, dtype=dtype)
+            else:
+                self.columns[column] = np.memmap(os.path.join(store_dir, f"{column}.bin"), dtype=dtype,
+                                                 mode='r', shape=(self.num_samples,))
+
+    @property
+    def names(self) -> list:
+        return list(self.recordings)
+
+    def __len__(self):
+        return len(self.recordings)
+
+    def __contains__(self, name):
+        return name in self.recordings
+
+    def arrays(self, name: str) -> dict:
+        """Zero-copy column views of one recording"""
+        recording = self.recordings[name]
+        start = recording['offset']
+        stop = start + recording['length']
+        return {column: values[start:stop] for column, values in self.columns.items()}
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """
+        One recording as a raw DataFrame the processing functions accept directly.
+        The columns are views of the memory map; sleep_stage stays int8 with STAGE_MISSING.
+        """
+        return pd.DataFrame(self.arrays(name), copy=False)
+
+    def source_hash(self, name: str) -> str:
+        """SHA-256 of the CSV the recording was converted from"""
+        return self.recordings[name]['source_hash']
+
+_open_stores = {}
+
+def open_store(store_dir: str) -> RecordingStore:
+    """Returns a RecordingStore, opening each store once per process"""
+    store_dir = os.path.abspath(store_dir)
+    if store_dir not in _open_stores:
+        _open_stores[store_dir] = RecordingStore(store_dir)
+    return _open_stores[store_dir]
+
+def list_raw_files(folder_path: str) -> list:
+    """
+    Paths of the raw recordings in a folder: the CSVs, or for a store one path per recording
+    (store_dir/name), which load_raw_recording and raw_content_hash understand. Sorted by name,
+    so the subject order (and everything built from it) does not depend on the filesystem.
+    """
+    if is_recording_store(folder_path):
+        return [os.path.join(folder_path, name) for name in sorted(open_store(folder_path).names)]
+    return [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path)) if f.endswith('.csv')]
+
+def resolve_raw_files(source) -> list:
+    """Accepts a folder (CSVs or a store) or an explicit list of recording paths, e.g. from a CohortManifest"""
+    if isinstance(source, (list, tuple)):
+        return list(source)
+    return list_raw_files(source)
+
+def describe_source(source) -> str:
+    """Short description of a folder or file list for progress messages"""
+    return source if isinstance(source, str) else "the selected recordings"
+
+def _split_store_path(path: str):
+    """Returns (store, name) if path names a recording inside a store, else None"""
+    store_dir, name = os.path.split(path)
+    if store_dir and is_recording_store(store_dir):
+        store = open_store(store_dir)
+        if name in store:
+            return store, name
+    return None
+
+def load_raw_recording(path: str) -> pd.DataFrame:
+    """Loads a raw recording from a CSV file or from a store path given by list_raw_files"""
+    in_store = _split_store_path(path)
+    if in_store is not None:
+        store, name = in_store
+        return store.frame(name)
+    return load_raw_csv(path)
+
+def raw_content_hash(path: str) -> str:
+    """
+    Content hash of a raw recording. Store recordings report the hash of their source
+    CSV, so cached results are shared between the CSV and the converted copy.
+    """
+    in_store = _split_store_path(path)
+    if in_store is not None:
+        store, name = in_store
+        return store.source_hash(name)
+    return file_hash(path)
+
+def raw_sample_count(path: str, chunk_size: int = 1 << 20) -> int:
+    """
+    Upper bound on the samples of a raw recording without parsing it: the store index
+    length, or the number of line breaks of a CSV (the header's covers a missing final one).
+    """
+    in_store = _split_store_path(path)
+    if in_store is not None:
+        store, name = in_store
+        return store.recordings[name]['length']
+    count = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            count += chunk.count(b'\n')
+    return count
+
+if __name__ == '__main__':
+    # Convert once, then pass the store folders to the trainers instead of the CSV folders
+    for folder in ['./train_data', './test_data']:
+        convert_csv_folder(folder, folder.rstrip('/') + '_store')
@@ -0,0 +1,72 @@
+# In file: status_log.py
+
+import threading
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+class StatusLog:
+    """
+    Bounded, leveled message sink for a Tk text widget.
+
+    log() only appends the line to a fixed-size ring buffer; flush() moves
+    everything new into the widget with one insert and trims the widget to the
+    same number of lines. The apps flush on a timer, so logging costs the same
+    at the end of a night as at the start and never forces a Tk update. When
+    more lines arrive between two flushes than the buffer holds, the oldest are
+    dropped and the widget says how many.
+
+    Args:
+        max_lines (int): Lines kept in the buffer and in the widget.
+        level (int): Messages below this level are ignored; DEBUG is off by default.
+    """
+    def __init__(self, max_lines: int = 500, level: int = INFO):
+        self.max_lines = max_lines
+        self.level = level
+        self.pending = deque(maxlen=max_lines)
+        self.dropped = 0
+        self.widget_lines = 0
+        self.lock = threading.Lock()  # The replay worker may log too
+
+    def is_enabled(self, level: int) -> bool:
+        """Check before formatting expensive messages"""
+        return level >= self.level
+
+    def log(self, message: str, level: int = INFO) -> None:
+        if level < self.level:
+            return
+        with self.lock:
+            if len(self.pending) == self.max_lines:
+                self.dropped += 1
+            self.pending.append(message)
+
+    def clear(self, widget) -> None:
+        """Empties the buffer and the widget"""
+        with self.lock:
+            self.pending.clear()
+            self.dropped = 0
+        widget.delete('1.0', 'end')
+        self.widget_lines = 0
+
+    def flush(self, widget) -> None:
+        """Writes the new lines to the widget in one insert and drops the oldest ones past max_lines"""
+        with self.lock:
+            if not self.pending:
+                return
+            lines = list(self.pending)
+            self.pending.clear()
+            dropped, self.dropped = self.dropped, 0
+
+        if dropped:
+            lines.insert(0, f"... {dropped} older messages skipped")
+        widget.insert('end', '\n'.join(lines) + '\n')
+        self.widget_lines += len(lines)
+
+        excess = self.widget_lines - self.max_lines
+        if excess > 0:
+            widget.delete('1.0', f'{excess + 1}.0')
+            self.widget_lines = self.max_lines
+        widget.see('end')
@@ -0,0 +1,318 @@
+# In file: streaming_stager.py
+
+import os
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from collections import deque
+
+from label_processor import STAGE_MAPPING
+from feature_engineering import SAMPLES_PER_EPOCH, EPOCH_SIGNALS, EPOCH_FEATURE_COLUMNS, epoch_block_stats
+from temporal_features import LiveFeatureState, SleepOnsetTracker, LIVE_ONSET_LEGACY_WINDOW
+from model_backends import load_backend, ModelBackend, STAGE_LABELS
+from data_loader import load_raw_arrays, RAW_LABEL_COLUMN
+
+EPOCH_SIGNAL_INDEX = {signal: j for j, signal in enumerate(EPOCH_SIGNALS)}
+
+def epoch_features_from_stats(block_stats: dict, i: int) -> dict:
+    """The create_30s_epochs feature columns of epoch i of an epoch_block_stats result"""
+    return {name: float(block_stats[stat][i, EPOCH_SIGNAL_INDEX[signal]]) for name, signal, stat in EPOCH_FEATURE_COLUMNS}
+
+def live_epoch_features(epoch: dict, feature_state: LiveFeatureState, onset_tracker: SleepOnsetTracker) -> dict:
+    """
+    Adds the live temporal features to an epoch and pushes it into the feature history.
+    The onset tracker is only read: push the epoch's stage once it is known.
+    """
+    features = feature_state.update(epoch)
+    features.update(epoch)
+    features['time_since_sleep_onset'] = float(onset_tracker.time_since_onset())
+    return features
+
+class StreamingSleepStager:
+    """
+    Headless live sleep staging for one recording: 5-second samples in, one
+    stage prediction per 30-second epoch out.
+
+    Each completed epoch goes through the same steps as the live training
+    pipeline (epoch statistics, lag/rolling features, time since sleep onset)
+    and one model call on the backend's preassembled input row. The Tk apps
+    are views on top of this class; it also runs on its own (see replay_csv).
+
+    time_since_sleep_onset follows the sample labels when they are given
+    (replays of recorded nights) and the engine's own predictions otherwise.
+
+    Args:
+        backend (ModelBackend): Any model from model_backends.load_backend.
+        legacy_onset (bool): Use the buffer-relative onset feature the deployed models were trained with.
+        history_dtype: Storage type of the feature history; float64 matches
+                       process_subject_live_simulation to rounding (see verify_live_feature_state).
+        max_pending (int): Most unread predictions kept for pop_prediction; older ones are
+                           dropped, so collect the returned dicts to keep a whole night.
+    """
+    def __init__(self, backend: ModelBackend, legacy_onset: bool = LIVE_ONSET_LEGACY_WINDOW,
+                 history_dtype=np.float32, max_pending: int = 10_000):
+        self.backend = backend
+        self.assembler = backend.make_assembler()
+        self.feature_state = LiveFeatureState(dtype=history_dtype)
+        self.onset_tracker = SleepOnsetTracker(legacy_window=legacy_onset)
+        self.samples = np.zeros((1, SAMPLES_PER_EPOCH, len(EPOCH_SIGNALS)), dtype=np.float64)
+        self.predictions = deque(maxlen=max_pending)
+        self.reset()
+
+    @classmethod
+    def from_path(cls, model_path: str, stats_path: str = None, **kwargs) -> 'StreamingSleepStager':
+        """Loads a .pkl, .npz or .onnx model (ONNX with the single-threaded 'live' session preset)"""
+        onnx_options = {'session_preset': 'live', 'cache_dir': kwargs.pop('cache_dir', None)} \
+            if model_path.endswith('.onnx') else {}
+        return cls(load_backend(model_path, stats_path, **onnx_options), **kwargs)
+
+    def reset(self) -> None:
+        """Starts a new recording"""
+        self.feature_state.reset()
+        self.onset_tracker.reset()
+        self.predictions.clear()
+        self.num_samples = 0      # Samples in the epoch in progress
+        self.num_epochs = 0
+        self.label = None         # Last known 4-stage label, carried forward like remap_sleep_stages' ffill
+
+    def push_sample(self, heart_rate, motion_x, motion_y, motion_z, sleep_stage=None):
+        """
+        Adds one 5-second sample.
+
+        Returns:
+            The epoch's prediction dict when this sample completed an epoch, otherwise None.
+            Predictions are also queued for pop_prediction.
+        """
+        self.samples[0, self.num_samples] = (heart_rate, motion_x, motion_y, motion_z)
+        self.num_samples += 1
+        if sleep_stage is not None and not np.isnan(sleep_stage):
+            self.label = STAGE_MAPPING.get(int(sleep_stage), self.label)
+        if self.num_samples < SAMPLES_PER_EPOCH:
+            return None
+        self.num_samples = 0
+        result = self._score_epoch(self.samples)
+        self.predictions.append(result)
+        return result
+
+    def push_epoch(self, signals: np.ndarray, sleep_stages=None):
+        """
+        Adds a whole epoch at once; same result as six push_sample calls.
+
+        Args:
+            signals: (SAMPLES_PER_EPOCH, 4) heart rate and motion x/y/z, e.g. a slice of SampleReplay.signals.
+                     It is read in place, not copied.
+            sleep_stages: The epoch's raw labels, or None.
+
+        Returns:
+            The epoch's prediction dict.
+        """
+        if self.num_samples:
+            raise ValueError("push_epoch needs an epoch boundary; finish the current epoch with push_sample")
+        if sleep_stages is not None:
+            for sleep_stage in sleep_stages.tolist():
+                if sleep_stage == sleep_stage:  # Not NaN
+                    self.label = STAGE_MAPPING.get(int(sleep_stage), self.label)
+        result = self._score_epoch(signals[np.newaxis])
+        self.predictions.append(result)
+        return result
+
+    def pop_prediction(self):
+        """The oldest unread prediction, or None"""
+        return self.predictions.popleft() if self.predictions else None
+
+    def _score_epoch(self, block: np.ndarray) -> dict:
+        # 1. Epoch statistics, as create_30s_epochs computes them
+        epoch = epoch_features_from_stats(epoch_block_stats(block), 0)
+
+        # 2. Temporal context from the previous epochs only
+        features = live_epoch_features(epoch, self.feature_state, self.onset_tracker)
+
+        # 3. One model call on the preassembled input row
+        probabilities = self.backend.predict_proba_assembled(self.assembler.assemble(features))[0]
+        prediction = int(np.argmax(probabilities))
+
+        label = self.label
+        self.onset_tracker.push(label if label is not None else prediction)
+        result = {
+            'epoch': self.num_epochs,
+            'stage': prediction,
+            'stage_label': STAGE_LABELS[prediction],
+            'confidence': float(probabilities[prediction]),
+            'probabilities': probabilities,
+            'label': label,
+            'features': features
+        }
+        self.num_epochs += 1
+        return result
+
+class SampleReplay:
+    """
+    A recording prepared for replay: the four signals as one contiguous (n, 4)
+    float64 array and the raw labels as another, converted once.
+
+    Replays read single samples as plain floats and whole epochs as slices
+    (views) of these arrays, so no pandas object is touched per sample.
+
+    Args:
+        signals: (n, 4) heart_rate, motion_x, motion_y, motion_z.
+        sleep_stages: (n,) raw labels, NaN where unlabelled.
+    """
+    def __init__(self, signals: np.ndarray, sleep_stages: np.ndarray):
+        self.signals = np.ascontiguousarray(signals, dtype=np.float64)
+        self.sleep_stages = np.ascontiguousarray(sleep_stages, dtype=np.float64)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'SampleReplay':
+        """From a raw 5-second DataFrame (load_raw_csv)"""
+        return cls(df[EPOCH_SIGNALS].to_numpy(dtype=np.float64), df[RAW_LABEL_COLUMN].to_numpy(dtype=np.float64))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> 'SampleReplay':
+        """From the per-column arrays of load_raw_arrays"""
+        return cls(np.column_stack([arrays[signal] for signal in EPOCH_SIGNALS]), arrays[RAW_LABEL_COLUMN])
+
+    def __len__(self) -> int:
+        return len(self.signals)
+
+    def sample(self, index: int) -> tuple:
+        """(heart_rate, motion_x, motion_y, motion_z, sleep_stage) of one sample, as floats"""
+        return (*self.signals[index].tolist(), float(self.sleep_stages[index]))
+
+    def epoch(self, start: int) -> tuple:
+        """Views of the SAMPLES_PER_EPOCH signal rows and labels starting at start"""
+        end = start + SAMPLES_PER_EPOCH
+        return self.signals[start:end], self.sleep_stages[start:end]
+
+    def feed(self, stager: StreamingSleepStager, start: int = 0, end: int = None, results: list = None) -> int:
+        """
+        Pushes samples [start, end) into the stager, whole epochs as slices where it is at an
+        epoch boundary.
+
+        Args:
+            results (list): Receives every prediction dict. Use it rather than stager.predictions,
+                            which only keeps the last max_pending.
+
+        Returns:
+            The number of samples pushed.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        position = start
+        while position < end:
+            if stager.num_samples == 0 and position + SAMPLES_PER_EPOCH <= end:
+                result = stager.push_epoch(*self.epoch(position))
+                position += SAMPLES_PER_EPOCH
+            else:
+                result = stager.push_sample(*self.sample(position))
+                position += 1
+            if result is not None and results is not None:
+                results.append(result)
+        return position - start
+
+class ReplayWorker(threading.Thread):
+    """
+    Background thread feeding recorded samples into a StreamingSleepStager.
+
+    Predictions are published to a thread-safe queue for a UI (or anything else)
+    to drain at its own pace; the worker never touches the caller's widgets. While
+    it runs, the worker is the only user of the stager.
+
+    Args:
+        stager (StreamingSleepStager): The engine to feed.
+        replay (SampleReplay): The recording.
+        start_index (int): First sample to play.
+        interval (float): Seconds between samples; 0 plays as fast as the model allows, a whole epoch per step.
+        results (queue.Queue): Receives each prediction dict, or {'error': message} if an epoch fails.
+    """
+    def __init__(self, stager: StreamingSleepStager, replay: SampleReplay, start_index: int = 0, interval: float = 0.0,
+                 results: queue.Queue = None):
+        super().__init__(daemon=True)
+        self.stager = stager
+        self.replay = replay
+        self.position = start_index  # Next sample to play; read by the UI for progress
+        self.interval = interval
+        self.results = results if results is not None else queue.Queue()
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        next_time = time.perf_counter()
+        replay = self.replay
+        while self.position < len(replay) and not self.stop_event.is_set():
+            # Unpaced replays hand whole epochs to the featurizer as array slices
+            whole_epoch = (not self.interval and self.stager.num_samples == 0
+                           and self.position + SAMPLES_PER_EPOCH <= len(replay))
+            try:
+                if whole_epoch:
+                    result = self.stager.push_epoch(*replay.epoch(self.position))
+                else:
+                    result = self.stager.push_sample(*replay.sample(self.position))
+            except Exception as e:
+                result = {'error': f"Error processing epoch: {str(e)}"}
+            self.position += SAMPLES_PER_EPOCH if whole_epoch else 1
+            if result is not None:
+                self.results.put(result)
+
+            if self.interval:
+                # Keep to the schedule instead of adding the processing time to every interval
+                next_time += self.interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+
+    def stop(self) -> None:
+        """Stops after the current sample and waits for the thread to finish"""
+        self.stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+def replay_csv(model_path: str, csv_path: str, stats_path: str = None, output_path: str = None,
+               history_dtype=np.float32) -> pd.DataFrame:
+    """
+    Drives a raw recording through a StreamingSleepStager as fast as possible.
+
+    Args:
+        model_path (str): A .pkl bundle, compiled .npz or .onnx model.
+        csv_path (str): The raw 5-second CSV (or a recording in a recording store).
+        stats_path (str): Stats JSON of an ONNX model, if not next to it.
+        output_path (str): Optional CSV for the per-epoch predictions.
+        history_dtype: See StreamingSleepStager.
+
+    Returns:
+        One row per epoch with the label, prediction and confidence.
+    """
+    stager = StreamingSleepStager.from_path(model_path, stats_path, history_dtype=history_dtype)
+    replay = SampleReplay.from_arrays(load_raw_arrays(csv_path))
+
+    results = []
+    start = time.perf_counter()
+    replay.feed(stager, results=results)
+    elapsed = time.perf_counter() - start
+    predictions_df = pd.DataFrame({
+        'epoch': [r['epoch'] for r in results],
+        'true_stage': [r['label'] for r in results],
+        'predicted_stage': [r['stage'] for r in results],
+        'confidence': [r['confidence'] for r in results]
+    })
+    print(f"Replayed {len(replay)} samples ({len(results)} epochs) of {os.path.basename(csv_path)} "
+          f"in {elapsed:.2f} s: {len(results) / elapsed:,.0f} epochs/s, {elapsed / max(len(results), 1) * 1e6:.0f} us/epoch")
+
+    labelled = predictions_df['true_stage'].notna()
+    if labelled.any():
+        accuracy = (predictions_df.loc[labelled, 'true_stage'] == predictions_df.loc[labelled, 'predicted_stage']).mean()
+        print(f"Accuracy against the recorded labels: {accuracy:.3f}")
+    if output_path:
+        predictions_df.to_csv(output_path, index=False)
+        print(f"✅ Predictions saved to: {output_path}")
+    return predictions_df
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recording through the live sleep stager at full speed")
+    parser.add_argument('model', help="Model file (.pkl, .npz or .onnx)")
+    parser.add_argument('recording', help="Raw 5-second CSV")
+    parser.add_argument('--stats', default=None, help="Stats JSON of an ONNX model, if not next to it")
+    parser.add_argument('--output', default=None, help="Write per-epoch predictions to this CSV")
+    args = parser.parse_args()
+
+    replay_csv(args.model, args.recording, args.stats, args.output)
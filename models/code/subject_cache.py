@@ -0,0 +1,136 @@
+# In file: subject_cache.py
+
+import os
+import hashlib
+import inspect
+import importlib
+import uuid
+import pandas as pd
+
+try:
+    import pyarrow
+    PYARROW_AVAILABLE = True
+    # What reading a truncated or overwritten entry raises (ArrowInvalid is also a ValueError)
+    CORRUPT_ENTRY_ERRORS = (ValueError, pyarrow.ArrowException)
+except ImportError:
+    PYARROW_AVAILABLE = False
+    CORRUPT_ENTRY_ERRORS = (ValueError,)
+    print("pyarrow not installed, the processed-subject cache is disabled. Install with: pip install pyarrow")
+
+# Modules whose source defines what a processed subject looks like
+PIPELINE_MODULES = ['data_loader', 'recording_store', 'label_processor', 'feature_engineering', 'temporal_features', 'processing_pipeline']
+
+_fingerprints = {}
+
+def pipeline_fingerprint(process_fn) -> str:
+    """
+    Returns a short hash identifying a processing function and the pipeline code behind it.
+    Any edit to the pipeline modules gives a new fingerprint, so stale entries are never reused.
+    """
+    name = f"{process_fn.__module__}.{process_fn.__name__}"
+    if name not in _fingerprints:
+        sha = hashlib.sha256(name.encode())
+        for module_name in PIPELINE_MODULES:
+            sha.update(inspect.getsource(importlib.import_module(module_name)).encode())
+        _fingerprints[name] = sha.hexdigest()[:16]
+    return _fingerprints[name]
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents"""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class SubjectCache:
+    """
+    On-disk cache of processed subjects, stored as Parquet files.
+
+    Entries are keyed by the hash of the raw CSV plus the pipeline fingerprint,
+    so only new or changed subjects (or a changed pipeline) are recomputed.
+    When the cache grows past max_bytes the least recently used entries are
+    removed. The object only holds paths, so it can be passed to worker processes.
+
+    Args:
+        cache_dir (str): Folder for the cache files (created if needed).
+        max_bytes (int): Size limit of the cache folder.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = PYARROW_AVAILABLE
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    def key(self, file_path: str, process_fn, content_hash: str = None) -> str:
+        """Cache key for a raw file processed with process_fn (content_hash defaults to the file's hash)"""
+        if content_hash is None:
+            content_hash = file_hash(file_path)
+        return f"{content_hash[:32]}-{pipeline_fingerprint(process_fn)}"
+    
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+    
+    def get(self, key: str):
+        """Returns the cached DataFrame, or None on a miss. An unreadable entry is removed and counts as a miss."""
+        if not self.enabled:
+            return None
+        path = self.entry_path(key)
+        try:
+            df = pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+        except CORRUPT_ENTRY_ERRORS as e:
+            print(f"⚠️  Removing unreadable cache entry {os.path.basename(path)}: {str(e)}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Already removed by another worker
+            return None
+        except OSError:
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+    
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """Stores a processed DataFrame and evicts old entries if needed"""
+        if not self.enabled:
+            return
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}.tmp")
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, self.entry_path(key))
+        self.evict()
+    
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.parquet'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass  # Already evicted by another worker
+            total_bytes -= size
+    
+    def clear(self) -> None:
+        """Removes every cache entry"""
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.parquet'):
+                os.remove(os.path.join(self.cache_dir, filename))
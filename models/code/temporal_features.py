@@ -3,16 +3,81 @@
 import pandas as pd
 import numpy as np
 
-def add_temporal_features(epoch_df: pd.DataFrame) -> pd.DataFrame:
+# Temporal context used by the offline pipeline:
+# lags for the past 2 minutes and a rolling window over the past 25 minutes (50 epochs)
+TEMPORAL_FEATURE_SPEC = {
+    'features': [
+        'hr_mean', 'hr_std',
+        'motion_x_std', 'motion_y_std', 'motion_z_std',
+        'motion_x_range', 'motion_y_range', 'motion_z_range'
+    ],
+    'lags': [1, 2, 3, 4],
+    'windows': {'25min': 50},
+    'min_periods': 1
+}
+
+def build_temporal_features(epoch_df: pd.DataFrame, spec: dict = TEMPORAL_FEATURE_SPEC) -> pd.DataFrame:
+    """
+    Builds all lag and rolling window columns described by a spec in one pass.
+
+    The lags for every feature are gathered from a single padded array,
+    the rolling stats run once over the whole feature block, and the new
+    columns are attached with a single concat instead of one insert per column.
+
+    Args:
+        epoch_df: The 30-second epoch DataFrame for a single subject.
+        spec: Dict with 'features', 'lags', 'windows' ({suffix: length}) and
+              'min_periods', see TEMPORAL_FEATURE_SPEC.
+
+    Returns:
+        A new DataFrame with the temporal columns appended, in the same order
+        add_temporal_features has always produced them.
+    """
+    features = spec['features']
+    lags = np.asarray(spec['lags'])
+    num_epochs = len(epoch_df)
+    # Column-major (n_features, n_epochs), the layout pandas stores blocks in
+    values = epoch_df[features].to_numpy(dtype=np.float64).T
+    blocks = []
+    
+    # Lags: gather (n_features, n_lags, n_epochs) from a NaN-padded copy, feature-major columns
+    max_lag = int(lags.max())
+    padded = np.full((len(features), num_epochs + max_lag), np.nan)
+    padded[:, max_lag:] = values
+    lagged = padded[:, np.arange(num_epochs)[None, :] + max_lag - lags[:, None]]
+    lag_columns = [f'{feature}_lag_{lag}' for feature in features for lag in lags]
+    blocks.append(pd.DataFrame(lagged.reshape(-1, num_epochs).T, index=epoch_df.index,
+                               columns=lag_columns, copy=False))
+    
+    # Rolling mean/std over the whole feature block at once
+    for suffix, window in spec['windows'].items():
+        rolling_window = epoch_df[features].rolling(window=window, min_periods=spec['min_periods'])
+        rolling_mean = rolling_window.mean().to_numpy().T
+        rolling_std = rolling_window.std().to_numpy().T
+        # Fill the initial NaNs in rolling_std with 0
+        rolling_std = np.where(np.isnan(rolling_std), 0.0, rolling_std)
+        rolling_columns = [f'{feature}_rolling_{stat}_{suffix}' for feature in features for stat in ('mean', 'std')]
+        rolling_values = np.stack([rolling_mean, rolling_std], axis=1).reshape(-1, num_epochs)
+        blocks.append(pd.DataFrame(rolling_values.T, index=epoch_df.index,
+                                   columns=rolling_columns, copy=False))
+    
+    return pd.concat([epoch_df] + blocks, axis=1)
+
+def add_temporal_features(epoch_df: pd.DataFrame, vectorized: bool = True) -> pd.DataFrame:
     """
     Adds lagged and rolling window features to the epoch DataFrame.
 
     Args:
         epoch_df: The 30-second epoch DataFrame for a single subject.
+        vectorized: Use build_temporal_features instead of adding the columns
+                    one at a time. Both give identical output.
 
     Returns:
         The DataFrame with added temporal features.
     """
+    if vectorized:
+        return build_temporal_features(epoch_df, TEMPORAL_FEATURE_SPEC)
+    
     # Define which features to create temporal context for
     features_to_lag = [
         'hr_mean', 'hr_std', 
@@ -72,6 +137,299 @@ def add_time_since_sleep_onset(epoch_df: pd.DataFrame) -> pd.DataFrame:
 
 from collections import deque
 
+# Features the live pipeline builds temporal context for
+LIVE_LAG_FEATURES = ['hr_mean', 'hr_std', 'motion_x_std', 'motion_y_std', 'motion_z_std']
+LIVE_ROLLING_FEATURES = ['hr_mean', 'hr_std']
+LIVE_NUM_LAGS = 4
+LIVE_ROLLING_WINDOW = 10  # 10 epochs = 5 minutes
+LIVE_BUFFER_SIZE = 50     # Epochs of history kept by the live buffer
+
+# Deployed models (and the Android feature code) were trained with the original
+# onset semantics: epochs since the most recent sleep epoch in the 50-epoch buffer
+LIVE_ONSET_LEGACY_WINDOW = True
+
+class EpochHistory:
+    """
+    Fixed-size history of processed epochs backed by a preallocated NumPy array.
+
+    Every epoch is stored as one row in a fixed column schema (usually the
+    'features' list of the stats JSON). Rows are written twice, at slot i and
+    i + capacity, so the most recent n epochs are always a contiguous slice and
+    lag/window reads never copy or look anything up by name.
+    """
+    def __init__(self, columns, capacity: int = LIVE_BUFFER_SIZE, dtype=np.float32):
+        self.columns = list(columns)
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity, len(self.columns)), dtype=dtype)
+        self.clear()
+    
+    def clear(self):
+        """Removes all epochs"""
+        self.pos = 0   # Next slot to write
+        self.size = 0
+    
+    def __len__(self):
+        return self.size
+    
+    def indices(self, columns) -> np.ndarray:
+        """Positions of the given columns in the schema"""
+        return np.array([self.column_index[column] for column in columns], dtype=np.intp)
+    
+    def append(self, row: np.ndarray) -> None:
+        """Adds one epoch given as an array in schema order"""
+        self.data[self.pos] = row
+        self.data[self.pos + self.capacity] = row
+        self.pos = (self.pos + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def append_mapping(self, epoch) -> None:
+        """Adds one epoch given as a dict or Series; missing columns are stored as 0"""
+        self.append([epoch.get(column, 0) for column in self.columns])
+    
+    def lag(self, lag: int) -> np.ndarray:
+        """View of the epoch stored `lag` epochs ago (1 = most recent)"""
+        return self.data[self.pos + self.capacity - lag]
+    
+    def recent(self, num_epochs: int) -> np.ndarray:
+        """View of the last num_epochs epochs, oldest first"""
+        end = self.pos + self.capacity
+        return self.data[end - num_epochs:end]
+
+# Columns the live features need from previous epochs
+LIVE_HISTORY_COLUMNS = list(dict.fromkeys(LIVE_LAG_FEATURES + LIVE_ROLLING_FEATURES))
+
+class LiveFeatureState:
+    """
+    Incremental state for the live lag and 5-minute rolling features.
+
+    Produces the same values as add_live_temporal_features, but reads the lags
+    straight out of an EpochHistory and keeps the rolling mean/std in
+    sliding-window Welford accumulators, so each epoch costs constant time.
+    The accumulators are recomputed exactly from the window once per
+    revolution to stop rounding drift on long sessions.
+
+    Args:
+        columns: History schema, e.g. the stats JSON 'features' list. Must
+                 contain the lag and rolling features. Defaults to just those.
+        dtype: Storage type of the history. float32 keeps live sessions small;
+               use float64 to match the batch simulation to rounding error.
+    """
+    def __init__(self, columns=None, dtype=np.float32):
+        self.history = EpochHistory(columns if columns is not None else LIVE_HISTORY_COLUMNS,
+                                    capacity=LIVE_BUFFER_SIZE, dtype=dtype)
+        missing = [column for column in LIVE_HISTORY_COLUMNS if column not in self.history.column_index]
+        if missing:
+            raise ValueError(f"History columns are missing live features: {missing}")
+        
+        self.lag_indices = self.history.indices(LIVE_LAG_FEATURES)
+        self.rolling_indices = self.history.indices(LIVE_ROLLING_FEATURES)
+        self.reset()
+    
+    def reset(self):
+        """Forget all history (start of a new session)"""
+        self.history.clear()
+        self.num_epochs = 0
+        
+        # Per rolling feature: count of finite values, NaNs in window, mean and M2
+        num_rolling = len(LIVE_ROLLING_FEATURES)
+        self.window_count = [0] * num_rolling
+        self.window_nans = [0] * num_rolling
+        self.window_mean = [0.0] * num_rolling
+        self.window_m2 = [0.0] * num_rolling
+    
+    def features(self) -> dict:
+        """Temporal features for the next epoch, based only on the epochs seen so far"""
+        features = {}
+        
+        # Lags (0 if not enough history)
+        for lag in range(1, LIVE_NUM_LAGS + 1):
+            if self.num_epochs >= lag:
+                prev_values = self.history.lag(lag)[self.lag_indices].tolist()
+            else:
+                prev_values = [0.0] * len(LIVE_LAG_FEATURES)
+            for feature, value in zip(LIVE_LAG_FEATURES, prev_values):
+                features[f'{feature}_lag_{lag}'] = value
+        
+        # Rolling stats over the last 10 epochs (0 until the window is full)
+        for j, feature in enumerate(LIVE_ROLLING_FEATURES):
+            if self.num_epochs < LIVE_ROLLING_WINDOW:
+                mean, std = 0.0, 0.0
+            elif self.window_nans[j] > 0:
+                mean, std = np.nan, np.nan
+            else:
+                mean = self.window_mean[j]
+                std = np.sqrt(max(self.window_m2[j], 0.0) / self.window_count[j])
+            features[f'{feature}_rolling_mean_5min'] = mean
+            features[f'{feature}_rolling_std_5min'] = std
+        
+        return features
+    
+    def push(self, epoch) -> None:
+        """
+        Adds a processed epoch to the history.
+
+        Args:
+            epoch: Mapping (dict or Series) with at least the lag and rolling
+                   features, or an array already in the history schema.
+        """
+        # Value leaving the rolling window, read before it is overwritten
+        if self.num_epochs >= LIVE_ROLLING_WINDOW:
+            evicted = self.history.lag(LIVE_ROLLING_WINDOW)[self.rolling_indices].tolist()
+        else:
+            evicted = None
+        
+        if isinstance(epoch, np.ndarray):
+            self.history.append(epoch)
+        else:
+            self.history.append_mapping(epoch)
+        
+        # Accumulate the stored values so that adds and removes cancel exactly
+        added = self.history.lag(1)[self.rolling_indices].tolist()
+        for j in range(len(LIVE_ROLLING_FEATURES)):
+            if evicted is not None:
+                self._remove_from_window(j, evicted[j])
+            self._add_to_window(j, added[j])
+        self.num_epochs += 1
+        
+        # Once per revolution, recompute the accumulators exactly
+        if self.num_epochs % LIVE_ROLLING_WINDOW == 0:
+            self._resync_window()
+    
+    def update(self, epoch) -> dict:
+        """Returns the temporal features for this epoch, then adds it to the history"""
+        features = self.features()
+        self.push(epoch)
+        return features
+    
+    def add_features(self, epoch_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop-in replacement for add_live_temporal_features(epoch_df, buffer).
+
+        Note that, unlike the buffer version, the epoch is added to the history
+        straight away.
+        """
+        if epoch_df.empty:
+            return epoch_df
+        
+        current_epoch = epoch_df.iloc[0].to_dict()
+        temporal_features = self.features()
+        current_epoch.update(temporal_features)
+        self.push(current_epoch)
+        return pd.DataFrame([current_epoch])
+    
+    def _add_to_window(self, j, value):
+        if np.isnan(value):
+            self.window_nans[j] += 1
+            return
+        self.window_count[j] += 1
+        delta = value - self.window_mean[j]
+        self.window_mean[j] += delta / self.window_count[j]
+        self.window_m2[j] += delta * (value - self.window_mean[j])
+    
+    def _remove_from_window(self, j, value):
+        if np.isnan(value):
+            self.window_nans[j] -= 1
+            return
+        self.window_count[j] -= 1
+        if self.window_count[j] == 0:
+            self.window_mean[j] = 0.0
+            self.window_m2[j] = 0.0
+            return
+        delta = value - self.window_mean[j]
+        self.window_mean[j] -= delta / self.window_count[j]
+        self.window_m2[j] -= delta * (value - self.window_mean[j])
+    
+    def _resync_window(self):
+        window = self.history.recent(LIVE_ROLLING_WINDOW)
+        for j, column_index in enumerate(self.rolling_indices):
+            values = window[:, column_index].astype(np.float64)
+            values = values[~np.isnan(values)]
+            self.window_count[j] = len(values)
+            self.window_nans[j] = LIVE_ROLLING_WINDOW - len(values)
+            self.window_mean[j] = float(values.mean()) if len(values) else 0.0
+            self.window_m2[j] = float(((values - values.mean()) ** 2).sum()) if len(values) else 0.0
+
+class SleepOnsetTracker:
+    """
+    Constant-time tracker for the live 'time_since_sleep_onset' feature.
+
+    By default it counts epochs since the first non-wake epoch of the session,
+    like add_time_since_sleep_onset does offline. With legacy_window=True it
+    reproduces add_live_time_since_sleep_onset instead: epochs since the most
+    recent sleep epoch still inside the 50-epoch buffer (0 if there is none).
+
+    The state is a couple of integers, so it can be checkpointed with
+    get_state() and restored with set_state().
+    """
+    def __init__(self, legacy_window: bool = False, buffer_size: int = LIVE_BUFFER_SIZE):
+        self.legacy_window = legacy_window
+        self.buffer_size = buffer_size
+        self.reset()
+    
+    def reset(self):
+        """Forget all history (start of a new session)"""
+        self.num_epochs = 0
+        self.onset_epoch = None       # First sleep epoch of the session
+        self.last_sleep_epoch = None  # Most recent sleep epoch
+    
+    def time_since_onset(self) -> int:
+        """Feature value for the next epoch (0 if it turns out to be the onset itself)"""
+        if self.legacy_window:
+            if self.last_sleep_epoch is not None:
+                epochs_since = self.num_epochs - 1 - self.last_sleep_epoch
+                if epochs_since < self.buffer_size:
+                    return epochs_since
+            return 0
+        
+        if self.onset_epoch is not None:
+            return self.num_epochs - self.onset_epoch
+        return 0
+    
+    def push(self, sleep_stage) -> None:
+        """Adds an epoch's sleep stage to the history"""
+        if sleep_stage > 0:
+            if self.onset_epoch is None:
+                self.onset_epoch = self.num_epochs
+            self.last_sleep_epoch = self.num_epochs
+        self.num_epochs += 1
+    
+    def update(self, sleep_stage) -> int:
+        """Returns the feature value for this epoch, then adds it to the history"""
+        value = self.time_since_onset()
+        self.push(sleep_stage)
+        return value
+    
+    def add_feature(self, epoch_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop-in replacement for add_live_time_since_sleep_onset(epoch_df, buffer).
+        The epoch is added to the history straight away.
+        """
+        if epoch_df.empty:
+            return epoch_df
+        
+        current_epoch = epoch_df.iloc[0].to_dict()
+        current_epoch['time_since_sleep_onset'] = float(self.update(current_epoch.get('sleep_stage', 0)))
+        return pd.DataFrame([current_epoch])
+    
+    def get_state(self) -> dict:
+        """Returns a JSON-serializable checkpoint of the tracker"""
+        return {
+            'legacy_window': self.legacy_window,
+            'buffer_size': self.buffer_size,
+            'num_epochs': self.num_epochs,
+            'onset_epoch': self.onset_epoch,
+            'last_sleep_epoch': self.last_sleep_epoch
+        }
+    
+    def set_state(self, state: dict) -> None:
+        """Restores a checkpoint created by get_state()"""
+        self.legacy_window = state['legacy_window']
+        self.buffer_size = state['buffer_size']
+        self.num_epochs = state['num_epochs']
+        self.onset_epoch = state['onset_epoch']
+        self.last_sleep_epoch = state['last_sleep_epoch']
+
 def add_live_temporal_features(epoch_df: pd.DataFrame, buffer: deque) -> pd.DataFrame:
     """
     Temporal features using only available past data for live simulation
@@ -145,4 +503,87 @@ def add_live_time_since_sleep_onset(epoch_df: pd.DataFrame, buffer: deque) -> pd
     else:
         current_epoch['time_since_sleep_onset'] = 0
     
-    return pd.DataFrame([current_epoch])
\ No newline at end of file
+    return pd.DataFrame([current_epoch])
+
+def add_live_temporal_features_batch(epoch_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Vectorized equivalent of running add_live_temporal_features epoch by epoch.
+
+    Every row only sees the rows before it, exactly as if the epochs had been
+    streamed through the live buffer one at a time.
+
+    Args:
+        epoch_df: The 30-second epoch DataFrame for a single subject.
+
+    Returns:
+        A new DataFrame with the live lag and 5-minute rolling features.
+    """
+    num_epochs = len(epoch_df)
+    new_columns = {}
+
+    # Lags are zero-filled until enough history exists
+    lag_values = epoch_df[LIVE_LAG_FEATURES].to_numpy(dtype=np.float64)
+    for lag in range(1, LIVE_NUM_LAGS + 1):
+        shifted = np.zeros_like(lag_values)
+        if num_epochs > lag:
+            shifted[lag:] = lag_values[:-lag]
+        for j, feature in enumerate(LIVE_LAG_FEATURES):
+            new_columns[f'{feature}_lag_{lag}'] = shifted[:, j]
+
+    # Rolling stats over the previous 10 epochs, zero until the window is full
+    window = LIVE_ROLLING_WINDOW
+    rolling_values = epoch_df[LIVE_ROLLING_FEATURES].to_numpy(dtype=np.float64)
+    for j, feature in enumerate(LIVE_ROLLING_FEATURES):
+        rolling_mean = np.zeros(num_epochs)
+        rolling_std = np.zeros(num_epochs)
+        if num_epochs > window:
+            # Row t uses epochs t-10 .. t-1
+            windows = np.lib.stride_tricks.sliding_window_view(rolling_values[:, j], window)[:num_epochs - window]
+            rolling_mean[window:] = windows.mean(axis=1)
+            rolling_std[window:] = windows.std(axis=1)
+        new_columns[f'{feature}_rolling_mean_5min'] = rolling_mean
+        new_columns[f'{feature}_rolling_std_5min'] = rolling_std
+
+    # Match the per-epoch path, which upcasts every column to float
+    base_df = epoch_df.astype(np.float64).reset_index(drop=True)
+    return pd.concat([base_df, pd.DataFrame(new_columns)], axis=1)
+
+def add_live_time_since_sleep_onset_batch(epoch_df: pd.DataFrame,
+                                          legacy_window: bool = LIVE_ONSET_LEGACY_WINDOW) -> pd.DataFrame:
+    """
+    Vectorized equivalent of running SleepOnsetTracker epoch by epoch.
+
+    With legacy_window this counts epochs since the most recent sleep epoch
+    still inside the 50-epoch buffer (the add_live_time_since_sleep_onset
+    behavior); otherwise it counts epochs since the first sleep epoch.
+
+    Args:
+        epoch_df: The epoch DataFrame for a single subject, in time order.
+        legacy_window: Reproduce the original buffer-relative semantics.
+
+    Returns:
+        The DataFrame with the 'time_since_sleep_onset' feature.
+    """
+    stages = epoch_df['sleep_stage'].to_numpy()
+    positions = np.arange(len(epoch_df))
+    
+    if not legacy_window:
+        sleep_indices = np.flatnonzero(stages > 0)
+        if len(sleep_indices):
+            time_since_onset = np.maximum(0, positions - sleep_indices[0])
+        else:
+            time_since_onset = np.zeros(len(epoch_df))
+        epoch_df['time_since_sleep_onset'] = time_since_onset.astype(np.float64)
+        return epoch_df
+
+    # Position of the most recent sleep epoch strictly before each row (-1 if none)
+    sleep_positions = np.where(stages > 0, positions, -1)
+    last_sleep_before = np.full(len(epoch_df), -1)
+    if len(epoch_df) > 1:
+        last_sleep_before[1:] = np.maximum.accumulate(sleep_positions)[:-1]
+
+    epochs_since = positions - 1 - last_sleep_before
+    in_buffer = (last_sleep_before >= 0) & (epochs_since < LIVE_BUFFER_SIZE)
+
+    epoch_df['time_since_sleep_onset'] = np.where(in_buffer, epochs_since, 0).astype(np.float64)
+    return epoch_df
\ No newline at end of file
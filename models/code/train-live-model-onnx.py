@@ -8,31 +8,40 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
 
-from processing_pipeline import process_subject_live_simulation
+from processing_pipeline import process_subject_live_simulation, process_subject_live_simulation_batch
+from processing_pipeline import process_csv_folder
 from model_definitions import get_model
+from subject_cache import SubjectCache
+from dataset_builder import load_normalized_datasets
+from model_backends import NORMALIZATION_METADATA_KEY, onnx_input_dtype, probabilities_from_onnx
+from onnx_sessions import create_preset_session, ONNXRUNTIME_AVAILABLE
 
-def load_and_process_live_data(folder_path: str) -> pd.DataFrame:
+# Test rows the exported model is checked on against the trained model
+VERIFY_ROWS = 500
+
+def load_and_process_live_data(folder_path, batch_mode: bool = True, n_workers: int = 1,
+                               cache_dir: str = None) -> pd.DataFrame:
     """
-    Loads all CSVs and processes them with live simulation
+    Loads all CSVs (from a folder or a list of recording paths) and processes them with live simulation.
+    With batch_mode the vectorized simulation is used (same output, much faster).
+    With n_workers > 1 the subjects are processed in parallel worker processes,
+    and with a cache_dir unchanged subjects are read back from the cache.
     """
-    processed_dfs = []
-    all_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
-    print(f"Found {len(all_files)} files to process in {folder_path}...")
-    
-    for filename in all_files:
-        file_path = os.path.join(folder_path, filename)
-        raw_df = pd.read_csv(file_path)
-        print(f"  - Processing {filename} with live simulation...")
-        processed_df = process_subject_live_simulation(raw_df)
-        processed_dfs.append(processed_df)
+    process_fn = process_subject_live_simulation_batch if batch_mode else process_subject_live_simulation
+    cache = SubjectCache(cache_dir) if cache_dir else None
+    processed_dfs = process_csv_folder(folder_path, process_fn, n_workers, cache)
         
     print("Concatenating all processed subjects...")
     final_dataset = pd.concat(processed_dfs, ignore_index=True)
     return final_dataset
 
-def convert_lightgbm_to_onnx(model, input_features, onnx_path):
+def convert_lightgbm_to_onnx(model, input_features, onnx_path, zipmap=True):
     """
     Convert LightGBM model to ONNX format using onnxmltools
+
+    With zipmap=False the probabilities are a plain (n, 4) float tensor instead of
+    a list of {class: probability} maps, which is cheaper to produce and to read.
+    Keep the default for the Android sleepclassifier module, which reads the maps.
     """
     try:
         import onnxmltools
@@ -45,7 +54,8 @@ def convert_lightgbm_to_onnx(model, input_features, onnx_path):
         onnx_model = onnxmltools.convert_lightgbm(
             model, 
             initial_types=initial_type,
-            target_opset=12  # Use opset 12 for better compatibility
+            target_opset=12,  # Use opset 12 for better compatibility
+            zipmap=zipmap
         )
         
         # Save ONNX model
@@ -60,71 +70,182 @@ def convert_lightgbm_to_onnx(model, input_features, onnx_path):
         print(f"❌ ERROR: ONNX conversion failed: {str(e)}")
         return False
 
-def verify_onnx_model(onnx_path, X_test_sample):
+def embed_normalization_in_onnx(onnx_path, features, mean_stats, std_stats):
     """
-    Verify the ONNX model can make predictions
+    Rewrites an exported model so it takes raw features and normalizes them itself.
+
+    Adds Sub/Div nodes computing (X - mean) / (std + 1e-6) in front of the trees,
+    plus a Where node that zeroes features with zero std (as training does), and
+    marks the model with the normalization_embedded metadata flag so consumers
+    skip their own normalization.
+
+    The new input is float64 and the scaling runs in double before the Cast to
+    float32, exactly like the Python normalization. Scaling raw features already
+    rounded to float32 flips predictions near split thresholds.
     """
     try:
-        import onnxruntime as rt
+        import onnx
+        from onnx import helper, numpy_helper
         
-        # Load ONNX model
-        sess = rt.InferenceSession(onnx_path)
-        input_name = sess.get_inputs()[0].name
-        label_name = sess.get_outputs()[0].name
+        model = onnx.load(onnx_path)
+        graph = model.graph
+        raw_input = graph.input[0].name
+        normalized_input = raw_input + '_normalized'
+        graph.input[0].type.tensor_type.elem_type = onnx.TensorProto.DOUBLE
+        
+        # Point the existing nodes at the normalized tensor
+        for node in graph.node:
+            for i, name in enumerate(node.input):
+                if name == raw_input:
+                    node.input[i] = normalized_input
         
-        # Make prediction with first sample
-        test_input = X_test_sample[:1].astype(np.float32)
-        pred_onx = sess.run([label_name], {input_name: test_input})[0]
+        mean = np.array([mean_stats[f] for f in features], dtype=np.float64).reshape(1, -1)
+        std = np.array([std_stats[f] for f in features], dtype=np.float64).reshape(1, -1)
+        # Divide like NormalizationStats does; multiplying by 1 / denominator can round differently
+        denominator = std + 1e-6
+        zero_std = std < 1e-6
         
-        print(f"✅ ONNX model verification successful!")
-        print(f"   Sample prediction: {pred_onx[0]}")
+        graph.initializer.extend([
+            numpy_helper.from_array(mean, 'normalization_mean'),
+            numpy_helper.from_array(denominator, 'normalization_denominator'),
+            numpy_helper.from_array(zero_std, 'normalization_zero_std'),
+            numpy_helper.from_array(np.zeros((1, 1), dtype=np.float64), 'normalization_zero')
+        ])
+        scaling_nodes = [
+            helper.make_node('Sub', [raw_input, 'normalization_mean'], ['normalization_centered']),
+            helper.make_node('Div', ['normalization_centered', 'normalization_denominator'], ['normalization_scaled']),
+            helper.make_node('Where', ['normalization_zero_std', 'normalization_zero', 'normalization_scaled'],
+                             ['normalization_output']),
+            helper.make_node('Cast', ['normalization_output'], [normalized_input], to=onnx.TensorProto.FLOAT)
+        ]
+        nodes = scaling_nodes + list(graph.node)
+        del graph.node[:]
+        graph.node.extend(nodes)
+        
+        helper.set_model_props(model, {NORMALIZATION_METADATA_KEY: 'true'})
+        onnx.checker.check_model(model)
+        onnx.save(model, onnx_path)
+        print(f"✅ Normalization embedded in ONNX model: {onnx_path}")
         return True
         
     except ImportError:
+        print("❌ ERROR: onnx not installed. Install with: pip install onnx")
+        return False
+    except Exception as e:
+        print(f"❌ ERROR: Embedding normalization failed: {str(e)}")
+        return False
+
+def verify_onnx_model(onnx_path, X_test_sample, expected_proba=None, classes=None):
+    """
+    Verify the ONNX model makes the same predictions as the trained model
+
+    Args:
+        X_test_sample: Test rows as the ONNX model takes them (raw features when the
+                       normalization is embedded, normalized features otherwise).
+        expected_proba: The trained model's predict_proba on the same rows, normalized.
+                        Without it only the first row is run.
+        classes: The trained model's classes_, the columns of expected_proba.
+
+    Returns:
+        True if every predicted stage matches, False on a mismatch or error,
+        None when onnxruntime is not installed.
+    """
+    if not ONNXRUNTIME_AVAILABLE:
         print("⚠️  WARNING: onnxruntime not installed. Skipping verification.")
         print("   Install with: pip install onnxruntime")
-        return False
+        return None
+    try:
+        # Load ONNX model with the session settings the batch scorer uses
+        sess = create_preset_session(onnx_path, 'batch')
+        input_name = sess.get_inputs()[0].name
+        
+        if expected_proba is None:
+            # Make prediction with first sample
+            test_input = X_test_sample[:1].astype(onnx_input_dtype(sess))
+            pred_onx = sess.run([sess.get_outputs()[0].name], {input_name: test_input})[0]
+            print(f"✅ ONNX model verification successful!")
+            print(f"   Sample prediction: {pred_onx[0]}")
+            return True
+        
+        test_input = np.asarray(X_test_sample, dtype=onnx_input_dtype(sess))
+        probabilities = sess.run([sess.get_outputs()[1].name], {input_name: test_input})[0]
+        onnx_proba = probabilities_from_onnx(probabilities)
+        if isinstance(probabilities, list):
+            onnx_proba = onnx_proba[:, np.asarray(classes, dtype=np.intp)]  # ZipMap rows hold every stage
+        mismatches = int(np.sum(np.argmax(onnx_proba, axis=1) != np.argmax(expected_proba, axis=1)))
+        max_difference = float(np.max(np.abs(onnx_proba - expected_proba)))
+        
+        if mismatches:
+            print(f"❌ ERROR: ONNX model predicts a different stage on {mismatches} of {len(test_input)} test rows "
+                  f"(max probability difference {max_difference:.2e})")
+            return False
+        print(f"✅ ONNX model verification successful: same stage on all {len(test_input)} test rows "
+              f"(max probability difference {max_difference:.2e})")
+        return True
+        
     except Exception as e:
         print(f"❌ ERROR: ONNX verification failed: {str(e)}")
         return False
 
-def train_live_model(train_folder: str, test_folder: str, model_name: str, model_save_path: str):
+def train_live_model(train_folder, test_folder, model_name: str, model_save_path: str,
+                     n_workers: int = 1, cache_dir: str = None, streaming: bool = False, zipmap: bool = True,
+                     embed_normalization: bool = False):
     """
     Train model with live-compatible features and convert to ONNX
+    (zipmap=False exports tensor probabilities, see convert_lightgbm_to_onnx;
+    embed_normalization=True exports a model that takes raw features, see embed_normalization_in_onnx)
     """
-    # 1. Load and process data with live simulation
-    print("Processing training data with live simulation...")
-    train_df = load_and_process_live_data(train_folder)
+    cache = SubjectCache(cache_dir) if cache_dir else None
     
-    print("Processing test data with live simulation...")
-    test_df = load_and_process_live_data(test_folder)
+    if streaming:
+        # 1-3. Stream subjects into float32 matrices, normalized with the training stats
+        print("Streaming training and test data with live simulation...")
+        train_data, test_data, mean_stats, std_stats = load_normalized_datasets(
+            train_folder, test_folder, process_subject_live_simulation_batch, n_workers, cache,
+            raw_test_rows=VERIFY_ROWS)
+        features_to_normalize = train_data.features
+        X_train_normalized, y_train = train_data.as_frame(), train_data.y
+        X_test_normalized, y_test = test_data.as_frame(), test_data.y
+        # The first test rows before normalization, for checking an embedded-normalization export
+        X_test_raw = pd.DataFrame(test_data.raw_sample, columns=features_to_normalize)
+        
+        print(f"\nTraining data shape: {X_train_normalized.shape}")
+        print(f"Testing data shape: {X_test_normalized.shape}")
+    else:
+        # 1. Load and process data with live simulation
+        print("Processing training data with live simulation...")
+        train_df = load_and_process_live_data(train_folder, n_workers=n_workers, cache_dir=cache_dir)
+    
+        print("Processing test data with live simulation...")
+        test_df = load_and_process_live_data(test_folder, n_workers=n_workers, cache_dir=cache_dir)
 
-    # 2. Separate features and target
-    X_train = train_df.drop('sleep_stage', axis=1)
-    y_train = train_df['sleep_stage']
-    X_test = test_df.drop('sleep_stage', axis=1)
-    y_test = test_df['sleep_stage']
+        # 2. Separate features and target
+        X_train = train_df.drop('sleep_stage', axis=1)
+        y_train = train_df['sleep_stage']
+        X_test = test_df.drop('sleep_stage', axis=1)
+        y_test = test_df['sleep_stage']
     
-    print(f"\nTraining data shape: {X_train.shape}")
-    print(f"Testing data shape: {X_test.shape}")
-    print(f"Features: {list(X_train.columns)}")
+        print(f"\nTraining data shape: {X_train.shape}")
+        print(f"Testing data shape: {X_test.shape}")
+        print(f"Features: {list(X_train.columns)}")
     
-    # 3. Calculate normalization stats
-    features_to_normalize = [col for col in X_train.columns if 'sleep_stage' not in col]
-    mean_stats = X_train[features_to_normalize].mean()
-    std_stats = X_train[features_to_normalize].std()
+        # 3. Calculate normalization stats
+        features_to_normalize = [col for col in X_train.columns if 'sleep_stage' not in col]
+        mean_stats = X_train[features_to_normalize].mean()
+        std_stats = X_train[features_to_normalize].std()
     
-    zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
-    if zero_std_cols:
-        print(f"Warning: Zero std features: {zero_std_cols}")
+        zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
+        if zero_std_cols:
+            print(f"Warning: Zero std features: {zero_std_cols}")
     
-    # Normalize
-    X_train_normalized = (X_train[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
-    X_test_normalized = (X_test[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
+        # Normalize
+        X_train_normalized = (X_train[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
+        X_test_normalized = (X_test[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
     
-    if zero_std_cols:
-        X_train_normalized[zero_std_cols] = 0
-        X_test_normalized[zero_std_cols] = 0
+        if zero_std_cols:
+            X_train_normalized[zero_std_cols] = 0
+            X_test_normalized[zero_std_cols] = 0
+        X_test_raw = X_test[features_to_normalize]
     
     # 4. Calculate sample weights
     sample_weights = compute_sample_weight(class_weight='balanced', y=y_train)
@@ -140,12 +261,19 @@ def train_live_model(train_folder: str, test_folder: str, model_name: str, model
     onnx_path = model_save_path.replace('.pkl', '.onnx')
     num_features = X_train_normalized.shape[1]
     
-    onnx_success = convert_lightgbm_to_onnx(model, num_features, onnx_path)
+    onnx_success = convert_lightgbm_to_onnx(model, num_features, onnx_path, zipmap)
+    if onnx_success and embed_normalization:
+        onnx_success = embed_normalization_in_onnx(onnx_path, features_to_normalize, mean_stats, std_stats)
     
     # 7. Verify ONNX model
     if onnx_success:
         print("\nVerifying ONNX model...")
-        verify_onnx_model(onnx_path, X_test_normalized.values)
+        # Compare with the trained model on the first test rows; a model with embedded normalization takes raw features
+        num_verify = min(VERIFY_ROWS, len(X_test_raw))
+        X_verify = X_test_raw if embed_normalization else X_test_normalized
+        expected_proba = model.predict_proba(X_test_normalized.iloc[:num_verify])
+        if verify_onnx_model(onnx_path, X_verify.values[:num_verify], expected_proba, model.classes_) is False:
+            onnx_success = False
     
     # 8. Save normalization stats as JSON for Android
     stats_path = model_save_path.replace('.pkl', '_stats.json')
@@ -208,6 +336,8 @@ def train_live_model(train_folder: str, test_folder: str, model_name: str, model
         print(f"✅ ONNX Model: {onnx_path}")
         print(f"✅ Stats File: {stats_path}")
         print(f"✅ Number of input features: {num_features}")
+        if embed_normalization:
+            print("⚠️  The model normalizes its own input: feed raw float64 features and skip FeatureNormalizer")
         print(f"✅ Model is ready for Android integration!")
         print("\nAdd to your Android app:")
         print("  implementation 'com.microsoft.onnxruntime:onnxruntime-android:latest.release'")
@@ -222,4 +352,12 @@ if __name__ == '__main__':
     MODEL_NAME = 'lightgbm'
     MODEL_SAVE_PATH = f'./{MODEL_NAME}_live_model3.pkl'
     
-    train_live_model(TRAIN_FOLDER, TEST_FOLDER, MODEL_NAME, MODEL_SAVE_PATH)
\ No newline at end of file
+    N_WORKERS = os.cpu_count()
+    CACHE_DIR = './processed_cache'
+    # The Android sleepclassifier module reads ZipMap output; the Python apps and scorers read either
+    ZIPMAP = True
+    # The Android apps normalize features themselves, so only embed for the Python consumers
+    EMBED_NORMALIZATION = False
+    
+    train_live_model(TRAIN_FOLDER, TEST_FOLDER, MODEL_NAME, MODEL_SAVE_PATH, N_WORKERS, CACHE_DIR,
+                     zipmap=ZIPMAP, embed_normalization=EMBED_NORMALIZATION)
\ No newline at end of file
@@ -7,65 +7,80 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
 
-from processing_pipeline import process_subject_live_simulation
+from processing_pipeline import process_subject_live_simulation, process_subject_live_simulation_batch
+from processing_pipeline import process_csv_folder
 from model_definitions import get_model
+from subject_cache import SubjectCache
+from dataset_builder import load_normalized_datasets
 
-def load_and_process_live_data(folder_path: str) -> pd.DataFrame:
+def load_and_process_live_data(folder_path, batch_mode: bool = True, n_workers: int = 1,
+                               cache_dir: str = None) -> pd.DataFrame:
     """
-    Loads all CSVs and processes them with live simulation
+    Loads all CSVs (from a folder or a list of recording paths) and processes them with live simulation.
+    With batch_mode the vectorized simulation is used (same output, much faster).
+    With n_workers > 1 the subjects are processed in parallel worker processes,
+    and with a cache_dir unchanged subjects are read back from the cache.
     """
-    processed_dfs = []
-    all_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
-    print(f"Found {len(all_files)} files to process in {folder_path}...")
-    
-    for filename in all_files:
-        file_path = os.path.join(folder_path, filename)
-        raw_df = pd.read_csv(file_path)
-        print(f"  - Processing {filename} with live simulation...")
-        processed_df = process_subject_live_simulation(raw_df)
-        processed_dfs.append(processed_df)
+    process_fn = process_subject_live_simulation_batch if batch_mode else process_subject_live_simulation
+    cache = SubjectCache(cache_dir) if cache_dir else None
+    processed_dfs = process_csv_folder(folder_path, process_fn, n_workers, cache)
         
     print("Concatenating all processed subjects...")
     final_dataset = pd.concat(processed_dfs, ignore_index=True)
     return final_dataset
 
-def train_live_model(train_folder: str, test_folder: str, model_name: str, model_save_path: str):
+def train_live_model(train_folder, test_folder, model_name: str, model_save_path: str,
+                     n_workers: int = 1, cache_dir: str = None, streaming: bool = False):
     """
     Train model with live-compatible features
     """
-    # 1. Load and process data with live simulation
-    print("Processing training data with live simulation...")
-    train_df = load_and_process_live_data(train_folder)
-    
-    print("Processing test data with live simulation...")
-    test_df = load_and_process_live_data(test_folder)
+    cache = SubjectCache(cache_dir) if cache_dir else None
+    
+    if streaming:
+        # 1-3. Stream subjects into float32 matrices, normalized with the training stats
+        print("Streaming training and test data with live simulation...")
+        train_data, test_data, mean_stats, std_stats = load_normalized_datasets(
+            train_folder, test_folder, process_subject_live_simulation_batch, n_workers, cache)
+        features_to_normalize = train_data.features
+        X_train_normalized, y_train = train_data.as_frame(), train_data.y
+        X_test_normalized, y_test = test_data.as_frame(), test_data.y
+        
+        print(f"\nTraining data shape: {X_train_normalized.shape}")
+        print(f"Testing data shape: {X_test_normalized.shape}")
+    else:
+        # 1. Load and process data with live simulation
+        print("Processing training data with live simulation...")
+        train_df = load_and_process_live_data(train_folder, n_workers=n_workers, cache_dir=cache_dir)
+    
+        print("Processing test data with live simulation...")
+        test_df = load_and_process_live_data(test_folder, n_workers=n_workers, cache_dir=cache_dir)
 
-    # 2. Separate features and target
-    X_train = train_df.drop('sleep_stage', axis=1)
-    y_train = train_df['sleep_stage']
-    X_test = test_df.drop('sleep_stage', axis=1)
-    y_test = test_df['sleep_stage']
+        # 2. Separate features and target
+        X_train = train_df.drop('sleep_stage', axis=1)
+        y_train = train_df['sleep_stage']
+        X_test = test_df.drop('sleep_stage', axis=1)
+        y_test = test_df['sleep_stage']
     
-    print(f"\nTraining data shape: {X_train.shape}")
-    print(f"Testing data shape: {X_test.shape}")
-    print(f"Features: {list(X_train.columns)}")
+        print(f"\nTraining data shape: {X_train.shape}")
+        print(f"Testing data shape: {X_test.shape}")
+        print(f"Features: {list(X_train.columns)}")
     
-    # 3. Calculate normalization stats
-    features_to_normalize = [col for col in X_train.columns if 'sleep_stage' not in col]
-    mean_stats = X_train[features_to_normalize].mean()
-    std_stats = X_train[features_to_normalize].std()
+        # 3. Calculate normalization stats
+        features_to_normalize = [col for col in X_train.columns if 'sleep_stage' not in col]
+        mean_stats = X_train[features_to_normalize].mean()
+        std_stats = X_train[features_to_normalize].std()
     
-    zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
-    if zero_std_cols:
-        print(f"Warning: Zero std features: {zero_std_cols}")
+        zero_std_cols = std_stats[std_stats < 1e-6].index.tolist()
+        if zero_std_cols:
+            print(f"Warning: Zero std features: {zero_std_cols}")
     
-    # Normalize
-    X_train_normalized = (X_train[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
-    X_test_normalized = (X_test[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
+        # Normalize
+        X_train_normalized = (X_train[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
+        X_test_normalized = (X_test[features_to_normalize] - mean_stats) / (std_stats + 1e-6)
     
-    if zero_std_cols:
-        X_train_normalized[zero_std_cols] = 0
-        X_test_normalized[zero_std_cols] = 0
+        if zero_std_cols:
+            X_train_normalized[zero_std_cols] = 0
+            X_test_normalized[zero_std_cols] = 0
     
     # 4. Calculate sample weights
     sample_weights = compute_sample_weight(class_weight='balanced', y=y_train)
@@ -119,4 +134,7 @@ if __name__ == '__main__':
     MODEL_NAME = 'lightgbm'
     MODEL_SAVE_PATH = f'./{MODEL_NAME}_live_model3.pkl'
     
-    train_live_model(TRAIN_FOLDER, TEST_FOLDER, MODEL_NAME, MODEL_SAVE_PATH)
\ No newline at end of file
+    N_WORKERS = os.cpu_count()
+    CACHE_DIR = './processed_cache'
+    
+    train_live_model(TRAIN_FOLDER, TEST_FOLDER, MODEL_NAME, MODEL_SAVE_PATH, N_WORKERS, CACHE_DIR)
\ No newline at end of file
@@ -0,0 +1,377 @@
+# In file: tree_compiler.py
+
+import json
+import numpy as np
+
+# How a compiled ensemble turns leaf values into probabilities
+AGGREGATION_MEAN = 'mean'        # Random forest: average of per-tree class distributions
+AGGREGATION_SOFTMAX = 'softmax'  # Boosting: per-class margins, then softmax
+
+# What a split does with a missing value (NaN), per node
+MISSING_DEFAULT = 0  # NaN follows the node's default direction
+MISSING_AS_ZERO = 1  # NaN is compared as 0.0 (LightGBM missing_type 'None')
+MISSING_ZERO = 2     # NaN and zero follow the default direction (LightGBM missing_type 'Zero')
+
+# LightGBM's kZeroThreshold
+LIGHTGBM_ZERO_THRESHOLD = 1e-35
+
+# Rows per evaluation chunk are chosen so a chunk visits about this many nodes at once;
+# small enough for the per-step index arrays to stay in cache
+NODES_PER_CHUNK = 1 << 18
+
+class CompiledEnsemble:
+    """
+    A trained tree ensemble flattened into NumPy arrays.
+
+    All trees share one set of node arrays. Leaves point to themselves, so every
+    tree of every row can be walked in lock step for max_depth steps without
+    branching; the node each walk ends on is the leaf. Only NumPy is needed to
+    load and evaluate it.
+
+    Splits reproduce the source library: sklearn and XGBoost compare float32
+    inputs (x <= t and x < t), LightGBM compares float64 inputs with x <= t and
+    its missing-value rules.
+
+    Args:
+        arrays (dict): The node and tree arrays, as produced by the compile_* functions.
+        settings (dict): aggregation, decision ('le' or 'lt'), input_dtype, classes, max_depth, ...
+    """
+    def __init__(self, arrays: dict, settings: dict):
+        self.feature = arrays['feature'].astype(np.intp)
+        self.threshold = arrays['threshold'].astype(np.float64)
+        self.left = arrays['left'].astype(np.intp)
+        self.right = arrays['right'].astype(np.intp)
+        self.default_left = arrays['default_left'].astype(bool)
+        self.missing_mode = arrays['missing_mode'].astype(np.int8)
+        self.leaf_value = arrays['leaf_value'].astype(np.float64)
+        self.roots = arrays['roots'].astype(np.intp)
+        self.tree_class = arrays['tree_class'].astype(np.intp)
+        self.base_margin = arrays['base_margin'].astype(np.float64)
+        self.settings = dict(settings)
+        self.aggregation = settings['aggregation']
+        self.decision = settings['decision']
+        self.input_dtype = np.dtype(settings['input_dtype'])
+        self.classes = [int(c) for c in settings['classes']]
+        self.max_depth = int(settings['max_depth'])
+        self.num_features = int(settings['num_features'])
+        self.margin_dtype = np.dtype(settings.get('margin_dtype', 'float64'))
+        self.zero_mode = bool(np.any(self.missing_mode == MISSING_ZERO))
+        # Children packed as [left, right] pairs: the next node is children[2 * node + goes_right]
+        self.children = np.stack([self.left, self.right], axis=1).ravel()
+
+        if self.aggregation == AGGREGATION_SOFTMAX:
+            # Margins are accumulated iteration by iteration, which needs one tree per class in turn
+            num_classes = len(self.classes)
+            if self.num_trees % num_classes or np.any(self.tree_class != np.arange(self.num_trees) % num_classes):
+                raise ValueError("Boosted trees must cycle through the classes in order")
+
+    @property
+    def num_trees(self) -> int:
+        return len(self.roots)
+
+    def arrays(self) -> dict:
+        return {
+            'feature': self.feature.astype(np.int32), 'threshold': self.threshold,
+            'left': self.left.astype(np.int32), 'right': self.right.astype(np.int32),
+            'default_left': self.default_left, 'missing_mode': self.missing_mode,
+            'leaf_value': self.leaf_value, 'roots': self.roots.astype(np.int32),
+            'tree_class': self.tree_class.astype(np.int32), 'base_margin': self.base_margin
+        }
+
+    def save(self, path: str, **extra_arrays) -> None:
+        """Writes the ensemble (and any extra arrays, e.g. normalization stats) to an .npz file"""
+        np.savez(path, settings=np.array(json.dumps(self.settings)), **self.arrays(), **extra_arrays)
+
+    @classmethod
+    def from_npz(cls, data) -> 'CompiledEnsemble':
+        """Rebuilds an ensemble from a loaded .npz archive"""
+        return cls(data, json.loads(str(data['settings'])))
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """Index of the leaf each row reaches in each tree, shape (n, num_trees)"""
+        X = self._prepare(X)
+        has_nan = np.isnan(X).any()
+        # Gathers on the flattened matrix with take() are much cheaper than 2-D fancy indexing
+        X_flat = X.ravel()
+        row_offsets = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), self.num_trees))
+
+        for _ in range(self.max_depth):
+            x = X_flat.take(row_offsets + self.feature.take(node))
+            threshold = self.threshold.take(node)
+            go_left = x <= threshold if self.decision == 'le' else x < threshold
+            if has_nan or self.zero_mode:
+                go_left = self._route_missing(x, node, threshold, go_left)
+            node = self.children.take(2 * node + ~go_left)
+        return node
+
+    def _prepare(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.num_features:
+            raise ValueError(f"Expected {self.num_features} features, got {X.shape[1]}")
+        # Round to the precision the library compares at, then compare in float64
+        return np.ascontiguousarray(X.astype(self.input_dtype, copy=False), dtype=np.float64)
+
+    def _route_missing(self, x, node, threshold, go_left):
+        mode = self.missing_mode[node]
+        nan = np.isnan(x)
+        missing = nan & (mode != MISSING_AS_ZERO)
+        if self.zero_mode:
+            missing |= (mode == MISSING_ZERO) & (np.abs(x) <= LIGHTGBM_ZERO_THRESHOLD)
+        as_zero = nan & (mode == MISSING_AS_ZERO)
+        if as_zero.any():
+            go_left = np.where(as_zero, 0.0 <= threshold if self.decision == 'le' else 0.0 < threshold, go_left)
+        return np.where(missing, self.default_left[node], go_left)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Class probabilities, shape (n, num_classes), columns in self.classes order"""
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X[None, :]
+        chunk = max(1, NODES_PER_CHUNK // max(1, self.num_trees))
+        if len(X) <= chunk:
+            return self._predict_chunk(X)
+        return np.concatenate([self._predict_chunk(X[start:start + chunk]) for start in range(0, len(X), chunk)])
+
+    def _predict_chunk(self, X: np.ndarray) -> np.ndarray:
+        leaves = self.leaves(X)
+        if self.aggregation == AGGREGATION_MEAN:
+            # leaf_value holds one class distribution per node
+            return self.leaf_value[leaves].sum(axis=1) / self.num_trees
+
+        # Sum the base margin and then the trees in order, at the library's precision;
+        # cumsum adds sequentially, so the rounding matches the library's own loop exactly
+        num_classes = len(self.classes)
+        values = self.leaf_value[leaves].astype(self.margin_dtype).reshape(len(X), -1, num_classes)
+        base = np.broadcast_to(self.base_margin.astype(self.margin_dtype), (len(X), 1, num_classes))
+        margins = np.cumsum(np.concatenate([base, values], axis=1), axis=1, dtype=self.margin_dtype)[:, -1, :]
+        if self.settings.get('average_output'):
+            margins /= values.shape[1]
+        margins -= margins.max(axis=1, keepdims=True)
+        np.exp(margins, out=margins)
+        margins /= margins.sum(axis=1, keepdims=True)
+        return margins.astype(np.float64)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predicted class labels"""
+        return np.asarray(self.classes)[np.argmax(self.predict_proba(X), axis=1)]
+
+def _finish_trees(trees: list, settings: dict, base_margin, leaf_width: int = 1) -> CompiledEnsemble:
+    """
+    Concatenates per-tree node lists into the shared arrays.
+    Each tree is a dict of equal-length lists/arrays with node-local child indices (-1 for leaves).
+    """
+    offsets = np.cumsum([0] + [len(tree['feature']) for tree in trees])
+    total = int(offsets[-1])
+    arrays = {
+        'feature': np.zeros(total, dtype=np.int32),
+        'threshold': np.zeros(total, dtype=np.float64),
+        'left': np.zeros(total, dtype=np.int32),
+        'right': np.zeros(total, dtype=np.int32),
+        'default_left': np.zeros(total, dtype=bool),
+        'missing_mode': np.zeros(total, dtype=np.int8),
+        'leaf_value': np.zeros((total, leaf_width) if leaf_width > 1 else total, dtype=np.float64),
+        'roots': offsets[:-1].astype(np.int32),
+        'tree_class': np.array([tree['class'] for tree in trees], dtype=np.int32),
+        'base_margin': np.asarray(base_margin, dtype=np.float64)
+    }
+    max_depth = 0
+    for tree, offset in zip(trees, offsets[:-1]):
+        nodes = slice(offset, offset + len(tree['feature']))
+        left = np.asarray(tree['left'])
+        right = np.asarray(tree['right'])
+        is_leaf = left < 0
+        own = np.arange(len(left)) + offset
+        arrays['feature'][nodes] = np.where(is_leaf, 0, tree['feature'])
+        arrays['threshold'][nodes] = tree['threshold']
+        arrays['left'][nodes] = np.where(is_leaf, own, left + offset)
+        arrays['right'][nodes] = np.where(is_leaf, own, right + offset)
+        arrays['default_left'][nodes] = tree['default_left']
+        arrays['missing_mode'][nodes] = tree.get('missing_mode', MISSING_DEFAULT)
+        arrays['leaf_value'][nodes] = tree['leaf_value']
+        max_depth = max(max_depth, _tree_depth(left, right))
+
+    settings = dict(settings, max_depth=max_depth)
+    return CompiledEnsemble(arrays, settings)
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    """Number of splits on the longest root-to-leaf path"""
+    depth = np.zeros(len(left), dtype=np.int64)
+    frontier = [0]
+    while frontier:
+        next_frontier = []
+        for i in frontier:
+            if left[i] >= 0:
+                depth[left[i]] = depth[right[i]] = depth[i] + 1
+                next_frontier.extend((left[i], right[i]))
+        frontier = next_frontier
+    return int(depth.max())
+
+def compile_random_forest(model) -> CompiledEnsemble:
+    """Compiles a fitted sklearn RandomForestClassifier"""
+    trees = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        # Per-node class distribution, what DecisionTreeClassifier.predict_proba returns at a leaf
+        value = tree.value[:, 0, :].astype(np.float64)
+        totals = value.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        missing_left = getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8))
+        trees.append({
+            'feature': tree.feature,
+            'threshold': tree.threshold,
+            'left': tree.children_left,
+            'right': tree.children_right,
+            'default_left': np.asarray(missing_left, dtype=bool),
+            'leaf_value': value / totals,
+            'class': 0
+        })
+    settings = {
+        'source': 'sklearn', 'aggregation': AGGREGATION_MEAN, 'decision': 'le', 'input_dtype': 'float32',
+        'classes': [int(c) for c in model.classes_], 'num_features': int(model.n_features_in_)
+    }
+    return _finish_trees(trees, settings, np.zeros(len(model.classes_)), leaf_width=len(model.classes_))
+
+def compile_xgboost(model) -> CompiledEnsemble:
+    """Compiles a fitted XGBClassifier (numerical splits, softmax/softprob objectives)"""
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw('json'))['learner']
+    objective = learner['objective']['name']
+    if objective not in ('multi:softmax', 'multi:softprob'):
+        raise ValueError(f"Unsupported XGBoost objective for compilation: {objective}")
+    gbtree = learner['gradient_booster']['model']
+    if int(gbtree['gbtree_model_param']['num_parallel_tree']) != 1:
+        raise ValueError("XGBoost models with num_parallel_tree > 1 are not supported")
+
+    trees = []
+    for tree, tree_class in zip(gbtree['trees'], gbtree['tree_info']):
+        if any(tree['split_type']):
+            raise ValueError("XGBoost models with categorical splits are not supported")
+        left = np.asarray(tree['left_children'])
+        # split_conditions holds the threshold of a split node and the value of a leaf
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32).astype(np.float64)
+        trees.append({
+            'feature': tree['split_indices'],
+            'threshold': conditions,
+            'left': left,
+            'right': tree['right_children'],
+            'default_left': np.asarray(tree['default_left'], dtype=bool),
+            'leaf_value': np.where(left < 0, conditions, 0.0),
+            'class': tree_class
+        })
+
+    num_class = int(learner['learner_model_param']['num_class'])
+    base_score = np.atleast_1d(np.asarray(json.loads(learner['learner_model_param']['base_score']), dtype=np.float32))
+    base_margin = np.broadcast_to(base_score.astype(np.float64), (num_class,))
+    settings = {
+        'source': 'xgboost', 'aggregation': AGGREGATION_SOFTMAX, 'decision': 'lt', 'input_dtype': 'float32',
+        'margin_dtype': 'float32',
+        'classes': [int(c) for c in model.classes_], 'num_features': int(learner['learner_model_param']['num_feature'])
+    }
+    return _finish_trees(trees, settings, base_margin)
+
+def compile_lightgbm(model) -> CompiledEnsemble:
+    """Compiles a fitted LGBMClassifier (numerical splits, multiclass objective)"""
+    dump = model.booster_.dump_model()
+    num_class = int(dump['num_tree_per_iteration'])
+    if num_class < 2:
+        raise ValueError("Only multiclass LightGBM models are supported")
+    missing_modes = {'None': MISSING_AS_ZERO, 'Zero': MISSING_ZERO, 'NaN': MISSING_DEFAULT}
+
+    trees = []
+    for tree_info in dump['tree_info']:
+        nodes = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'default_left': [],
+                 'missing_mode': [], 'leaf_value': [], 'class': tree_info['tree_index'] % num_class}
+
+        def add(node) -> int:
+            index = len(nodes['feature'])
+            for key in ('feature', 'threshold', 'left', 'right', 'default_left', 'missing_mode', 'leaf_value'):
+                nodes[key].append(0)
+            if 'leaf_value' in node or 'split_index' not in node:
+                nodes['left'][index] = nodes['right'][index] = -1
+                nodes['leaf_value'][index] = node.get('leaf_value', 0.0)
+                return index
+            if node['decision_type'] != '<=':
+                raise ValueError("LightGBM models with categorical splits are not supported")
+            nodes['feature'][index] = node['split_feature']
+            nodes['threshold'][index] = node['threshold']
+            nodes['default_left'][index] = node['default_left']
+            nodes['missing_mode'][index] = missing_modes[node['missing_type']]
+            nodes['left'][index] = add(node['left_child'])
+            nodes['right'][index] = add(node['right_child'])
+            return index
+
+        add(tree_info['tree_structure'])
+        trees.append(nodes)
+
+    settings = {
+        'source': 'lightgbm', 'aggregation': AGGREGATION_SOFTMAX, 'decision': 'le', 'input_dtype': 'float64',
+        'classes': [int(c) for c in model.classes_], 'num_features': int(dump['max_feature_idx']) + 1,
+        'average_output': bool(dump.get('average_output', False))
+    }
+    return _finish_trees(trees, settings, np.zeros(num_class))
+
+def compile_model(model) -> CompiledEnsemble:
+    """
+    Compiles any classifier returned by model_definitions.get_model after fitting.
+    The model type is recognised by its attributes, so the libraries are not imported here.
+    """
+    if hasattr(model, 'get_booster'):
+        return compile_xgboost(model)
+    if hasattr(model, 'booster_'):
+        return compile_lightgbm(model)
+    if hasattr(model, 'estimators_') and hasattr(model.estimators_[0], 'tree_'):
+        return compile_random_forest(model)
+    raise ValueError(f"Don't know how to compile a {type(model).__name__}")
+
+def compile_model_bundle(model_path: str, output_path: str = None) -> str:
+    """
+    Compiles a trainer .pkl bundle into an .npz file holding the trees and the
+    normalization stats, loadable with model_backends.load_backend.
+
+    Args:
+        model_path (str): The .pkl bundle ({'model': ..., 'normalization_stats': ...}).
+        output_path (str): Defaults to the bundle path with a .npz extension.
+
+    Returns:
+        The path of the .npz file.
+    """
+    import pickle
+    from model_backends import NormalizationStats
+
+    with open(model_path, 'rb') as f:
+        bundle = pickle.load(f)
+    ensemble = compile_model(bundle['model'])
+    stats = NormalizationStats.from_bundle(bundle['normalization_stats'])
+    if output_path is None:
+        output_path = model_path[:-len('.pkl')] + '.npz' if model_path.endswith('.pkl') else model_path + '.npz'
+
+    ensemble.save(output_path, stats_features=np.array(stats.features, dtype=str),
+                  stats_mean=stats.mean, stats_std=stats.std)
+    print(f"✅ Compiled {ensemble.num_trees} trees ({len(ensemble.feature)} nodes) to: {output_path}")
+    return output_path
+
+def check_parity(model, ensemble: CompiledEnsemble, X: np.ndarray) -> dict:
+    """
+    Compares a compiled ensemble with the model it came from.
+
+    Returns:
+        max_abs_diff of the probabilities and the fraction of rows with the same prediction.
+    """
+    import pandas as pd
+
+    feature_names = getattr(model, 'feature_names_in_', None)
+    X_model = pd.DataFrame(X, columns=feature_names) if feature_names is not None else X
+    expected = model.predict_proba(X_model)
+    actual = ensemble.predict_proba(X)
+    return {
+        'max_abs_diff': float(np.max(np.abs(expected - actual))),
+        'prediction_agreement': float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+    }
+
+if __name__ == '__main__':
+    MODEL_PATH = './xgboost_sleep_model7.pkl'  # Any .pkl bundle written by the trainers
+
+    compile_model_bundle(MODEL_PATH)